@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+
+from rate_limiter import limited_read
+
+
+class AccountState:
+    """Latest balance and positions, written by the exchange loop and read from any thread.
+
+    Readers get copies from snapshot(), so the UI and the strategy can read
+    account figures without waiting on the network.
+    """
+
+    def __init__(self, currency='USD', on_change=None):
+        self.currency = currency
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._balance = None
+        self._positions = {}  # (symbol, side) -> position
+        self._updated_at = None
+        self._source = None
+
+    def reset(self):
+        with self._lock:
+            self._balance = None
+            self._positions = {}
+            self._updated_at = None
+            self._source = None
+
+    def apply_balance(self, balance, source='stream'):
+        """Store the total of the settlement currency from a ccxt balance structure"""
+        total = float((balance.get(self.currency) or {}).get('total') or 0)
+        with self._lock:
+            changed = total != self._balance
+            self._balance = total
+            self._touch(source)
+        if changed:
+            self._changed()
+
+    def apply_positions(self, positions, source='stream', symbols=None):
+        """Merge position updates; with symbols, replace everything held on those symbols"""
+        with self._lock:
+            before = dict(self._positions)
+            if symbols is not None:
+                for key in [key for key in self._positions if key[0] in symbols]:
+                    del self._positions[key]
+            for position in positions:
+                key = (position['symbol'], position.get('side'))
+                if float(position.get('contracts') or 0) > 0:
+                    self._positions[key] = {
+                        'symbol': position['symbol'],
+                        'side': position.get('side'),
+                        'contracts': float(position['contracts']),
+                        'notional': abs(float(position.get('notional') or 0)),
+                        'entry_price': float(position.get('entryPrice') or 0) or None,
+                        'unrealized_pnl': float(position.get('unrealizedPnl') or 0)
+                    }
+                else:
+                    self._positions.pop(key, None)
+            changed = before != self._positions
+            self._touch(source)
+        if changed:
+            self._changed()
+
+    def _touch(self, source):
+        self._updated_at = time.time()
+        self._source = source
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(self.snapshot())
+
+    def snapshot(self):
+        """Copy of the account figures, or None before the first update"""
+        with self._lock:
+            if self._balance is None:
+                return None
+            positions = [dict(position) for position in self._positions.values()]
+            return {
+                'balance': self._balance,
+                'positions_value': sum(p['notional'] for p in positions),
+                'unrealized_pnl': sum(p['unrealized_pnl'] for p in positions),
+                'positions': positions,
+                'updated_at': self._updated_at,
+                'source': self._source
+            }
+
+
+class AccountSync:
+    """Keep an AccountState current from balance/position streams.
+
+    REST reconciliation runs every reconcile_interval seconds as a safety
+    net, and every fallback_interval seconds unless both streams are up.
+    on_reconcile gets the snapshot of every reconciliation.
+    """
+
+    def __init__(self, exchange, state, symbols=(), reconcile_interval=60, fallback_interval=10,
+                 log=None, limiter=None, on_reconcile=None):
+        self.exchange = exchange
+        self.state = state
+        self.symbols = set(symbols)
+        self.reconcile_interval = reconcile_interval
+        self.fallback_interval = fallback_interval
+        self.log = log or print
+        self.limiter = limiter
+        self.on_reconcile = on_reconcile
+        self.streaming = {}  # stream name -> True while it is delivering updates
+        self._wake = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        has = getattr(self.exchange, 'has', None) or {}
+        self._tasks = [asyncio.ensure_future(self._reconcile_loop())]
+        if has.get('watchBalance'):
+            self._tasks.append(asyncio.ensure_future(self._stream('balance', self._watch_balance)))
+        if has.get('watchPositions'):
+            self._tasks.append(asyncio.ensure_future(self._stream('positions', self._watch_positions)))
+        return self
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def add_symbols(self, symbols):
+        """Track more symbols; new ones are reconciled straight away"""
+        new = set(symbols) - self.symbols
+        if new:
+            self.symbols |= new
+            self._wake.set()
+
+    async def reconcile(self):
+        """Fetch balance and positions over REST and overwrite the cache"""
+        symbols = sorted(self.symbols)
+        fetch_balance = limited_read(self.limiter, ('fetch_balance',), self.exchange.fetch_balance)
+        if symbols:
+            balance, positions = await asyncio.gather(fetch_balance, limited_read(
+                self.limiter, ('fetch_positions', tuple(symbols)),
+                lambda: self.exchange.fetch_positions(symbols)))
+            self.state.apply_positions(positions, source='rest', symbols=set(symbols))
+        else:
+            balance = await fetch_balance
+        self.state.apply_balance(balance, source='rest')
+        snapshot = self.state.snapshot()
+        if self.on_reconcile:
+            self.on_reconcile(snapshot)
+        return snapshot
+
+    def _interval(self):
+        healthy = self.streaming.get('balance') and self.streaming.get('positions')
+        return self.reconcile_interval if healthy else self.fallback_interval
+
+    async def _reconcile_loop(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"Error reconciling account state: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._interval())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _stream(self, name, watch):
+        self.streaming[name] = False
+        delay = 1
+        while True:
+            try:
+                await watch()
+                self.streaming[name] = True
+                delay = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # REST reconciliation speeds up while the stream is down
+                self.streaming[name] = False
+                self.log(f"Account {name} stream error: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _watch_balance(self):
+        self.state.apply_balance(await self.exchange.watch_balance())
+
+    async def _watch_positions(self):
+        self.state.apply_positions(await self.exchange.watch_positions(sorted(self.symbols) or None))
@@ -0,0 +1,275 @@
+"""Vectorized grid backtests over historical OHLCV candles.
+
+    python -m backtest --csv btc_1m.csv --lower 60000 --upper 70000 --grids 20
+    python -m backtest --symbol BTC/USD:USD --timeframe 1m --lower 60000 --upper 70000
+"""
+import argparse
+
+import numpy as np
+
+from grid_core import EXCHANGE_CONFIGS, parse_grid_params
+from grid_generators import SPACINGS, generate_grid
+
+# Maintenance margin rate used for the liquidation check
+DEFAULT_MAINTENANCE_MARGIN = 0.005
+
+# Compressed ticks simulated per chunk; bounds the (ticks, levels) working arrays
+CHUNK_TICKS = 1 << 16
+
+
+def load_ohlcv(data):
+    """Return (timestamps, open, high, low, close) float arrays.
+
+    Accepts ccxt fetch_ohlcv rows, an (N, 5+) array or a DataFrame with
+    timestamp/open/high/low/close columns.
+    """
+    if hasattr(data, 'columns'):
+        columns = ['timestamp', 'open', 'high', 'low', 'close']
+        array = data[columns].to_numpy(dtype=np.float64)
+    else:
+        array = np.asarray(data, dtype=np.float64)
+    if array.ndim != 2 or array.shape[1] < 5:
+        raise ValueError("OHLCV data must have timestamp, open, high, low and close columns")
+    return array[:, 0], array[:, 1], array[:, 2], array[:, 3], array[:, 4]
+
+
+def candle_path(open_, high, low, close):
+    """Expand candles into two ticks each: low then high for up candles, high then low otherwise"""
+    up = close >= open_
+    ticks = np.empty(len(open_) * 2, dtype=np.float64)
+    ticks[0::2] = np.where(up, low, high)
+    ticks[1::2] = np.where(up, high, low)
+    return ticks
+
+
+def ffill_state(signal, initial):
+    """Carry the last non-zero signal forward per column, starting from initial"""
+    rows = np.arange(signal.shape[0], dtype=np.int32)[:, None]
+    index = np.where(signal != 0, rows, np.int32(-1))
+    np.maximum.accumulate(index, axis=0, out=index)
+    state = np.take_along_axis(signal, np.maximum(index, 0), axis=0)
+    return np.where(index < 0, initial[None, :], state)
+
+
+def compress_ticks(ticks, thresholds):
+    """Indices of ticks whose position relative to the grid prices changed.
+
+    Fill decisions only depend on which side of each grid price a tick is on
+    (or exactly at it), so runs of ticks in the same bucket can be collapsed.
+    """
+    thresholds = np.unique(thresholds)
+    bucket = (np.searchsorted(thresholds, ticks, side='left')
+              + np.searchsorted(thresholds, ticks, side='right'))
+    changed = np.empty(len(ticks), dtype=bool)
+    changed[0] = True
+    np.not_equal(bucket[1:], bucket[:-1], out=changed[1:])
+    return np.flatnonzero(changed), np.cumsum(changed) - 1
+
+
+def grid_arrays(params, closes=None):
+    """Entry prices, exit prices and sizes of the grid as arrays"""
+    ladder = generate_grid(params, closes)
+    return ladder['prices'], ladder['exits'], ladder['sizes']
+
+
+def simulate_levels(prices, entry, exit_, state, long):
+    """Per-level fills over a tick sequence.
+
+    Returns the state after each tick plus entry and exit fill flags, all of
+    shape (ticks, levels). State is 1 while a level holds a position, -1
+    while its entry order rests.
+    """
+    column = prices[:, None]
+    if long:
+        signal = (column <= entry).view(np.int8) - (column >= exit_).view(np.int8)
+    else:
+        signal = (column >= entry).view(np.int8) - (column <= exit_).view(np.int8)
+    held = ffill_state(signal, state)
+
+    previous = np.empty_like(held)
+    previous[0] = state
+    previous[1:] = held[:-1]
+    entries = (held == 1) & (previous == -1)
+    exits = (held == -1) & (previous == 1)
+    return held, entries, exits
+
+
+def backtest_grid(ohlcv, params, exchange='Phemex', maintenance_margin=DEFAULT_MAINTENANCE_MARGIN,
+                  keep_equity=False, ticks=None):
+    """Replay candles through a grid and return its performance.
+
+    Each level buys (Long) or sells (Short) at its price and closes one grid
+    step away, re-arming after every round trip. Levels already through the
+    opening price fill immediately as taker. The whole investment is the
+    margin; the run stops at the first tick where equity falls to the
+    maintenance margin of the open notional. Callers backtesting many
+    parameter sets over the same candles can pass the precomputed
+    candle_path() as ticks.
+    """
+    timestamps, open_, high, low, close = load_ohlcv(ohlcv)
+    if len(close) == 0:
+        raise ValueError("No candles to backtest")
+
+    fees = EXCHANGE_CONFIGS[exchange]
+    maker_fee, taker_fee = fees['maker_fee'], fees['taker_fee']
+    long = params['direction'] == 'Long'
+    sign = 1.0 if long else -1.0
+    margin = float(params['investment'])
+
+    # Volatility spacing is weighted by the replayed candles themselves, i.e. in-sample
+    entry, exit_, size = grid_arrays(params, close)
+    cost = size * entry
+    trip_pnl = sign * size * (exit_ - entry) - maker_fee * size * exit_
+    entry_fee = maker_fee * cost
+    exit_fee = maker_fee * size * exit_
+
+    # Levels on the wrong side of the opening price are taken immediately
+    first = open_[0]
+    crossed = entry >= first if long else entry <= first
+    state = np.where(crossed, 1, -1).astype(np.int8)
+    opening_fees = float(np.sum(taker_fee * size[crossed] * first))
+    opening_realized = float(np.sum(sign * size[crossed] * (entry[crossed] - first))) - opening_fees
+
+    if ticks is None:
+        ticks = candle_path(open_, high, low, close)
+    kept, segment = compress_ticks(ticks, np.concatenate([entry, exit_]))
+    kept_prices = ticks[kept]
+
+    # Per compressed tick: open size, open cost and cumulative realized PnL, fills, trips, fees
+    held_size = np.empty(len(kept))
+    held_cost = np.empty(len(kept))
+    realized = np.empty(len(kept))
+    fills = np.empty(len(kept), dtype=np.int64)
+    trips = np.empty(len(kept), dtype=np.int64)
+    fees_paid = np.empty(len(kept))
+    carry = [opening_realized, int(crossed.sum()), 0, opening_fees]
+
+    for start in range(0, len(kept), CHUNK_TICKS):
+        chunk = slice(start, start + CHUNK_TICKS)
+        held, entries, exits = simulate_levels(kept_prices[chunk], entry, exit_, state, long)
+        holding = held == 1
+        entries_f = entries.astype(np.float64)
+        exits_f = exits.astype(np.float64)
+
+        held_size[chunk] = holding @ size
+        held_cost[chunk] = holding @ cost
+        realized[chunk] = carry[0] + np.cumsum(exits_f @ trip_pnl - entries_f @ entry_fee)
+        fills[chunk] = carry[1] + np.cumsum(entries.sum(axis=1) + exits.sum(axis=1))
+        trips[chunk] = carry[2] + np.cumsum(exits.sum(axis=1))
+        fees_paid[chunk] = carry[3] + np.cumsum(entries_f @ entry_fee + exits_f @ exit_fee)
+
+        last = min(start + CHUNK_TICKS, len(kept)) - 1
+        carry = [realized[last], fills[last], trips[last], fees_paid[last]]
+        state = held[-1].copy()
+
+    # Expand back to every tick; positions only change on kept ticks
+    tick_size = held_size[segment]
+    tick_equity = margin + realized[segment] + sign * (tick_size * ticks - held_cost[segment])
+
+    # Liquidation: equity at or below maintenance margin of the open notional
+    breach = tick_equity <= maintenance_margin * tick_size * ticks
+    liquidated_at = int(np.argmax(breach)) if breach.any() else None
+
+    # Mark each candle's equity at its close with the holdings after the candle
+    candle_segment = segment[1::2]
+    equity = margin + realized[candle_segment] + sign * (
+        held_size[candle_segment] * close - held_cost[candle_segment])
+
+    if liquidated_at is None:
+        end = candle_segment[-1]
+        realized_pnl = float(realized[end])
+        unrealized = float(equity[-1] - margin - realized_pnl)
+        final_equity = float(equity[-1])
+    else:
+        end = segment[liquidated_at]
+        equity[liquidated_at // 2:] = 0.0
+        realized_pnl = -margin
+        unrealized = 0.0
+        final_equity = 0.0
+
+    peak = np.maximum.accumulate(equity)
+    drawdown = peak - equity
+    max_drawdown = float(drawdown.max())
+    max_drawdown_pct = float((drawdown / np.where(peak > 0, peak, 1)).max() * 100)
+
+    result = {
+        'net_pnl': final_equity - margin,
+        'realized_pnl': realized_pnl,
+        'unrealized_pnl': unrealized,
+        'fees': float(fees_paid[end]),
+        'fills': int(fills[end]),
+        'round_trips': int(trips[end]),
+        'max_drawdown': max_drawdown,
+        'max_drawdown_pct': max_drawdown_pct,
+        'final_equity': final_equity,
+        'return_pct': (final_equity - margin) / margin * 100,
+        'liquidated': liquidated_at is not None,
+        'liquidation_time': float(timestamps[liquidated_at // 2]) if liquidated_at is not None else None
+    }
+    if keep_equity:
+        result['equity'] = equity
+    return result
+
+
+def add_candle_arguments(parser):
+    """Candle source options shared by the backtest and optimizer CLIs"""
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--csv', help="CSV with timestamp,open,high,low,close columns")
+    source.add_argument('--symbol', help="Symbol synced into the local store with market_data")
+    parser.add_argument('--timeframe', default='1m', help="Candle timeframe in the local store")
+    parser.add_argument('--data-dir', default='data', help="Local market data store directory")
+
+
+def load_candles(args):
+    """Candles for the parsed CLI arguments; store-backed candles are memory-mapped"""
+    if args.csv:
+        import pandas as pd
+
+        return np.column_stack(load_ohlcv(pd.read_csv(args.csv)))
+
+    from market_data import MarketDataStore
+
+    store = MarketDataStore(args.data_dir, EXCHANGE_CONFIGS[args.exchange]['id'])
+    candles = store.load_ohlcv(args.symbol, args.timeframe)
+    if not len(candles):
+        raise SystemExit(f"No {args.timeframe} candles stored for {args.symbol}; "
+                         f"run python -m market_data sync first")
+    return candles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest a grid over historical OHLCV candles")
+    add_candle_arguments(parser)
+    parser.add_argument('--lower', type=float)
+    parser.add_argument('--upper', type=float)
+    parser.add_argument('--grids', type=int, default=10)
+    parser.add_argument('--spacing', choices=SPACINGS, default=None,
+                        help="Level distribution (default arithmetic, or custom with --levels)")
+    parser.add_argument('--levels', type=float, nargs='+', help="Prices of a custom grid")
+    parser.add_argument('--investment', type=float, default=100)
+    parser.add_argument('--leverage', type=int, default=1)
+    parser.add_argument('--direction', choices=['Long', 'Short'], default='Long')
+    parser.add_argument('--exchange', default='Phemex', choices=list(EXCHANGE_CONFIGS))
+    args = parser.parse_args(argv)
+
+    if not args.levels and (args.lower is None or args.upper is None):
+        parser.error("--lower and --upper are required unless --levels is given")
+
+    candles = load_candles(args)
+    params = parse_grid_params({
+        'lower_price': args.lower,
+        'upper_price': args.upper,
+        'num_grids': args.grids,
+        'spacing': args.spacing,
+        'levels': args.levels,
+        'investment': args.investment,
+        'leverage': args.leverage,
+        'direction': args.direction
+    })
+    result = backtest_grid(candles, params, exchange=args.exchange)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,589 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from backtest import backtest_grid
+from dashboard import DEFAULT_FPS, PriceChart
+from fake_exchange import AsyncFakeExchange, FakeExchange, FakeStreamExchange
+from grid_engine import GridEngine
+from grid_manager import GridManager
+from kill_switch import KillSwitch
+from market_cache import MarketPrecision
+from market_data import MarketDataStore
+from grid_core import build_grid_levels, parse_grid_params
+from optimizer import parameter_grid, sweep
+from paper_exchange import PaperExchange, replay_feed
+from order_placer import AsyncGridOrderPlacer, GridOrderPlacer
+from rate_limiter import AsyncTokenBucket, RequestScheduler
+from reconciler import GridReconciler
+from state_journal import StateJournal
+
+
+def make_levels(num_grids, lower_price=90.0, upper_price=110.0, size=1.0):
+    """Build a simple buy ladder for benchmarking"""
+    grid_step = (upper_price - lower_price) / (num_grids - 1)
+    return [{'price': upper_price - i * grid_step, 'size': size, 'type': 'buy'}
+            for i in range(num_grids)]
+
+
+def place_sequential(exchange, symbol, levels):
+    """Baseline: one blocking request per level, as create_grid_bot used to do"""
+    for level in levels:
+        level['order'] = exchange.create_limit_buy_order(symbol, level['size'], level['price'])
+        level['status'] = 'open'
+    return levels
+
+
+def bench_grid_placement(level_counts, latency, rate_limit):
+    """Time-to-full-grid for sequential, pooled and batch placement"""
+    symbol = 'BTC/USD:USD'
+    print(f"Grid placement (latency {latency * 1000:.0f} ms, rate limit {rate_limit} ms)")
+    print(f"{'levels':>8} {'mode':>12} {'seconds':>10} {'requests':>10} {'failed':>8}")
+
+    for count in level_counts:
+        modes = [
+            ('sequential', FakeExchange(latency, rate_limit), place_sequential),
+            ('pooled', FakeExchange(latency, rate_limit),
+             lambda ex, s, lv: GridOrderPlacer(ex).place(s, lv)),
+            ('batch', FakeExchange(latency, rate_limit, batch=True),
+             lambda ex, s, lv: GridOrderPlacer(ex).place(s, lv)),
+        ]
+        for name, exchange, place in modes:
+            levels = make_levels(count)
+            start = time.perf_counter()
+            place(exchange, symbol, levels)
+            elapsed = time.perf_counter() - start
+            failed = sum(1 for level in levels if level.get('status') != 'open')
+            print(f"{count:>8} {name:>12} {elapsed:>10.3f} {exchange.request_count:>10} {failed:>8}")
+
+
+async def run_recenter(count, latency, batch, shift, reconcile):
+    """Place a grid, then move it up by shift steps; returns (seconds, requests) of the move"""
+    symbol = 'BTC/USD:USD'
+    exchange = AsyncFakeExchange(latency, batch=batch)
+    levels = make_levels(count)
+    await AsyncGridOrderPlacer(exchange).place(symbol, levels)
+
+    step = levels[0]['price'] - levels[1]['price']
+    moved = make_levels(count, 90.0 + shift * step, 110.0 + shift * step)
+    before = exchange.request_count
+    start = time.perf_counter()
+    if reconcile:
+        open_orders = await exchange.fetch_open_orders(symbol)
+        await GridReconciler(exchange).reconcile(symbol, moved, open_orders)
+    else:
+        # Baseline: cancel everything, then place the whole ladder again
+        for level in levels:
+            await exchange.cancel_order(level['order']['id'], symbol)
+        await AsyncGridOrderPlacer(exchange).place(symbol, moved)
+    return time.perf_counter() - start, exchange.request_count - before
+
+
+def bench_recenter(level_counts, latency, shift=3):
+    """Requests and time to move a running grid up a few steps"""
+    print(f"Grid re-center by {shift} steps (latency {latency * 1000:.0f} ms)")
+    print(f"{'levels':>8} {'mode':>18} {'seconds':>10} {'requests':>10}")
+    modes = [
+        ('cancel+recreate', False, False),
+        ('reconcile', False, True),
+        ('reconcile batch', True, True),
+    ]
+    for count in level_counts:
+        for name, batch, reconcile in modes:
+            elapsed, requests = asyncio.run(run_recenter(count, latency, batch, shift, reconcile))
+            print(f"{count:>8} {name:>18} {elapsed:>10.3f} {requests:>10}")
+
+
+async def run_recovery(count, latency, journal_path):
+    """Run a grid with a journal, stop it, then time a fresh manager recovering it"""
+    symbol = 'BTC/USD:USD'
+    exchange = FakeStreamExchange(latency)
+    manager = GridManager(exchange, log=lambda message: None, journal=StateJournal(journal_path))
+    await manager.add_grid(symbol, make_levels(count), 1, grid_step=20.0 / (count - 1))
+    await exchange.replay_prices([109.0, 108.0, 109.5])
+    await asyncio.sleep(0.05)
+    await manager.stop()
+    manager.journal.close()
+
+    before = exchange.request_count
+    start = time.perf_counter()
+    journal = StateJournal(journal_path)
+    journal.compact()
+    recovered = GridManager(exchange, log=lambda message: None, journal=journal)
+    grids = await recovered.recover()
+    elapsed = time.perf_counter() - start
+    await recovered.stop()
+    journal.close()
+    return elapsed, exchange.request_count - before, grids[0]['open']
+
+
+def bench_recovery(level_counts, latency):
+    """Time to rebuild a running grid from the state journal after a restart"""
+    print(f"Grid recovery from journal (latency {latency * 1000:.0f} ms)")
+    print(f"{'levels':>8} {'seconds':>10} {'requests':>10} {'open':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in level_counts:
+            path = os.path.join(tmp, f"journal_{count}.db")
+            elapsed, requests, open_orders = asyncio.run(run_recovery(count, latency, path))
+            print(f"{count:>8} {elapsed:>10.3f} {requests:>10} {open_orders:>8}")
+
+
+def close_sequential(exchange, symbol):
+    """Baseline: cancel one order at a time, then close positions, as close_all_positions used to do"""
+    for order in exchange.fetch_open_orders(symbol):
+        exchange.cancel_order(order['id'], symbol)
+    for position in exchange.fetch_positions([symbol]):
+        if float(position['contracts']) > 0:
+            side = 'sell' if position['side'] == 'long' else 'buy'
+            exchange.create_order(symbol, 'market', side, position['contracts'])
+
+
+def open_book(exchange, symbols, orders):
+    """Rest a ladder of orders and open a long position on every symbol"""
+    for symbol in symbols:
+        for level in make_levels(orders):
+            exchange.create_order(symbol, 'limit', 'buy', level['size'], level['price'])
+        exchange.create_order(symbol, 'market', 'buy', 5.0)
+
+
+def is_flat(exchange):
+    return not exchange.orders and not exchange.positions
+
+
+def bench_flatten(num_symbols, orders, latency, rate, budget_ms):
+    """Time-to-flat for the sequential close against the kill switch"""
+    symbols = [f"SYM{i}/USD:USD" for i in range(num_symbols)]
+    print(f"Flatten {num_symbols} symbols with {orders} orders each (latency {latency * 1000:.0f} ms)")
+    print(f"{'mode':>12} {'seconds':>10} {'requests':>10} {'flat':>6}")
+
+    exchange = FakeExchange(latency)
+    open_book(exchange, symbols, orders)
+    before = exchange.request_count
+    start = time.perf_counter()
+    for symbol in symbols:
+        close_sequential(exchange, symbol)
+    elapsed = time.perf_counter() - start
+    print(f"{'sequential':>12} {elapsed:>10.3f} {exchange.request_count - before:>10} {str(is_flat(exchange)):>6}")
+
+    exchange = AsyncFakeExchange(latency)
+    open_book(exchange.sync, symbols, orders)
+    before = exchange.request_count
+    kill_switch = KillSwitch(exchange, limiter=RequestScheduler({'default': (rate, 10)}), log=lambda message: None)
+    report = asyncio.run(kill_switch.flatten(symbols))
+    flat = report['flat'] and is_flat(exchange.sync)
+    print(f"{'kill switch':>12} {report['elapsed']:>10.3f} {exchange.request_count - before:>10} {str(flat):>6}")
+
+    elapsed_ms = report['elapsed'] * 1000
+    if not flat:
+        print("FAIL: kill switch left orders or positions behind")
+        return False
+    if budget_ms is not None and elapsed_ms > budget_ms:
+        print(f"FAIL: time-to-flat {elapsed_ms:.1f} ms exceeds budget of {budget_ms} ms")
+        return False
+    return True
+
+
+async def run_contention(limiter, reads, orders, latency):
+    """Queue reads and orders, then time one cancel issued behind them"""
+    exchange = AsyncFakeExchange(latency)
+
+    async def call(lane, request):
+        await limiter.acquire(lane=lane)
+        return await request()
+
+    background = [asyncio.ensure_future(call('read', exchange.fetch_balance)) for _ in range(reads)]
+    background += [asyncio.ensure_future(call('order', lambda: exchange.create_order(
+        'BTC/USD:USD', 'limit', 'buy', 1.0, 90.0))) for _ in range(orders)]
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await call('cancel', lambda: exchange.fetch_open_orders('BTC/USD:USD'))
+    cancel_latency = time.perf_counter() - start
+    await asyncio.gather(*background)
+    return cancel_latency
+
+
+def bench_scheduler(rate, reads=40, orders=20, latency=0.005):
+    """Latency of an urgent cancel queued behind account reads and order placement"""
+    print(f"Cancel behind {reads} reads and {orders} orders ({rate:.0f} requests/s)")
+    print(f"{'limiter':>18} {'cancel ms':>10}")
+    limiters = [
+        ('fifo bucket', AsyncTokenBucket(rate, 5)),
+        ('priority lanes', RequestScheduler({'default': (rate, 5)})),
+    ]
+    for name, limiter in limiters:
+        elapsed = asyncio.run(run_contention(limiter, reads, orders, latency))
+        print(f"{name:>18} {elapsed * 1000:>10.1f}")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_fill_replay(num_grids, latency, sweeps):
+    """Replay a price path through a live grid and collect fill-to-counter latencies"""
+    symbol = 'BTC/USD:USD'
+    exchange = FakeStreamExchange(latency=latency)
+    levels = make_levels(num_grids)
+    grid_step = levels[0]['price'] - levels[1]['price']
+    await AsyncGridOrderPlacer(exchange).place(symbol, levels)
+
+    latencies = []
+
+    def on_fill(level, counter):
+        # Measured from the moment the stand-in published the fill
+        latencies.append(time.perf_counter() - exchange.fill_times[level['order']['id']])
+
+    engine = GridEngine(exchange, symbol, levels, grid_step=grid_step, on_fill=on_fill, log=lambda m: None)
+    task = asyncio.ensure_future(engine.run())
+
+    # Sweep down through every level and back up, so buys fill and then their counters
+    high = levels[0]['price'] + grid_step
+    low = levels[-1]['price'] - grid_step
+    ticks = num_grids * 2
+    down = [high - (high - low) * i / ticks for i in range(ticks + 1)]
+    for _ in range(sweeps):
+        await exchange.replay_prices(down)
+        await exchange.replay_prices(list(reversed(down)))
+
+    while engine._tasks or not exchange.order_updates.empty():
+        await asyncio.sleep(0.001)
+    engine.stop()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return latencies
+
+
+def bench_fill_reaction(num_grids, latency, sweeps, budget_ms):
+    """Fill-to-counter-order latency against the local stream stand-in"""
+    latencies = asyncio.run(run_fill_replay(num_grids, latency, sweeps))
+    p50 = percentile(latencies, 50) * 1000
+    p99 = percentile(latencies, 99) * 1000
+    worst = max(latencies) * 1000 if latencies else 0.0
+
+    print(f"Fill reaction ({num_grids} levels, {sweeps} sweeps, latency {latency * 1000:.0f} ms)")
+    print(f"{'fills':>8} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    print(f"{len(latencies):>8} {p50:>10.3f} {p99:>10.3f} {worst:>10.3f}")
+
+    if budget_ms is not None and p99 > budget_ms:
+        print(f"FAIL: p99 {p99:.3f} ms exceeds budget of {budget_ms} ms")
+        return False
+    return True
+
+
+async def run_paper_matching(resting, num_ticks, seed=1):
+    """Rest orders on both sides of 100, then random-walk through them re-arming every fill"""
+    symbol = 'BTC/USD:USD'
+    exchange = PaperExchange(balance=1e12, maker_fee=0.0, taker_fee=0.0)
+    exchange.tick(symbol, 100.0)
+    prices = np.round(np.linspace(90.0, 110.0, resting), 4)
+    start = time.perf_counter()
+    for price in prices:
+        side = 'buy' if price < 100.0 else 'sell'
+        await exchange.create_order(symbol, 'limit', side, 1.0, float(price), {})
+    placed = time.perf_counter() - start
+
+    path = 100.0 + np.cumsum(np.random.default_rng(seed).normal(0.0, 0.05, num_ticks))
+    fills = 0
+    start = time.perf_counter()
+    for price in np.clip(path, 90.5, 109.5):
+        price = float(price)
+        for order in exchange.tick(symbol, price):
+            # Counter order one price unit back, as a grid would place it
+            counter = order['price'] + 0.05 if order['side'] == 'buy' else order['price'] - 0.05
+            side = 'sell' if order['side'] == 'buy' else 'buy'
+            if (side == 'buy') == (counter < price):
+                await exchange.create_order(symbol, 'limit', side, 1.0, counter, {})
+            fills += 1
+    matched = time.perf_counter() - start
+    return placed, matched, fills, len(exchange.books[symbol])
+
+
+async def run_paper_soak(num_grids, num_ticks, market=None, balance=1e9, investment=100000.0):
+    """Grids driven end to end by GridManager while the paper exchange replays a price path.
+
+    market is ccxt market metadata for the symbol, e.g. an inverse contract;
+    the ladder is then sized in its contracts as it would be live.
+    """
+    symbol = 'BTC/USD:USD'
+    path = 100.0 + 8.0 * np.sin(np.linspace(0.0, 20 * np.pi, num_ticks))
+    exchange = PaperExchange(balance=balance)
+    precision = None
+    if market is not None:
+        exchange.set_markets({symbol: dict(market, symbol=symbol)})
+        precision = MarketPrecision.from_market(dict(market, symbol=symbol))
+    exchange.tick(symbol, 100.0)
+    manager = GridManager(exchange, log=lambda m: None)
+    params = parse_grid_params({'symbol': symbol, 'lower_price': 90.0, 'upper_price': 99.9, 'num_grids': num_grids,
+                                'investment': investment, 'leverage': 1, 'direction': 'Long'})
+    levels, grid_step, _ = build_grid_levels(params, precision)
+    grid = await manager.add_grid(symbol, levels, 1, grid_step=grid_step)
+    placed = sum(1 for level in grid.levels if level['status'] == 'open')
+
+    start = time.perf_counter()
+    async for tick_symbol, price in replay_feed(symbol, path):
+        exchange.tick(tick_symbol, price)
+    while any(grid.engine and grid.engine._tasks for grid in manager.grids.values()):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    await manager.stop()
+    equity = (await exchange.fetch_balance())[exchange.currency]['total']
+    return elapsed, len(exchange.trades), len(exchange.books[symbol]), placed, equity
+
+
+def bench_paper(resting, num_ticks, soak_grids):
+    """Matching throughput of the paper exchange and an end-to-end grid soak on it"""
+    placed, matched, fills, book = asyncio.run(run_paper_matching(resting, num_ticks))
+    print(f"Paper matching engine ({resting} resting orders, {num_ticks} ticks)")
+    print(f"{'orders/s':>10} {'ticks/s':>10} {'fills/s':>10} {'fills':>8} {'book':>8}")
+    print(f"{resting / placed:>10.0f} {num_ticks / matched:>10.0f} {fills / matched:>10.0f} {fills:>8} {book:>8}")
+
+    soak_ticks = max(num_ticks // 10, 1)
+    print(f"Paper soak ({soak_grids} levels, {soak_ticks} ticks through GridManager)")
+    print(f"{'market':>10} {'seconds':>10} {'ticks/s':>10} {'placed':>8} {'fills':>8} {'book':>8} {'equity':>12}")
+    # The inverse soak runs on a small account, so contracts mistaken for coins would fail its margin check
+    markets = [('linear', None, 1e9), ('inverse', {'contractSize': 1.0, 'inverse': True}, 2000.0)]
+    for name, market, balance in markets:
+        investment = 100000.0 if market is None else 1000.0
+        elapsed, trades, book, placed, equity = asyncio.run(
+            run_paper_soak(soak_grids, soak_ticks, market, balance, investment))
+        print(f"{name:>10} {elapsed:>10.3f} {soak_ticks / elapsed:>10.0f} {placed:>8} {trades:>8} {book:>8} "
+              f"{equity:>12.2f}")
+
+
+async def run_trailing(path, num_grids, tick_seconds, trailing):
+    """One grid on the paper exchange following path; price time advances tick_seconds per tick"""
+    symbol = 'BTC/USD:USD'
+    exchange = PaperExchange(balance=1e9)
+    exchange.tick(symbol, float(path[0]))
+    manager = GridManager(exchange, log=lambda m: None)
+    start_price = float(path[0])
+    params = parse_grid_params({'symbol': symbol, 'lower_price': start_price * 0.9, 'upper_price': start_price * 0.99,
+                                'num_grids': num_grids, 'investment': 100000.0, 'leverage': 1, 'direction': 'Long'})
+    levels, grid_step, _ = build_grid_levels(params)
+    grid = await manager.add_grid(symbol, levels, 1, grid_step=grid_step, trailing=trailing)
+    trailer = grid.trailer
+    for i, price in enumerate(path):
+        price = float(price)
+        exchange.tick(symbol, price)
+        shift = trailer.on_price(price, now=i * tick_seconds)
+        if shift is not None:
+            await shift
+        await asyncio.sleep(0)
+    await manager.stop()
+    return trailer.stats(), len(exchange.trades)
+
+
+def bench_trailing(num_grids, num_ticks, candles_symbol=None):
+    """Requests per shift and time out of range of a static, trailing and re-centering grid"""
+    if candles_symbol:
+        path = MarketDataStore().load_ohlcv(candles_symbol, '1m')[-num_ticks:, 4]
+        tick_seconds, source = 60.0, f"{candles_symbol} 1m closes"
+    else:
+        # A rally, a sell-off below the start and a recovery, with noise
+        t = np.linspace(0.0, 2 * np.pi, num_ticks)
+        noise = np.random.default_rng(3).normal(0, 0.002, num_ticks)
+        path = 100.0 * (1 + 0.25 * np.sin(t) + np.cumsum(noise) / np.sqrt(num_ticks))
+        tick_seconds, source = 1.0, "synthetic path"
+    if len(path) < 2:
+        raise SystemExit(f"No candles stored for {candles_symbol}")
+    print(f"Trailing grid ({num_grids} levels, {len(path)} ticks of {source})")
+    print(f"{'mode':>10} {'shifts':>8} {'req/shift':>10} {'out of range':>13} {'fills':>8}")
+    modes = [('static', {'mode': 'trail', 'threshold': float('inf'), 'debounce': 0.0}),
+             ('trail', {'mode': 'trail', 'threshold': 1.0, 'debounce': 10 * tick_seconds}),
+             ('recenter', {'mode': 'recenter', 'threshold': 1.0, 'debounce': 10 * tick_seconds})]
+    for name, trailing in modes:
+        stats, fills = asyncio.run(run_trailing(path, num_grids, tick_seconds, trailing))
+        per_shift = f"{stats['requests_per_shift']:.1f}" if stats['shifts'] else '-'
+        out = stats['out_of_range_seconds'] / ((len(path) - 1) * tick_seconds) * 100
+        print(f"{name:>10} {stats['shifts']:>8} {per_shift:>10} {out:>12.1f}% {fills:>8}")
+
+
+class CountingCanvas:
+    """Stand-in for a Tk canvas that only counts the calls a chart makes"""
+
+    def __init__(self, width=1200, height=260):
+        self.width, self.height = width, height
+        self.calls = 0
+        self._ids = iter(range(1, 1 << 62))
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def _create(self, *args, **kwargs):
+        self.calls += 1
+        return next(self._ids)
+
+    create_line = create_oval = create_text = _create
+
+    def _call(self, *args, **kwargs):
+        self.calls += 1
+
+    coords = itemconfigure = delete = tag_lower = _call
+
+
+def bench_dashboard(num_levels, hours, fps=DEFAULT_FPS, fill_every=50):
+    """Frame time and canvas calls of the live chart over hours of ticks with a large grid"""
+    canvas = CountingCanvas()
+    chart = PriceChart(canvas)
+    frames = int(hours * 3600 * fps)
+    rng = np.random.default_rng(5)
+    prices = 100.0 * np.exp(np.cumsum(rng.normal(0, 0.0003, frames)))
+    step = 20.0 / num_levels
+    levels = [('bench', {'price': 90.0 + i * step, 'type': 'buy' if i < num_levels // 2 else 'sell',
+                         'status': 'open'}) for i in range(num_levels)]
+    chart.set_levels(levels)
+
+    timings, calls = [], 0
+    for i, price in enumerate(prices):
+        now = i / fps
+        start = time.perf_counter()
+        chart.add_price(now, float(price))
+        chart.add_pnl(now, float(price) - 100.0)
+        if i % fill_every == 0:
+            # A fill turns one level into a filled one plus its counter, as a fill event does
+            _, level = levels[i // fill_every % num_levels]
+            level['status'] = 'filled' if level['status'] == 'open' else 'open'
+            chart.add_fill(now, float(price), level['type'])
+            chart.set_levels(levels)
+        before = canvas.calls
+        chart.render(now)
+        calls += canvas.calls - before
+        timings.append(time.perf_counter() - start)
+
+    # Clearing and redrawing every item each frame, for comparison
+    redraw = 1 + len(chart.levels) + len(chart.fills) + len(chart._items)
+    print(f"Live chart ({num_levels} levels, {hours:g} h at {fps} fps, {frames} frames)")
+    print(f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'calls/frame':>12} {'redraw calls':>13} {'points':>8}")
+    print(f"{percentile(timings, 50) * 1000:>8.3f} {percentile(timings, 99) * 1000:>8.3f} "
+          f"{max(timings) * 1000:>8.3f} {calls / frames:>12.2f} {redraw:>13} {len(chart.prices):>8}")
+
+
+def synthetic_ohlcv(num_candles, start_price=100.0, volatility=0.0008, seed=1):
+    """Random-walk 1-minute candles for benchmarking"""
+    rng = np.random.default_rng(seed)
+    close = start_price * np.exp(np.cumsum(rng.normal(0, volatility, num_candles)))
+    open_ = np.concatenate([[start_price], close[:-1]])
+    wick = np.abs(rng.normal(0, volatility / 2, (2, num_candles)))
+    high = np.maximum(open_, close) * (1 + wick[0])
+    low = np.minimum(open_, close) * (1 - wick[1])
+    timestamps = np.arange(num_candles, dtype=np.float64) * 60000
+    return np.column_stack([timestamps, open_, high, low, close])
+
+
+def bench_generators(level_counts, spacings=('arithmetic', 'geometric', 'volatility')):
+    """Time to build a full ladder of level dicts for each spacing"""
+    closes = synthetic_ohlcv(50000)[:, 4]
+    print("Grid generation")
+    print(f"{'levels':>8} {'spacing':>12} {'ms':>10}")
+    for count in level_counts:
+        for spacing in spacings:
+            params = parse_grid_params({'lower_price': 90, 'upper_price': 110, 'num_grids': count,
+                                        'spacing': spacing})
+            start = time.perf_counter()
+            build_grid_levels(params, closes=closes)
+            print(f"{count:>8} {spacing:>12} {(time.perf_counter() - start) * 1000:>10.2f}")
+
+
+def bench_backtest(num_candles, level_counts):
+    """Backtest wall time for one parameter set over synthetic 1m candles"""
+    candles = synthetic_ohlcv(num_candles)
+    print(f"Backtest ({num_candles} candles)")
+    print(f"{'levels':>8} {'seconds':>10} {'fills':>8} {'net pnl':>12}")
+    for count in level_counts:
+        params = parse_grid_params({
+            'lower_price': 80,
+            'upper_price': 120,
+            'num_grids': count,
+            'investment': 1000,
+            'leverage': 2,
+            'direction': 'Long'
+        })
+        start = time.perf_counter()
+        result = backtest_grid(candles, params)
+        elapsed = time.perf_counter() - start
+        print(f"{count:>8} {elapsed:>10.3f} {result['fills']:>8} {result['net_pnl']:>12.2f}")
+
+
+def bench_sweep(num_candles, worker_counts):
+    """Parameter-sweep throughput for increasing process counts"""
+    candles = synthetic_ohlcv(num_candles)
+    param_sets = parameter_grid([70, 80, 90], [110, 120, 130], [10, 20, 40, 80], [1, 2, 5],
+                                ['Long', 'Short'], 1000)
+    print(f"Parameter sweep ({len(param_sets)} sets, {num_candles} candles)")
+    print(f"{'workers':>8} {'seconds':>10} {'sets/s':>10}")
+    for workers in worker_counts:
+        start = time.perf_counter()
+        sweep(candles, param_sets, workers=workers)
+        elapsed = time.perf_counter() - start
+        print(f"{workers:>8} {elapsed:>10.3f} {len(param_sets) / elapsed:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grid bot benchmarks against a local fake exchange")
+    parser.add_argument('--levels', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--latency', type=float, default=0.02, help="Simulated round-trip in seconds")
+    parser.add_argument('--rate-limit', type=int, default=5, help="Milliseconds between requests")
+    parser.add_argument('--sweeps', type=int, default=5, help="Price sweeps for the fill replay")
+    parser.add_argument('--candles', type=int, default=525600, help="Candles for the backtest (default: 1 year of 1m)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help="Process counts for the parameter sweep")
+    parser.add_argument('--fill-budget-ms', type=float, default=None,
+                        help="Fail when p99 fill-to-counter latency exceeds this budget")
+    parser.add_argument('--flat-symbols', type=int, default=5, help="Symbols for the flatten benchmark")
+    parser.add_argument('--paper-orders', type=int, default=50000,
+                        help="Resting orders for the paper matching benchmark")
+    parser.add_argument('--paper-ticks', type=int, default=200000, help="Price ticks for the paper benchmark")
+    parser.add_argument('--flat-budget-ms', type=float, default=None,
+                        help="Fail when the kill switch takes longer than this to flatten")
+    parser.add_argument('--trail-ticks', type=int, default=20000, help="Price ticks for the trailing benchmark")
+    parser.add_argument('--chart-hours', type=float, default=2.0, help="Hours of ticks for the live chart benchmark")
+    parser.add_argument('--trail-candles', default=None,
+                        help="Replay this symbol's stored 1m closes in the trailing benchmark instead of a synthetic path")
+    args = parser.parse_args()
+
+    bench_grid_placement(args.levels, args.latency, args.rate_limit)
+    print()
+    bench_recenter(args.levels, args.latency)
+    print()
+    bench_recovery(args.levels, args.latency)
+    print()
+    bench_scheduler(1000.0 / max(args.rate_limit, 1))
+    print()
+    ok = bench_fill_reaction(max(args.levels), args.latency, args.sweeps, args.fill_budget_ms)
+    print()
+    ok = bench_flatten(args.flat_symbols, max(args.levels), args.latency,
+                       1000.0 / max(args.rate_limit, 1), args.flat_budget_ms) and ok
+    print()
+    bench_generators(sorted(set(args.levels) | {10000}))
+    print()
+    bench_paper(args.paper_orders, args.paper_ticks, max(args.levels))
+    print()
+    bench_trailing(min(max(args.levels), 100), args.trail_ticks, args.trail_candles)
+    print()
+    bench_dashboard(max(args.levels), args.chart_hours)
+    print()
+    bench_backtest(args.candles, args.levels)
+    print()
+    bench_sweep(args.candles, args.workers)
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
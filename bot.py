@@ -1,36 +1,12 @@
 import tkinter as tk
 from tkinter import ttk
-import ccxt
-import pandas as pd
-from datetime import datetime
-import threading
-import time
-import os
-import json
-
-# Configuration Management
-class ConfigManager:
-    CONFIG_FILE = 'grid_trading_config.json'
-    
-    @classmethod
-    def load_config(cls):
-        """Load configuration from a JSON file"""
-        try:
-            if os.path.exists(cls.CONFIG_FILE):
-                with open(cls.CONFIG_FILE, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
-            print(f"Error loading config: {e}")
-        return {}
-    
-    @classmethod
-    def save_config(cls, config):
-        """Save configuration to a JSON file"""
-        try:
-            with open(cls.CONFIG_FILE, 'w') as f:
-                json.dump(config, f, indent=4)
-        except Exception as e:
-            print(f"Error saving config: {e}")
+
+from dashboard import Dashboard, WidgetText
+from grid_core import ConfigManager, TradingCore, parse_grid_params
+from log_pipeline import LogPipeline
+
+# Lines kept in the log widget; older ones stay in the JSON-lines log files
+LOG_VIEW_LINES = 1000
 
 class GridTradingBot:
     def __init__(self):
@@ -41,36 +17,20 @@ class GridTradingBot:
         
         # Load saved configuration
         self.config = ConfigManager.load_config()
-        
-        self.exchange = None
-        self.symbol = 'BTC/USD:USD'  # Updated to Phemex default
-        self.positions = []
-        self.orders = []
-        self.grid_levels = []
-        self.is_running = False
-        
-        # Trading parameters
-        self.grid_size = 10  # Number of grid levels
-        self.grid_spacing = 1.0  # Percentage between grid levels
-        self.position_size = 100  # Size of each grid position in USDT
-        self.take_profit = 2.0  # Take profit percentage
-        self.leverage = 1  # Default leverage
-        
-        # PnL tracking
-        self.total_fees = 0
-        self.realized_pnl = 0
-        self.start_balance = 0
-        self.trade_history = []
-        
-        # Available exchanges and their configurations
-        self.exchange_configs = {
-            'Phemex': {
-                'id': 'phemex',
-                'markets': ['BTC/USD:USD', 'ETH/USD:USD', 'SOL/USD:USD'],
-                'type': 'future',
-                'maker_fee': 0.0001,
-                'taker_fee': 0.0006
-            }
+
+        # Records are written by a background listener; the widget renders them in batches
+        self.logs = LogPipeline(ring_size=LOG_VIEW_LINES)
+        
+        # Trading state and all exchange I/O live in the core; this class is only a front end
+        self.core = TradingCore(log=self.log).start()
+        self.core.add_listener(self.on_core_event)
+        self.exchange_configs = self.core.exchange_configs
+        # Account labels are only reconfigured when their text changes
+        self.widget_text = WidgetText()
+        self.event_handlers = {
+            'connect': self.handle_connect_result,
+            'fetch_account': self.handle_account_result,
+            'account': self.handle_account_result
         }
         
         # Create configuration variables
@@ -87,9 +47,21 @@ class GridTradingBot:
             if saved_exchange and saved_exchange in self.exchange_configs:
                 self.exchange_var.set(saved_exchange)
                 self.api_key_var.set(saved_api_key)
+                self.on_exchange_selected()
         
-        # Start account overview updates
+        # Start draining exchange results and account overview updates
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.process_service_results()
         self.update_account_overview()
+        self.render_log()
+        self.dashboard.start()
+
+    def on_close(self):
+        """Shut down the exchange service before closing the window"""
+        self.dashboard.stop()
+        self.core.stop()
+        self.logs.stop()
+        self.root.destroy()
 
     def draw_status_indicator(self, status):
         """Draw connection status indicator"""
@@ -139,6 +111,7 @@ class GridTradingBot:
         # API configuration variables
         self.api_key_var = tk.StringVar(self.root)
         self.api_secret_var = tk.StringVar(self.root)
+        self.api_password_var = tk.StringVar(self.root)  # passphrase, only some venues have one
         
         # Market selection variable
         self.market_var = tk.StringVar(self.root, value='BTC/USD:USD')
@@ -150,6 +123,8 @@ class GridTradingBot:
         self.investment_var = tk.StringVar(self.root, value='100')
         self.leverage_var = tk.StringVar(self.root, value='1')
         self.direction_var = tk.StringVar(self.root, value='Long')
+        self.spacing_var = tk.StringVar(self.root, value='arithmetic')
+        self.trailing_var = tk.BooleanVar(self.root, value=False)
 
     def setup_grid_section(self, main_container):
         """Create Grid Configuration Section"""
@@ -228,6 +203,21 @@ class GridTradingBot:
                                         state="readonly", 
                                         width=10)
         direction_dropdown.pack(side=tk.LEFT, padx=5)
+
+        ttk.Label(leverage_frame,
+                 text="Spacing:",
+                 font=('Consolas', 11)).pack(side=tk.LEFT, padx=(20, 10))
+        spacing_dropdown = ttk.Combobox(leverage_frame,
+                                      textvariable=self.spacing_var,
+                                      values=['arithmetic', 'geometric', 'volatility'],
+                                      state="readonly",
+                                      width=10)
+        spacing_dropdown.pack(side=tk.LEFT, padx=5)
+
+        # Follow the price with the default trailing settings once it leaves the range
+        ttk.Checkbutton(leverage_frame,
+                       text="Trail price",
+                       variable=self.trailing_var).pack(side=tk.LEFT, padx=(20, 5))
         
         # Buttons for preview and create
         button_frame = ttk.Frame(grid_config_container)
@@ -243,6 +233,11 @@ class GridTradingBot:
                                  command=self.create_grid_bot)
         create_button.pack(side=tk.LEFT, padx=5)
         
+        update_button = ttk.Button(button_frame,
+                                 text="Update Grid",
+                                 command=self.update_grid_bot)
+        update_button.pack(side=tk.LEFT, padx=5)
+
         # Close Positions Button
         close_button = ttk.Button(button_frame, 
                                 text="Close All Positions", 
@@ -309,18 +304,19 @@ class GridTradingBot:
                                        state="readonly",
                                        width=15)
         exchange_dropdown.pack(side=tk.LEFT, padx=5)
+        exchange_dropdown.bind('<<ComboboxSelected>>', lambda event: self.on_exchange_selected())
         
         # Create market selection dropdown
         ttk.Label(exchange_select_frame,
                  text="Market:",
                  font=('Consolas', 11)).pack(side=tk.LEFT, padx=(20, 10))
         
-        market_dropdown = ttk.Combobox(exchange_select_frame,
-                                     textvariable=self.market_var,
-                                     values=self.exchange_configs['Phemex']['markets'],
-                                     state="readonly",
-                                     width=15)
-        market_dropdown.pack(side=tk.LEFT, padx=5)
+        self.market_dropdown = ttk.Combobox(exchange_select_frame,
+                                          textvariable=self.market_var,
+                                          values=self.exchange_configs[self.exchange_var.get()]['markets'],
+                                          state="readonly",
+                                          width=15)
+        self.market_dropdown.pack(side=tk.LEFT, padx=5)
         
         # Center - API Configuration
         api_frame = ttk.Frame(config_container)
@@ -344,6 +340,16 @@ class GridTradingBot:
                                    width=30,
                                    show="•")
         api_secret_entry.pack(side=tk.LEFT, padx=5)
+
+        ttk.Label(api_frame,
+                 text="Passphrase:",
+                 font=('Consolas', 11)).pack(side=tk.LEFT, padx=(20, 10))
+
+        api_password_entry = ttk.Entry(api_frame,
+                                     textvariable=self.api_password_var,
+                                     width=15,
+                                     show="•")
+        api_password_entry.pack(side=tk.LEFT, padx=5)
         
         # Right side - Connection status and button
         connect_frame = ttk.Frame(config_container)
@@ -423,7 +429,15 @@ class GridTradingBot:
         
         # 3. GRID CONFIGURATION SECTION
         self.setup_grid_section(main_container)
-        
+
+        # 4. LIVE CHART: price, grid levels, fills and PnL of the selected market
+        self.chart_canvas = tk.Canvas(main_container,
+                                    height=260,
+                                    bg='#121212',
+                                    highlightthickness=0)
+        self.chart_canvas.pack(fill=tk.X, padx=10)
+        self.dashboard = Dashboard(self.root, self.chart_canvas, self.core)
+
         # Status text area
         self.status_text = tk.Text(main_container, 
                                  height=8,
@@ -432,156 +446,127 @@ class GridTradingBot:
                                  font=('Consolas', 10))
         self.status_text.pack(fill=tk.BOTH, expand=True, pady=10)
         self.status_text.tag_configure('timestamp', foreground='#2196F3')
+        self.status_text.tag_configure('WARNING', foreground='#FFC107')
+        self.status_text.tag_configure('ERROR', foreground='#F44336')
 
     def log(self, message):
-        """Log message with timestamp"""
+        """Queue a log message; safe from any thread and never touches Tk directly"""
+        self.logs.log(message)
+
+    def render_log(self):
+        """Append the messages logged since the last render in one insert and trim old lines"""
         try:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            if hasattr(self, 'status_text'):
-                self.status_text.insert(tk.END, timestamp, 'timestamp')
-                self.status_text.insert(tk.END, f": {message}\n")
+            entries = self.logs.ring.drain()
+            if entries:
+                chunks = []
+                for timestamp, level, message in entries:
+                    chunks.extend((timestamp, 'timestamp', f": {message}\n", level))
+                self.status_text.insert(tk.END, *chunks)
+                lines = int(self.status_text.index('end-1c').split('.')[0])
+                if lines > LOG_VIEW_LINES:
+                    self.status_text.delete('1.0', f"{lines - LOG_VIEW_LINES}.0")
                 self.status_text.see(tk.END)
-            else:
-                print(f"{timestamp}: {message}")
+        finally:
+            self.root.after(200, self.render_log)
+
+    def process_service_results(self):
+        """Drain exchange service results on the Tk thread"""
+        try:
+            self.core.process_results()
         except Exception as e:
-            print(f"Logging error: {e}")
-            print(f"Message was: {message}")
+            self.log(f"Error handling exchange result: {str(e)}")
+        finally:
+            self.root.after(50, self.process_service_results)
+
+    def on_core_event(self, item):
+        """Refresh widgets after the core has applied a service result"""
+        handler = self.event_handlers.get(item['command'])
+        if handler:
+            handler(item)
+
+    def read_grid_params(self):
+        """Collect grid settings from the form"""
+        return parse_grid_params({
+            'symbol': self.core.symbol,
+            'upper_price': self.upper_price_var.get(),
+            'lower_price': self.lower_price_var.get(),
+            'num_grids': self.num_grids_var.get(),
+            'investment': self.investment_var.get(),
+            'leverage': self.leverage_var.get(),
+            'direction': self.direction_var.get(),
+            'spacing': self.spacing_var.get(),
+            'trailing': self.trailing_var.get()
+        })
+
+    def on_exchange_selected(self):
+        """Offer the selected exchange's markets, keeping the market if it trades there"""
+        markets = self.exchange_configs[self.exchange_var.get()]['markets']
+        self.market_dropdown.config(values=markets)
+        if self.market_var.get() not in markets:
+            self.market_var.set(markets[0])
 
     def test_connection(self):
         """Test the API connection with current credentials"""
         self.draw_status_indicator("connecting")
         self.connect_button.config(state='disabled')
-        
-        def connect():
-            try:
-                exchange_config = self.exchange_configs['Phemex']
-                exchange = getattr(ccxt, exchange_config['id'])({
-                    'enableRateLimit': True,
-                    'apiKey': self.api_key_var.get(),
-                    'secret': self.api_secret_var.get()
-                })
-                
-                # Test authentication
-                exchange.fetch_balance()
-                
-                # Save configuration
-                config = {
-                    'last_exchange': 'Phemex',
-                    'api_key': self.api_key_var.get()
-                }
-                ConfigManager.save_config(config)
-                
-                # Update status
-                def success_callback():
-                    self.draw_status_indicator("connected")
-                    self.log("API connection successful")
-                    self.connect_button.config(state='normal')
-                
-                self.root.after(0, success_callback)
-                
-                # Store working exchange instance
-                self.exchange = exchange
-                self.symbol = self.market_var.get()
-                
-            except Exception as e:
-                error_message = str(e)
-                def error_callback():
-                    self.draw_status_indicator("disconnected")
-                    self.log(f"API connection failed: {error_message}")
-                    self.connect_button.config(state='normal')
-                
-                self.root.after(0, error_callback)
-                self.exchange = None
-        
-        # Run connection test in separate thread
-        threading.Thread(target=connect, daemon=True).start()
+        try:
+            self.core.connect(self.api_key_var.get(),
+                              self.api_secret_var.get(),
+                              exchange_name=self.exchange_var.get(),
+                              symbol=self.market_var.get(),
+                              password=self.api_password_var.get() or None)
+        except ValueError as e:
+            self.log(f"Error: {str(e)}")
+            self.draw_status_indicator("disconnected")
+            self.connect_button.config(state='normal')
+
+    def handle_connect_result(self, item):
+        """Update connection status once the service has answered"""
+        self.connect_button.config(state='normal')
+        if item['error']:
+            self.draw_status_indicator("disconnected")
+        else:
+            self.draw_status_indicator("connected")
 
     def update_account_overview(self):
-        """Update account balance, positions value, and PnL display"""
+        """Show account balance, positions value, and PnL from the streamed account cache"""
         try:
-            if not self.exchange:
-                self.balance_label.config(text="Not Connected")
-                self.positions_value_label.config(text="Not Connected")
-                self.total_pnl_label.config(text="Not Connected")
-                return
-                
-            # Fetch futures balance
-            balance = self.exchange.fetch_balance()
-            usdt_balance = balance.get('USD', {}).get('total', 0)
-            self.balance_label.config(text=f"{usdt_balance:.2f} USD")
-            
-            # Store initial balance if not set
-            if self.start_balance == 0:
-                self.start_balance = usdt_balance
-            
-            # Calculate total positions value and unrealized PnL
-            positions = self.exchange.fetch_positions([self.symbol])
-            total_value = 0
-            unrealized_pnl = 0
-            for position in positions:
-                if float(position['contracts']) > 0:
-                    total_value += float(position['notional'])
-                    unrealized_pnl += float(position['unrealizedPnl'])
-                    
-            self.positions_value_label.config(text=f"{total_value:.2f} USD")
-            
-            # Calculate total PnL including fees
-            total_pnl = self.realized_pnl + unrealized_pnl - self.total_fees
-            
-            # Update PnL label with color based on profit/loss
-            if total_pnl > 0:
-                self.total_pnl_label.config(text=f"+{total_pnl:.2f} USD", foreground='#4CAF50')
-            else:
-                self.total_pnl_label.config(text=f"{total_pnl:.2f} USD", foreground='#FF5252')
-            
-            # Update every 10 seconds
-            self.root.after(10000, self.update_account_overview)
-            
-        except Exception as e:
-            self.log(f"Error updating account overview: {str(e)}")
-            self.balance_label.config(text="Error")
-            self.positions_value_label.config(text="Error")
-            self.total_pnl_label.config(text="Error")
+            if not self.core.connected:
+                self.widget_text.set(self.balance_label, text="Not Connected")
+                self.widget_text.set(self.positions_value_label, text="Not Connected")
+                self.widget_text.set(self.total_pnl_label, text="Not Connected")
+            elif self.core.account:
+                self.render_account()
+        finally:
+            # Only reads local state, so it can refresh every second
+            self.root.after(1000, self.update_account_overview)
+
+    def handle_account_result(self, item):
+        """Render account figures as soon as the service reports a change"""
+        if item['error']:
+            self.widget_text.set(self.balance_label, text="Error")
+            self.widget_text.set(self.positions_value_label, text="Error")
+            self.widget_text.set(self.total_pnl_label, text="Error")
+            return
+        if self.core.account:
+            self.render_account()
+
+    def render_account(self):
+        account = self.core.account
+        self.widget_text.set(self.balance_label, text=f"{account['balance']:.2f} USD")
+        self.widget_text.set(self.positions_value_label, text=f"{account['positions_value']:.2f} USD")
+        
+        # Update PnL label with color based on profit/loss
+        total_pnl = self.core.total_pnl()
+        if total_pnl > 0:
+            self.widget_text.set(self.total_pnl_label, text=f"+{total_pnl:.2f} USD", foreground='#4CAF50')
+        else:
+            self.widget_text.set(self.total_pnl_label, text=f"{total_pnl:.2f} USD", foreground='#FF5252')
 
     def preview_grid(self):
         """Preview grid levels and investment details before creating bot"""
         try:
-            # Get and validate parameters
-            upper_price = float(self.upper_price_var.get())
-            lower_price = float(self.lower_price_var.get())
-            num_grids = int(self.num_grids_var.get())
-            total_investment = float(self.investment_var.get())
-            leverage = int(self.leverage_var.get())
-            direction = self.direction_var.get()
-            
-            if upper_price <= lower_price:
-                raise ValueError("Upper price must be greater than lower price")
-            
-            if num_grids < 2:
-                raise ValueError("Number of grids must be at least 2")
-                
-            # Calculate grid levels
-            price_diff = upper_price - lower_price
-            grid_step = price_diff / (num_grids - 1)
-            investment_per_grid = total_investment / num_grids
-            
-            # Preview calculations
-            self.log("\n=== Grid Preview ===")
-            self.log(f"Direction: {direction}")
-            self.log(f"Price Range: {lower_price:.2f} - {upper_price:.2f} USD")
-            self.log(f"Grid Step: {grid_step:.2f} USD")
-            self.log(f"Number of Grids: {num_grids}")
-            self.log(f"Total Investment: {total_investment:.2f} USD")
-            self.log(f"Investment per Grid: {investment_per_grid:.2f} USD")
-            self.log(f"Leverage: {leverage}x")
-            
-            # Preview grid levels
-            self.log("\nGrid Levels:")
-            for i in range(num_grids):
-                price = upper_price - (i * grid_step)
-                size = (investment_per_grid * leverage) / price
-                self.log(f"Level {i+1}: {price:.2f} USD - Size: {size:.4f}")
-                
+            self.core.preview_grid(self.read_grid_params())
         except ValueError as e:
             self.log(f"Error in parameters: {str(e)}")
         except Exception as e:
@@ -590,126 +575,30 @@ class GridTradingBot:
     def create_grid_bot(self):
         """Create and start the grid bot with specified parameters"""
         try:
-            if not self.exchange:
-                raise ValueError("Please connect to exchange first")
-                
-            # Get and validate parameters
-            upper_price = float(self.upper_price_var.get())
-            lower_price = float(self.lower_price_var.get())
-            num_grids = int(self.num_grids_var.get())
-            total_investment = float(self.investment_var.get())
-            leverage = int(self.leverage_var.get())
-            direction = self.direction_var.get()
-            
-            # Set leverage on exchange
-            try:
-                if hasattr(self.exchange, 'fapiPrivate_post_leverage'):
-                    self.exchange.fapiPrivate_post_leverage({
-                        'symbol': self.symbol.replace('/', '').replace(':USD', ''),
-                        'leverage': leverage
-                    })
-                elif hasattr(self.exchange, 'set_leverage'):
-                    self.exchange.set_leverage(leverage, self.symbol)
-            except Exception as e:
-                self.log(f"Warning setting leverage: {str(e)}")
-            
-            # Calculate grid levels
-            price_diff = upper_price - lower_price
-            grid_step = price_diff / (num_grids - 1)
-            investment_per_grid = total_investment / num_grids
-            
-            self.log("\n=== Creating Grid Bot ===")
-            self.log(f"Setting up {direction} grid...")
-            
-            # Get exchange fee rates
-            exchange_config = self.exchange_configs['Phemex']
-            maker_fee = exchange_config['maker_fee']
-            
-            # Create orders for each grid level
-            self.grid_levels = []
-            for i in range(num_grids):
-                price = upper_price - (i * grid_step)
-                size = (investment_per_grid * leverage) / price
-                
-                try:
-                    if direction == "Long":
-                        order = self.exchange.create_limit_buy_order(
-                            self.symbol,
-                            size,
-                            price
-                        )
-                    else:  # Short
-                        order = self.exchange.create_limit_sell_order(
-                            self.symbol,
-                            size,
-                            price
-                        )
-                    
-                    # Calculate and track fees
-                    order_value = size * price
-                    fee = order_value * maker_fee
-                    self.total_fees += fee
-                    
-                    self.grid_levels.append({
-                        'price': price,
-                        'size': size,
-                        'order': order,
-                        'type': 'buy' if direction == "Long" else 'sell',
-                        'fee': fee
-                    })
-                    
-                    self.log(f"Created {direction} order at {price:.2f} USD (Fee: {fee:.4f} USD)")
-                    
-                except Exception as e:
-                    self.log(f"Error creating order at {price:.2f}: {str(e)}")
-                    
-            self.log(f"Initial total fees: {self.total_fees:.4f} USD")
-            self.log("Grid bot created successfully!")
-            
+            self.core.create_grid(self.read_grid_params())
         except ValueError as e:
             self.log(f"Error: {str(e)}")
         except Exception as e:
             self.log(f"Error creating grid bot: {str(e)}")
 
+    def update_grid_bot(self):
+        """Apply the form to the newest grid on the selected market without restarting it"""
+        try:
+            grid_ids = [grid_id for grid_id, grid in self.core.grids.items()
+                        if grid['symbol'] == self.core.symbol]
+            if not grid_ids:
+                self.log("No running grid on this market, use Create Grid Bot")
+                return
+            self.core.update_grid(grid_ids[-1], self.read_grid_params())
+        except ValueError as e:
+            self.log(f"Error in parameters: {str(e)}")
+        except Exception as e:
+            self.log(f"Error updating grid bot: {str(e)}")
+
     def close_all_positions(self):
         """Close all open positions and cancel all pending orders"""
         try:
-            if not self.exchange:
-                raise ValueError("Please connect to exchange first")
-                
-            self.log("\n=== Closing All Positions ===")
-            
-            # Cancel all pending orders
-            open_orders = self.exchange.fetch_open_orders(self.symbol)
-            for order in open_orders:
-                try:
-                    self.exchange.cancel_order(order['id'], self.symbol)
-                    self.log(f"Cancelled order at {order['price']}")
-                except Exception as e:
-                    self.log(f"Error cancelling order: {str(e)}")
-            
-            # Close all open positions
-            positions = self.exchange.fetch_positions([self.symbol])
-            for position in positions:
-                if float(position['contracts']) > 0:
-                    try:
-                        if position['side'] == 'long':
-                            self.exchange.create_market_sell_order(
-                                self.symbol,
-                                position['contracts']
-                            )
-                        else:
-                            self.exchange.create_market_buy_order(
-                                self.symbol,
-                                position['contracts']
-                            )
-                        self.log(f"Closed {position['side']} position of {position['contracts']} contracts")
-                    except Exception as e:
-                        self.log(f"Error closing position: {str(e)}")
-            
-            self.grid_levels = []
-            self.log("All positions and orders cancelled")
-            
+            self.core.close_all()
         except Exception as e:
             self.log(f"Error closing positions: {str(e)}")
 
@@ -0,0 +1,398 @@
+"""Live chart of the selected market: price, grid levels, fills and PnL.
+
+Everything here runs on the Tk thread and only reads state the trading
+core holds on that thread: the grid snapshots and the quotes the exchange
+service publishes through its results queue. Drawing never waits on,
+loads or races the exchange loop. Frames are capped at a
+fixed rate, histories are downsampled to a bounded number of points, and
+canvas items are created once and then moved or restyled only when what
+they show changed.
+"""
+import collections
+import time
+from array import array
+
+import numpy as np
+
+DEFAULT_FPS = 10
+HISTORY_POINTS = 1024  # points kept per history, however long the bot runs
+FILL_MARKERS = 200  # most recent fills drawn on the chart
+
+PRICE_COLOR = '#E0E0E0'
+PNL_COLOR = '#2196F3'
+AXIS_COLOR = '#424242'
+LEVEL_COLORS = {'buy': '#4CAF50', 'sell': '#FF5252'}
+PENDING_COLOR = '#757575'
+LABEL_FONT = ('Consolas', 9)
+
+# Shares of the canvas height for the price area and the PnL strip below it
+PRICE_AREA = 0.78
+LABEL_WIDTH = 70  # pixels kept free on the right for the value labels
+
+
+class HistoryBuffer:
+    """Time series held at a bounded number of points by merging neighbours as it grows.
+
+    Each point covers resolution seconds from its time and keeps the low,
+    high and last value seen in that span, so spikes survive downsampling.
+    Once capacity points are held, neighbouring pairs are merged and the
+    resolution doubles: appends stay O(1) amortized and memory stays fixed.
+    """
+
+    def __init__(self, capacity=HISTORY_POINTS, resolution=1.0):
+        self.capacity = capacity
+        self.resolution = resolution
+        self.version = 0  # changes whenever a point is added or changed
+        self.reset()
+
+    def reset(self):
+        self.times, self.lows, self.highs, self.lasts = array('d'), array('d'), array('d'), array('d')
+        self.low = self.high = None  # over the whole history
+        self.version += 1
+
+    def __len__(self):
+        return len(self.times)
+
+    def last(self):
+        return self.lasts[-1] if self.lasts else None
+
+    def append(self, t, value):
+        """Add a sample; returns False if it changed nothing that is drawn"""
+        if self.times and t - self.times[-1] < self.resolution:
+            if value == self.lasts[-1]:
+                return False
+            self.lasts[-1] = value
+            if value < self.lows[-1]:
+                self.lows[-1] = value
+            elif value > self.highs[-1]:
+                self.highs[-1] = value
+        else:
+            if len(self.times) >= self.capacity:
+                self._merge()
+            for series in (self.times, self.lows, self.highs, self.lasts):
+                series.append(t if series is self.times else value)
+        if self.low is None or value < self.low:
+            self.low = value
+        if self.high is None or value > self.high:
+            self.high = value
+        self.version += 1
+        return True
+
+    def _merge(self):
+        count = len(self.times) // 2 * 2
+        lows, highs = np.frombuffer(self.lows), np.frombuffer(self.highs)
+        merged_lows = np.minimum(lows[0:count:2], lows[1:count:2])
+        merged_highs = np.maximum(highs[0:count:2], highs[1:count:2])
+        # An odd point out stays as it is
+        self.times = array('d', self.times[0:count:2] + self.times[count:])
+        self.lows = array('d', merged_lows.tobytes()) + self.lows[count:]
+        self.highs = array('d', merged_highs.tobytes()) + self.highs[count:]
+        self.lasts = array('d', self.lasts[1:count:2] + self.lasts[count:])
+        self.resolution *= 2
+
+    def envelope(self):
+        """(times, values) tracing each point's low and high, in the direction the series moved"""
+        times = np.frombuffer(self.times)
+        lows, highs, lasts = np.frombuffer(self.lows), np.frombuffer(self.highs), np.frombuffer(self.lasts)
+        rising = np.empty(len(lasts), dtype=bool)
+        rising[0] = True
+        np.greater_equal(lasts[1:], lasts[:-1], out=rising[1:])
+        values = np.empty((len(times), 2))
+        values[:, 0] = np.where(rising, lows, highs)
+        values[:, 1] = np.where(rising, highs, lows)
+        return np.repeat(times, 2), values.ravel()
+
+
+class Scale:
+    """Linear map from values to pixels that only moves when the data outgrows it.
+
+    Keeping the range until values leave it, or shrink to a small part of
+    it, means most frames leave every item that depends on it untouched.
+    """
+
+    def __init__(self, padding=0.1, shrink=0.3):
+        self.padding = padding
+        self.shrink = shrink
+        self.low = self.high = None
+        self.start = self.end = 0.0  # pixel positions of low and high
+
+    def fit(self, low, high, start, end):
+        """Adjust to cover low..high between pixels start and end; True if the mapping changed"""
+        span = self.high - self.low if self.low is not None else 0.0
+        inside = self.low is not None and self.low <= low and high <= self.high
+        if inside and (high - low) >= self.shrink * span and (start, end) == (self.start, self.end):
+            return False
+        width = (high - low) or abs(high) * 0.01 or 1.0
+        self.low, self.high = low - width * self.padding, high + width * self.padding
+        self.start, self.end = start, end
+        return True
+
+    def __call__(self, value):
+        return self.start + (value - self.low) * (self.end - self.start) / (self.high - self.low)
+
+    def array(self, values):
+        return self.start + (values - self.low) * ((self.end - self.start) / (self.high - self.low))
+
+
+class PriceChart:
+    """Price and PnL lines with grid levels and fills on one Tk canvas, updated by difference.
+
+    The price and PnL lines are single canvas items whose coordinates are
+    replaced when their history changed. Levels are keyed by grid, side
+    and price: new ones are created, gone ones deleted and the rest only
+    restyled when their status changed. Levels and fill markers are moved
+    only when a scale changes, which the sticky scales keep rare. The time
+    axis runs from the first sample to a little past now and is extended
+    in steps, not every frame.
+    """
+
+    def __init__(self, canvas, capacity=HISTORY_POINTS, fill_markers=FILL_MARKERS):
+        self.canvas = canvas
+        self.prices = HistoryBuffer(capacity)
+        self.pnl = HistoryBuffer(capacity)
+        self.fill_limit = fill_markers
+        self.levels = {}  # (grid id, side, price) -> [item, style]
+        self.fills = collections.deque()  # [time, price, side, item]
+        self.x = Scale(padding=0.0)
+        self.y = Scale()
+        self.pnl_y = Scale(padding=0.2)
+        self._level_range = None  # (lowest, highest) level price
+        self._drawn = {}  # (item, method) or line name -> what it was last drawn with, to skip repeats
+        self._items = None
+        self._invalid = True
+
+    def reset(self):
+        """Forget everything drawn, e.g. when another market is selected"""
+        self.prices.reset()
+        self.pnl.reset()
+        self.set_levels([])
+        for fill in self.fills:
+            self.canvas.delete(fill[3])
+        self.fills.clear()
+        self._invalid = True
+
+    def invalidate(self):
+        """Re-lay out everything on the next render, e.g. after the canvas was resized"""
+        self._invalid = True
+
+    def _create_items(self):
+        canvas = self.canvas
+        self._items = {
+            'pnl_zero': canvas.create_line(0, 0, 0, 0, fill=AXIS_COLOR, dash=(2, 4)),
+            'divider': canvas.create_line(0, 0, 0, 0, fill=AXIS_COLOR),
+            'price': canvas.create_line(0, 0, 0, 0, fill=PRICE_COLOR, width=1),
+            'pnl': canvas.create_line(0, 0, 0, 0, fill=PNL_COLOR, width=1),
+            'price_label': canvas.create_text(0, 0, text='', fill=PRICE_COLOR, font=LABEL_FONT, anchor='w'),
+            'pnl_label': canvas.create_text(0, 0, text='', fill=PNL_COLOR, font=LABEL_FONT, anchor='nw')
+        }
+
+    def add_price(self, t, price):
+        return self.prices.append(t, price)
+
+    def add_pnl(self, t, pnl):
+        return self.pnl.append(t, pnl)
+
+    def add_fill(self, t, price, side):
+        if self._items is None:
+            self._create_items()
+        color = LEVEL_COLORS.get(side, PENDING_COLOR)
+        item = self.canvas.create_oval(0, 0, 0, 0, fill=color, outline='')
+        fill = [t, price, side, item]
+        self.fills.append(fill)
+        if len(self.fills) > self.fill_limit:
+            self.canvas.delete(self.fills.popleft()[3])
+        if self.x.low is not None:
+            self._place_fill(fill)
+
+    def set_levels(self, levels):
+        """Show [(grid id, level)]; only open and pending levels are drawn"""
+        wanted = {}
+        for grid_id, level in levels:
+            status = level.get('status')
+            if status not in ('open', 'pending'):
+                continue
+            color = LEVEL_COLORS.get(level['type'], PENDING_COLOR) if status == 'open' else PENDING_COLOR
+            dash = (4, 3) if level.get('counter_of') is not None else ()
+            wanted[(grid_id, level['type'], level['price'])] = (color, dash)
+
+        for key in [key for key in self.levels if key not in wanted]:
+            self.canvas.delete(self.levels.pop(key)[0])
+        for key, style in wanted.items():
+            drawn = self.levels.get(key)
+            if drawn is None:
+                item = self.canvas.create_line(0, 0, 0, 0, fill=style[0], dash=style[1])
+                # Levels stay under the price line
+                self.canvas.tag_lower(item)
+                self.levels[key] = [item, style]
+                if self.y.low is not None:
+                    self._place_level(key, item)
+            elif drawn[1] != style:
+                self.canvas.itemconfigure(drawn[0], fill=style[0], dash=style[1])
+                drawn[1] = style
+        prices = [key[2] for key in self.levels]
+        self._level_range = (min(prices), max(prices)) if prices else None
+
+    def _place_level(self, key, item):
+        y = self.y(key[2])
+        self.canvas.coords(item, 0, y, self.x.end, y)
+
+    def _place_fill(self, fill):
+        x, y = self.x(fill[0]), self.y(fill[1])
+        self.canvas.coords(fill[3], x - 3, y - 3, x + 3, y + 3)
+
+    def _set(self, name, method, *args, **options):
+        """Call a canvas method on a named item unless it was last called with the same values"""
+        item = self._items[name]
+        drawn = (method, args, tuple(sorted(options.items())))
+        if self._drawn.get((item, method)) == drawn:
+            return
+        self._drawn[(item, method)] = drawn
+        getattr(self.canvas, method)(item, *args, **options)
+
+    def render(self, now):
+        """Bring the canvas in line with the data"""
+        canvas = self.canvas
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        if width < 50 or height < 50 or not len(self.prices):
+            return
+        if self._items is None:
+            self._create_items()
+        if self._invalid:
+            self._drawn = {}
+            self.x.low = self.x.high = self.y.low = self.pnl_y.low = None
+        plot_width = width - LABEL_WIDTH
+        price_bottom = height * PRICE_AREA
+
+        # Time axis: from the first sample to a quarter of the elapsed time past now
+        start = self.prices.times[0]
+        moved_x = self.x.high is None or now > self.x.high
+        if moved_x:
+            self.x.low, self.x.high = start, start + max(now - start, 60.0) * 1.25
+            self.x.start, self.x.end = 0.0, plot_width
+
+        low, high = self.prices.low, self.prices.high
+        if self._level_range is not None:
+            low, high = min(low, self._level_range[0]), max(high, self._level_range[1])
+        moved_y = self.y.fit(low, high, price_bottom - 4, 4)
+
+        if moved_y:
+            for key, (item, _) in self.levels.items():
+                self._place_level(key, item)
+        if moved_x or moved_y:
+            for fill in self.fills:
+                self._place_fill(fill)
+            self._set('divider', 'coords', 0, price_bottom, width, price_bottom)
+
+        if moved_x or moved_y or self._drawn.get('price') != self.prices.version:
+            self._draw_history('price', self.prices, self.y)
+            last = self.prices.last()
+            self._set('price_label', 'coords', plot_width + 4, self.y(last))
+            self._set('price_label', 'itemconfigure', text=f"{last:.2f}")
+
+        if len(self.pnl):
+            moved_pnl = self.pnl_y.fit(min(self.pnl.low, 0.0), max(self.pnl.high, 0.0), height - 4,
+                                       price_bottom + 4)
+            if moved_x or moved_pnl or self._drawn.get('pnl') != self.pnl.version:
+                self._draw_history('pnl', self.pnl, self.pnl_y)
+                zero = self.pnl_y(0.0)
+                self._set('pnl_zero', 'coords', 0, zero, plot_width, zero)
+                last = self.pnl.last()
+                self._set('pnl_label', 'coords', 4, price_bottom + 4)
+                self._set('pnl_label', 'itemconfigure', text=f"PnL {last:+.2f}",
+                          fill=LEVEL_COLORS['buy'] if last >= 0 else LEVEL_COLORS['sell'])
+        self._invalid = False
+
+    def _draw_history(self, name, history, scale):
+        times, values = history.envelope()
+        points = np.empty((len(times), 2))
+        points[:, 0] = self.x.array(times)
+        points[:, 1] = scale.array(values)
+        self.canvas.coords(self._items[name], points.ravel().tolist())
+        self._drawn[name] = history.version
+
+
+class Dashboard:
+    """Feed a PriceChart from the trading core at a capped frame rate.
+
+    Each frame samples the selected market's last published mid price and
+    the total PnL, and refreshes the levels only after the core applied an
+    event that changes grids. Fills are marked as their events arrive.
+    """
+
+    GRID_EVENTS = ('connect', 'create_grid', 'update_grid', 'fill', 'remove_grid', 'close_all')
+
+    def __init__(self, root, canvas, core, fps=DEFAULT_FPS, clock=time.monotonic):
+        self.root = root
+        self.canvas = canvas
+        self.core = core
+        self.interval = max(int(1000 / fps), 1)
+        self.clock = clock
+        self.chart = PriceChart(canvas)
+        self.symbol = None
+        self.frame_seconds = 0.0  # time the last frame took
+        self._levels_dirty = True
+        self._after = None
+        core.add_listener(self.on_core_event)
+        canvas.bind('<Configure>', lambda event: self.chart.invalidate())
+
+    def on_core_event(self, item):
+        if item['error'] or item['command'] not in self.GRID_EVENTS:
+            return
+        self._levels_dirty = True
+        if item['command'] == 'fill' and item['result']['symbol'] == self.symbol:
+            level = item['result']['level']
+            self.chart.add_fill(self.clock(), level['price'], level['type'])
+
+    def start(self):
+        self._frame()
+        return self
+
+    def stop(self):
+        if self._after is not None:
+            self.root.after_cancel(self._after)
+            self._after = None
+
+    def _frame(self):
+        try:
+            self.render()
+        except Exception as e:
+            self.core.log(f"Error drawing the chart: {str(e)}")
+        finally:
+            self._after = self.root.after(self.interval, self._frame)
+
+    def render(self):
+        started = time.perf_counter()
+        core, chart = self.core, self.chart
+        now = self.clock()
+        if core.symbol != self.symbol:
+            self.symbol = core.symbol
+            chart.reset()
+            self._levels_dirty = True
+
+        book = core.market_book(self.symbol)
+        if book is not None:
+            chart.add_price(now, book.mid())
+        if core.connected:
+            chart.add_pnl(now, core.total_pnl())
+        if self._levels_dirty:
+            self._levels_dirty = False
+            chart.set_levels([(grid_id, level) for grid_id, grid in core.grids.items()
+                              if grid['symbol'] == self.symbol for level in grid['levels']])
+        if self.canvas.winfo_ismapped():
+            chart.render(now)
+        self.frame_seconds = time.perf_counter() - started
+
+
+class WidgetText:
+    """Configure widgets only when what they show has changed"""
+
+    def __init__(self):
+        self._shown = {}
+
+    def set(self, widget, **options):
+        key = str(widget)
+        if self._shown.get(key) == options:
+            return False
+        widget.config(**options)
+        self._shown[key] = options
+        return True
@@ -0,0 +1,244 @@
+"""Venue adapters: what differs between the ccxt futures venues the bot trades on.
+
+An adapter knows a venue's ccxt client options, how its perpetual symbols
+are written, how leverage is set there and how many orders its batch
+endpoints take. Clients of one venue share a pooled keep-alive HTTP
+session from a SessionPool.
+
+    python -m exchange_adapters probe --venues binanceusdm bybit okx phemex
+"""
+import argparse
+import asyncio
+import time
+
+# Quote currencies recognised when splitting concatenated symbols such as BTCUSDT
+QUOTES = ('USDT', 'USDC', 'USD')
+
+
+class ExchangeAdapter:
+    """Venue specific behaviour behind one interface; the base class suits most ccxt venues"""
+
+    id = None
+    ccxt_id = None  # ccxt class name, when it differs from id
+    options = {}  # ccxt client options, e.g. the default market type
+    settle = 'USDT'  # settlement currency of symbols given without one
+    batch_limit = None  # most orders per create_orders / cancel_orders call; 0 for none, None if unknown
+    needs_password = False  # venues whose API keys come with a passphrase
+
+    def client_config(self, api_key, secret, password=None, session=None):
+        """Constructor config of the ccxt client.
+
+        ccxt's own throttle is off: REST pacing is left to the
+        RequestScheduler. A shared session is not closed with the client.
+        """
+        config = {
+            'enableRateLimit': False,
+            'apiKey': api_key,
+            'secret': secret,
+            'options': dict(self.options)
+        }
+        if password:
+            config['password'] = password
+        if session is not None:
+            config['session'] = session
+        return config
+
+    def configure(self, exchange):
+        """Align the client's capability flags with what the bot can rely on at this venue"""
+        has = getattr(exchange, 'has', None)
+        if has is not None and self.batch_limit == 0:
+            # ccxt emulates some batch calls one request per order; the placers pace those better
+            has['createOrders'] = has['cancelOrders'] = False
+        return exchange
+
+    def normalize_symbol(self, symbol):
+        """Unified perpetual symbol for 'BTC', 'BTCUSDT', 'BTC-USDT-SWAP', 'BTC/USDT' or 'BTC/USDT:USDT'"""
+        if ':' in symbol:
+            return symbol
+        name = symbol.upper().replace('-SWAP', '').replace('_', '-')
+        for separator in ('/', '-'):
+            if separator in name:
+                base, quote = name.split(separator)[:2]
+                break
+        else:
+            quote = next((quote for quote in QUOTES if name.endswith(quote) and len(name) > len(quote)), None)
+            base, quote = (name[:-len(quote)], quote) if quote else (name, self.settle)
+        return f"{base}/{quote}:{quote}"
+
+    def leverage_params(self, symbol):
+        return {}
+
+    async def set_leverage(self, exchange, symbol, leverage):
+        """Set the leverage of symbol; False if the client cannot set leverage at all"""
+        if not hasattr(exchange, 'set_leverage'):
+            return False
+        await exchange.set_leverage(leverage, symbol, self.leverage_params(symbol))
+        return True
+
+
+class BinanceUsdmAdapter(ExchangeAdapter):
+    id = 'binanceusdm'
+    options = {'defaultType': 'future'}
+    batch_limit = 5  # batchOrders takes 5 orders, cancel batches 10
+
+
+class BybitAdapter(ExchangeAdapter):
+    id = 'bybit'
+    options = {'defaultType': 'swap'}
+    batch_limit = 10
+
+    async def set_leverage(self, exchange, symbol, leverage):
+        try:
+            return await super().set_leverage(exchange, symbol, leverage)
+        except Exception as e:
+            # Bybit rejects setting the leverage a symbol already has
+            if '110043' in str(e) or 'not modified' in str(e).lower():
+                return True
+            raise
+
+
+class OkxAdapter(ExchangeAdapter):
+    id = 'okx'
+    options = {'defaultType': 'swap'}
+    batch_limit = 20
+    needs_password = True
+
+    def leverage_params(self, symbol):
+        # OKX sets leverage per margin mode; grids trade cross margin
+        return {'marginMode': 'cross'}
+
+
+class PhemexAdapter(ExchangeAdapter):
+    id = 'phemex'
+    options = {'defaultType': 'swap'}
+    settle = 'USD'
+    batch_limit = 0
+
+
+ADAPTERS = {adapter.id: adapter() for adapter in (BinanceUsdmAdapter, BybitAdapter, OkxAdapter, PhemexAdapter)}
+
+
+def get_adapter(exchange_id):
+    """Adapter of a venue, or a generic one for venues without specifics"""
+    adapter = ADAPTERS.get(exchange_id)
+    if adapter is None:
+        adapter = ExchangeAdapter()
+        adapter.id = exchange_id
+    return adapter
+
+
+class SessionPool:
+    """One keep-alive aiohttp session per venue, shared by every client of that venue.
+
+    Reconnecting or adding a price feed reuses open connections instead of
+    paying for new TCP and TLS handshakes. Sessions belong to the event
+    loop they were created on, so use a pool from one loop only.
+    """
+
+    def __init__(self, limit_per_host=16, keepalive_timeout=60, dns_cache_ttl=300):
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self._sessions = {}  # venue -> aiohttp.ClientSession
+
+    def session(self, venue):
+        """Open session of venue, created on first use"""
+        session = self._sessions.get(venue)
+        if session is None or session.closed:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=self.dns_cache_ttl,
+                                             enable_cleanup_closed=True)
+            session = self._sessions[venue] = aiohttp.ClientSession(connector=connector, trust_env=True)
+        return session
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            if not session.closed:
+                await session.close()
+
+
+def ccxt_module():
+    """ccxt.pro when installed for websocket streams, else plain async ccxt"""
+    try:
+        import ccxt.pro as ccxt_async
+    except ImportError:
+        import ccxt.async_support as ccxt_async
+    return ccxt_async
+
+
+def create_client(exchange_id, api_key=None, secret=None, password=None, pool=None):
+    """Async ccxt client of a venue, configured by its adapter, on the pool's session if given"""
+    adapter = get_adapter(exchange_id)
+    session = pool.session(exchange_id) if pool is not None else None
+    config = adapter.client_config(api_key, secret, password, session)
+    if api_key is None:
+        # Public client: no credentials, and ccxt may pace its own public calls
+        config = {key: value for key, value in config.items() if key not in ('apiKey', 'secret')}
+        config['enableRateLimit'] = True
+    return adapter.configure(getattr(ccxt_module(), adapter.ccxt_id or adapter.id)(config))
+
+
+async def probe_latency(exchange_id, samples=5, pool=None):
+    """Round-trip times in seconds of a venue's public fetch_time, warm connection"""
+    client = create_client(exchange_id, pool=pool)
+    timings = []
+    try:
+        for _ in range(samples + 1):
+            start = time.perf_counter()
+            await client.fetch_time()
+            timings.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+    # The first call pays for the handshake
+    return timings[1:]
+
+
+async def rank_by_latency(exchange_ids, samples=5):
+    """[(exchange id, median seconds or None)] fastest first; unreachable venues last"""
+    pool = SessionPool()
+    try:
+        results = await asyncio.gather(*(probe_latency(exchange_id, samples, pool) for exchange_id in exchange_ids),
+                                       return_exceptions=True)
+    finally:
+        await pool.close()
+    ranked = []
+    for exchange_id, timings in zip(exchange_ids, results):
+        median = sorted(timings)[len(timings) // 2] if isinstance(timings, list) and timings else None
+        ranked.append((exchange_id, median))
+    return sorted(ranked, key=lambda item: (item[1] is None, item[1] or 0))
+
+
+def rank_by_fees(configs, maker_share=1.0):
+    """Venue names of exchange configs cheapest first, for a mix of maker and taker fills"""
+    def cost(name):
+        config = configs[name]
+        return maker_share * config['maker_fee'] + (1 - maker_share) * config['taker_fee']
+    return sorted(configs, key=cost)
+
+
+def main(argv=None):
+    from grid_core import EXCHANGE_CONFIGS
+
+    parser = argparse.ArgumentParser(description="Compare futures venues")
+    sub = parser.add_subparsers(dest='command', required=True)
+    probe = sub.add_parser('probe', help="Rank venues by public REST latency, with their fees")
+    probe.add_argument('--venues', nargs='+', default=list(ADAPTERS))
+    probe.add_argument('--samples', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    fees = {config['id']: config for config in EXCHANGE_CONFIGS.values() if 'price_source' not in config}
+    ranked = asyncio.run(rank_by_latency(args.venues, args.samples))
+    print(f"{'venue':>14} {'p50 ms':>12} {'maker %':>9} {'taker %':>9}")
+    for exchange_id, median in ranked:
+        latency = 'unreachable' if median is None else f"{median * 1000:.1f}"
+        config = fees.get(exchange_id)
+        maker, taker = (f"{config['maker_fee'] * 100:.3f}", f"{config['taker_fee'] * 100:.3f}") if config else ('', '')
+        print(f"{exchange_id:>14} {latency:>12} {maker:>9} {taker:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
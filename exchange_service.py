@@ -0,0 +1,406 @@
+import asyncio
+import functools
+import hashlib
+import itertools
+import queue
+import threading
+import time
+
+from account_state import AccountState, AccountSync
+from exchange_adapters import SessionPool, create_client, get_adapter
+from grid_manager import GridManager
+from kill_switch import KillSwitch
+from ledger import LedgerSync, PnLLedger
+from market_book import MarketBooks
+from market_cache import DEFAULT_MARKETS_CACHE, MarketCache
+from metrics import METRICS, InstrumentedExchange, scheduler_collector
+from paper_exchange import PAPER_EXCHANGE_ID, PaperExchange, create_price_source
+from rate_limiter import limited_read
+from recorder import RecordingExchange
+from risk_engine import RiskEngine
+from state_journal import DEFAULT_JOURNAL, StateJournal
+
+# Quotes reach the results queue at most this often per symbol; the GUI draws no faster
+QUOTE_INTERVAL = 0.1
+
+
+def create_async_exchange(exchange_id, api_key, secret, password=None, pool=None):
+    """Build an async ccxt client through its venue adapter, preferring ccxt.pro for websocket streams.
+
+    ccxt's own throttle is off: it would queue every call equally, so REST
+    pacing is left to the GridManager's RequestScheduler, which serves
+    cancels before orders before reads. With a SessionPool the client
+    shares its venue's keep-alive HTTP session. The 'paper' id gives a
+    simulated account matched locally against live public prices.
+    """
+    if exchange_id == PAPER_EXCHANGE_ID:
+        return PaperExchange(source=create_price_source(pool=pool))
+    return create_client(exchange_id, api_key, secret, password=password, pool=pool)
+
+
+class ExchangeService:
+    """Run all exchange I/O on a background asyncio loop.
+
+    Results of submit() land on the thread-safe results queue as dicts with
+    'id', 'command', 'result' and 'error' keys; call() blocks instead, so the
+    service also works without a GUI. Account changes arrive unsolicited as
+    'account' events, and account_state can be read from any thread.
+    Realized PnL, fees and funding from actual fills arrive as 'pnl' events.
+    With risk_limits, every entry order is checked by a RiskEngine first.
+    """
+
+    COMMANDS = ('connect', 'fetch_account', 'create_grid', 'update_grid', 'remove_grid', 'close_all',
+                'disconnect')
+
+    def __init__(self, exchange_factory=None, reconcile_interval=60, journal_path=DEFAULT_JOURNAL,
+                 markets_path=DEFAULT_MARKETS_CACHE, record_path=None, risk_limits=None):
+        # Clients of one venue share a keep-alive HTTP session across reconnects
+        self.sessions = SessionPool()
+        self.exchange_factory = exchange_factory or functools.partial(create_async_exchange, pool=self.sessions)
+        self.record_path = record_path  # capture of every request, response and stream message
+        self.exchange = None
+        self.manager = None  # GridManager over the shared exchange session
+        self.journal_path = journal_path  # None runs without a state journal
+        self.journal = None
+        self.reconcile_interval = reconcile_interval
+        # Market metadata outlives sessions, so previews can round to tick and lot offline
+        self.markets = MarketCache(markets_path, log=self.log)
+        self.account_state = AccountState(on_change=self._on_account_change)
+        self.account_sync = None
+        self.exchange_id = None
+        self.ledger = PnLLedger(precision=lambda symbol: self.markets.precision(self.exchange_id, symbol),
+                                on_change=lambda snapshot: self.notify('pnl', snapshot))
+        self.ledger_sync = None
+        self.books = None  # MarketBooks of the session, followed for every traded symbol
+        self.risk_limits = risk_limits  # RiskEngine settings, see risk_engine.parse_risk_limits
+        self.risk = None  # RiskEngine of the session
+        self.results = queue.Queue()
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._ids = itertools.count(1)
+        self._collector = None
+        self._quotes_due = set()  # symbols with a quote publication scheduled
+
+    def start(self):
+        """Start the event loop thread"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run_loop, name='exchange-service', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self, timeout=5):
+        """Close the exchange session and stop the loop"""
+        if not self.loop or not self._thread:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.disconnect(), self.loop).result(timeout)
+        except Exception:
+            pass
+        try:
+            asyncio.run_coroutine_threadsafe(self.sessions.close(), self.loop).result(timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    @property
+    def connected(self):
+        return self.exchange is not None
+
+    def submit(self, command, *args, **kwargs):
+        """Queue a command on the loop and return its request id"""
+        if command not in self.COMMANDS:
+            raise ValueError(f"Unknown command: {command}")
+        request_id = next(self._ids)
+        coro = self._execute(request_id, command, getattr(self, command)(*args, **kwargs))
+        asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return request_id
+
+    def call(self, command, *args, timeout=None, **kwargs):
+        """Run a command and block until it finishes (for callers without a UI loop)"""
+        if command not in self.COMMANDS:
+            raise ValueError(f"Unknown command: {command}")
+        future = asyncio.run_coroutine_threadsafe(getattr(self, command)(*args, **kwargs), self.loop)
+        return future.result(timeout)
+
+    def run(self, coro, timeout=None):
+        """Run an arbitrary coroutine on the service loop and wait for it"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def poll_results(self, max_items=100):
+        """Drain up to max_items pending results without blocking"""
+        items = []
+        while len(items) < max_items:
+            try:
+                items.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def notify(self, event, payload):
+        """Push an unsolicited event to whoever drains the results queue"""
+        self.results.put({'id': None, 'command': event, 'result': payload, 'error': None})
+
+    def log(self, message):
+        """Forward a log line to whoever drains the results queue"""
+        self.notify('log', message)
+
+    async def _execute(self, request_id, command, coro):
+        try:
+            result = await coro
+            self.results.put({'id': request_id, 'command': command, 'result': result, 'error': None})
+        except Exception as e:
+            self.results.put({'id': request_id, 'command': command, 'result': None, 'error': str(e)})
+
+    async def connect(self, exchange_id, api_key, secret, symbols=(), password=None):
+        """Create an authenticated client, verify it, recover journaled grids and sync account state.
+
+        password is the API passphrase of venues that have one, such as OKX.
+        Returns {'recovered': [...]} with a snapshot of every grid restarted
+        from the state journal.
+        """
+        await self.disconnect()
+        started = int(time.time() * 1000)
+        if password:
+            exchange = self.exchange_factory(exchange_id, api_key, secret, password=password)
+        else:
+            exchange = self.exchange_factory(exchange_id, api_key, secret)
+        if self.record_path:
+            exchange = RecordingExchange(exchange, self.record_path)
+        # Every REST call is timed into METRICS per venue
+        exchange = InstrumentedExchange(exchange, venue=exchange_id)
+        try:
+            balance = await exchange.fetch_balance()
+        except Exception:
+            await exchange.close()
+            raise
+        self.exchange = exchange
+        self.exchange_id = exchange_id
+        if self.risk_limits:
+            self.risk = RiskEngine(precision=lambda symbol: self.markets.precision(exchange_id, symbol),
+                                   log=self.log, **self.risk_limits)
+        self.manager = GridManager(exchange, log=self.log, on_fill=self._on_fill, on_rearm=self._on_rearm,
+                                   journal=self._open_journal(exchange_id, api_key),
+                                   on_trade=self.ledger.ingest,
+                                   precision=lambda symbol: self.markets.precision(exchange_id, symbol),
+                                   risk=self.risk)
+        # Grids are placed against the live book: crossing levels are skipped, the rest go post-only
+        self.books = self.manager.books = MarketBooks(exchange, log=self.log, limiter=self.manager.limiter,
+                                                      on_update=self._on_book)
+        # Balances are read in the venue's settlement currency
+        self.account_state.currency = ('USD' if exchange_id == PAPER_EXCHANGE_ID
+                                       else get_adapter(exchange_id).settle)
+        self.account_state.apply_balance(balance, source='rest')
+        await self._attach_markets(exchange_id, exchange)
+        if hasattr(self.manager.limiter, 'metrics'):
+            self._collector = scheduler_collector(self.manager.limiter)
+            METRICS.add_collector(self._collector)
+
+        journaled = set()
+        if self.manager.journal is not None:
+            try:
+                self.manager.journal.compact()
+                journaled = {state['symbol'] for state in self.manager.journal.replay().values()}
+            except Exception as e:
+                self.log(f"Error reading the state journal: {str(e)}")
+        self.account_sync = AccountSync(exchange, self.account_state, symbols=set(symbols) | journaled,
+                                        reconcile_interval=self.reconcile_interval,
+                                        log=self.log, limiter=self.manager.limiter,
+                                        on_reconcile=self.risk.apply_account if self.risk else None)
+        if self.risk is not None:
+            # Positions held before connecting count against the limits from the first check on
+            await self.account_sync.reconcile()
+
+        recovered = []
+        if self.manager.journal is not None:
+            try:
+                for item in await self.manager.recover():
+                    snapshot = item.pop('grid').snapshot()
+                    snapshot['recovery'] = item
+                    recovered.append(snapshot)
+            except Exception as e:
+                self.log(f"Error recovering grids from the state journal: {str(e)}")
+
+        # Recovered grids are all journaled, so the account sync already follows their symbols
+        symbols = set(symbols) | {grid['symbol'] for grid in recovered}
+        self.account_sync.start()
+        self._seed_ledger(recovered)
+        self.books.subscribe(symbols)
+        self.ledger_sync = LedgerSync(exchange, self.ledger, symbols=symbols, since=started,
+                                      interval=self.reconcile_interval, log=self.log,
+                                      limiter=self.manager.limiter).start()
+        return {'recovered': recovered}
+
+    def _on_book(self, book):
+        # Other threads get copies of the touch, never the book the streams keep writing
+        if book.symbol not in self._quotes_due:
+            self._quotes_due.add(book.symbol)
+            self.loop.call_later(QUOTE_INTERVAL, self._publish_quote, book)
+
+    def _publish_quote(self, book):
+        self._quotes_due.discard(book.symbol)
+        self.notify('quote', {'symbol': book.symbol, 'bid': book.bid, 'ask': book.ask,
+                              'timestamp': book.timestamp})
+
+    def _on_account_change(self, snapshot):
+        # The risk engine measures against the cached equity instead of fetching it per check
+        if self.risk is not None and snapshot is not None:
+            self.risk.apply_balance(snapshot['balance'])
+        self.notify('account', snapshot)
+
+    def _seed_ledger(self, recovered):
+        """Open ledger lots for fills made before this session: every open counter holds one"""
+        for grid in recovered:
+            for level in grid['levels']:
+                if level.get('counter_of') is not None and level.get('status') == 'open':
+                    side = 'long' if level['type'] == 'sell' else 'short'
+                    self.ledger.seed(grid['symbol'], side, level['size'], level['counter_of'])
+
+    async def _attach_markets(self, exchange_id, exchange):
+        """Hand the client cached markets, loading them only when the cache is stale"""
+        if not hasattr(exchange, 'load_markets'):
+            return
+        try:
+            await self.markets.attach(exchange_id, exchange, load=lambda: limited_read(
+                self.manager.limiter, 'load_markets', exchange.load_markets))
+        except Exception as e:
+            self.log(f"Error loading markets, orders will not be rounded: {str(e)}")
+
+    def _open_journal(self, exchange_id, api_key):
+        """The state journal for this account, or None if journaling is off or it is foreign"""
+        if self.journal_path is None or exchange_id == PAPER_EXCHANGE_ID:
+            # Paper accounts only live in memory, so there is nothing to recover
+            return None
+        if self.journal is None:
+            self.journal = StateJournal(self.journal_path)
+        account = hashlib.sha256(f"{exchange_id}:{api_key}".encode()).hexdigest()[:16]
+        if not self.journal.bind_account(account):
+            self.log(f"State journal {self.journal_path} belongs to another account, "
+                     f"grids will not be journaled or recovered")
+            return None
+        return self.journal
+
+    async def disconnect(self):
+        """Close the current exchange session, if any"""
+        sync, self.account_sync = self.account_sync, None
+        if sync is not None:
+            await sync.stop()
+        self.account_state.reset()
+        ledger_sync, self.ledger_sync = self.ledger_sync, None
+        if ledger_sync is not None:
+            await ledger_sync.stop()
+        self.ledger.reset()
+        books, self.books = self.books, None
+        if books is not None:
+            await books.stop()
+        collector, self._collector = self._collector, None
+        if collector is not None:
+            METRICS.remove_collector(collector)
+        manager, self.manager = self.manager, None
+        if manager is not None:
+            await manager.stop()
+        self.risk = None
+        exchange, self.exchange = self.exchange, None
+        if exchange is not None:
+            await exchange.close()
+
+    def _require_exchange(self):
+        if self.exchange is None:
+            raise ValueError("Please connect to exchange first")
+        return self.exchange
+
+    async def fetch_account(self, symbols):
+        """Reconcile the account cache over REST now and return the fresh snapshot"""
+        self._require_exchange()
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        self.account_sync.add_symbols(symbols)
+        return await self.account_sync.reconcile()
+
+    async def create_grid(self, symbol, levels, leverage, grid_step=None, take_profit=None, grid_id=None,
+                          trailing=None):
+        """Set leverage, place every grid level and start reacting to fills (and to the price when trailing)"""
+        self._require_exchange()
+        tracked = symbol in self.account_sync.symbols
+        self.account_sync.add_symbols([symbol])
+        self.ledger_sync.add_symbols([symbol])
+        self.books.subscribe([symbol])
+        if self.risk is not None and not tracked:
+            # A position already held on a new symbol must count before its levels are checked
+            await self.account_sync.reconcile()
+        grid = await self.manager.add_grid(symbol, levels, leverage, grid_step=grid_step,
+                                           take_profit=take_profit, grid_id=grid_id, trailing=trailing)
+        return grid.snapshot()
+
+    async def update_grid(self, grid_id, levels, leverage, grid_step=None, take_profit=None):
+        """Reconcile a running grid onto new levels with the fewest order changes"""
+        self._require_exchange()
+        grid, summary = await self.manager.update_grid(grid_id, levels, leverage, grid_step=grid_step,
+                                                       take_profit=take_profit)
+        snapshot = grid.snapshot()
+        snapshot['reconcile'] = summary
+        return snapshot
+
+    async def remove_grid(self, grid_id, cancel_orders=True):
+        """Stop one grid, leaving other grids on the same symbol running"""
+        self._require_exchange()
+        grid = await self.manager.remove_grid(grid_id, cancel_orders=cancel_orders)
+        return {'grid_id': grid.grid_id, 'symbol': grid.symbol}
+
+    def _on_fill(self, grid, level, counter):
+        self.notify('fill', {
+            'grid_id': grid.grid_id,
+            'symbol': grid.symbol,
+            'level': dict(level),
+            'counter': dict(counter)
+        })
+
+    def _on_rearm(self, grid, counter):
+        self.notify('rearm', {
+            'grid_id': grid.grid_id,
+            'index': next(i for i, level in enumerate(grid.levels) if level is counter),
+            'counter': dict(counter)
+        })
+
+    async def close_all(self, symbols=None):
+        """Stop the grids on symbols, then cancel every order and close every position there.
+
+        Without symbols, every symbol with a grid, a tracked account or a
+        cached position is flattened.
+        """
+        exchange = self._require_exchange()
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        cached = self.account_state.snapshot()
+        if symbols is None:
+            symbols = {grid.symbol for grid in self.manager.grids.values()}
+            symbols |= set(self.account_sync.symbols if self.account_sync else ())
+            symbols |= {position['symbol'] for position in (cached or {}).get('positions', [])}
+            symbols = sorted(symbols)
+
+        # Engines stop first so no counter order is placed while flattening
+        grids = []
+        for symbol in symbols:
+            grids.extend(await self.manager.remove_symbol(symbol))
+
+        kill_switch = KillSwitch(exchange, limiter=self.manager.limiter, log=self.log)
+        report = await kill_switch.flatten(symbols, positions=cached['positions'] if cached else None)
+        report['grid_ids'] = [grid.grid_id for grid in grids]
+        return report
@@ -0,0 +1,309 @@
+import asyncio
+import itertools
+import threading
+import time
+
+
+class FakeExchange:
+    """In-memory stand-in for a ccxt exchange with configurable request latency"""
+
+    def __init__(self, latency=0.05, rate_limit=0, batch=False, batch_limit=20, balance=10000.0,
+                 maker_fee=0.0001, taker_fee=0.0006):
+        self.latency = latency
+        self.rateLimit = rate_limit
+        self.batch_limit = batch_limit
+        self.has = {
+            'createOrders': batch,
+            'cancelOrders': batch,
+            'editOrder': True,
+            'cancelAllOrders': True,
+            'fetchPositions': True,
+            'fetchClosedOrders': True,
+            'fetchMyTrades': True,
+        }
+        self.balance = balance
+        self.orders = {}
+        self.closed_orders = {}  # filled or cancelled orders by id
+        self.positions = {}
+        self.trades = []  # own fills, oldest first
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.last_price = None  # market orders fill here; no trade is recorded while unknown
+        self.request_count = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _request(self):
+        """Simulate one REST round-trip"""
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _new_order(self, symbol, type, side, amount, price=None, params=None):
+        with self._lock:
+            order_id = str(next(self._ids))
+            order = {
+                'id': order_id,
+                'symbol': symbol,
+                'type': type,
+                'side': side,
+                'amount': amount,
+                'price': price,
+                'filled': 0.0,
+                'status': 'open' if type == 'limit' else 'closed',
+                'timestamp': int(time.time() * 1000),
+                'info': params or {},
+            }
+            if type == 'limit':
+                self.orders[order_id] = order
+            else:
+                amount = self._apply_market(symbol, side, amount, (params or {}).get('reduceOnly'))
+                order['filled'] = amount
+        fill_price = price or self.last_price
+        if type != 'limit' and amount > 0 and fill_price:
+            self.record_trade(order, fill_price, self.taker_fee, amount)
+        return dict(order)
+
+    def record_trade(self, order, price, fee_rate=None, amount=None):
+        """Store a fill of order at price (all of it by default); returns the ccxt style trade"""
+        rate = self.maker_fee if fee_rate is None else fee_rate
+        amount = order['amount'] if amount is None else amount
+        trade = {
+            'id': f"t{order['id']}",
+            'order': order['id'],
+            'symbol': order['symbol'],
+            'side': order['side'],
+            'amount': amount,
+            'price': price,
+            'timestamp': int(time.time() * 1000),
+            'fee': {'cost': amount * price * rate, 'currency': 'USD'},
+        }
+        with self._lock:
+            self.trades.append(trade)
+        return dict(trade)
+
+    def _apply_market(self, symbol, side, amount, reduce_only):
+        """Move the one-way position of symbol by an immediately filled market order"""
+        position = self.positions.get(symbol)
+        signed = (position['contracts'] if position['side'] == 'long' else -position['contracts']) if position else 0.0
+        delta = amount if side == 'buy' else -amount
+        if reduce_only:
+            # Reduce-only never flips or grows the position
+            delta = max(-signed, min(0.0, delta)) if signed > 0 else min(-signed, max(0.0, delta))
+        signed += delta
+        filled = abs(delta)
+        if abs(signed) < 1e-12:
+            self.positions.pop(symbol, None)
+        else:
+            self.positions[symbol] = {'symbol': symbol, 'side': 'long' if signed > 0 else 'short',
+                                      'contracts': abs(signed), 'notional': 0.0, 'unrealizedPnl': 0.0}
+        return filled
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        self._request()
+        return self._new_order(symbol, type, side, amount, price, params)
+
+    def create_limit_buy_order(self, symbol, amount, price, params={}):
+        return self.create_order(symbol, 'limit', 'buy', amount, price, params)
+
+    def create_limit_sell_order(self, symbol, amount, price, params={}):
+        return self.create_order(symbol, 'limit', 'sell', amount, price, params)
+
+    def create_market_buy_order(self, symbol, amount, params={}):
+        return self.create_order(symbol, 'market', 'buy', amount, None, params)
+
+    def create_market_sell_order(self, symbol, amount, params={}):
+        return self.create_order(symbol, 'market', 'sell', amount, None, params)
+
+    def create_orders(self, orders, params={}):
+        if not self.has['createOrders']:
+            raise NotImplementedError('createOrders() is not supported')
+        if len(orders) > self.batch_limit:
+            raise ValueError(f'createOrders() accepts at most {self.batch_limit} orders')
+        self._request()
+        return [self._new_order(o['symbol'], o['type'], o['side'], o['amount'],
+                                o.get('price'), o.get('params')) for o in orders]
+
+    def cancel_order(self, id, symbol=None, params={}):
+        self._request()
+        with self._lock:
+            order = self.orders.pop(id, None)
+        if order is None:
+            raise ValueError(f'Order {id} not found')
+        order['status'] = 'canceled'
+        self.closed_orders[id] = order
+        return order
+
+    def cancel_all_orders(self, symbol=None, params={}):
+        self._request()
+        with self._lock:
+            ids = [id for id, o in self.orders.items() if symbol is None or o['symbol'] == symbol]
+            orders = [self.orders.pop(id) for id in ids]
+            for order in orders:
+                order['status'] = 'canceled'
+                self.closed_orders[order['id']] = order
+        return orders
+
+    def cancel_orders(self, ids, symbol=None, params={}):
+        if not self.has['cancelOrders']:
+            raise NotImplementedError('cancelOrders() is not supported')
+        if len(ids) > self.batch_limit:
+            raise ValueError(f'cancelOrders() accepts at most {self.batch_limit} orders')
+        self._request()
+        with self._lock:
+            orders = [self.orders.pop(id, None) for id in ids]
+        for order in orders:
+            if order is not None:
+                order['status'] = 'canceled'
+                self.closed_orders[order['id']] = order
+        return [order for order in orders if order is not None]
+
+    def edit_order(self, id, symbol, type, side, amount=None, price=None, params={}):
+        self._request()
+        with self._lock:
+            order = self.orders.get(id)
+            if order is None:
+                raise ValueError(f'Order {id} not found')
+            if amount is not None:
+                order['amount'] = amount
+            if price is not None:
+                order['price'] = price
+            return dict(order)
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._request()
+        with self._lock:
+            return [dict(o) for o in self.orders.values() if symbol is None or o['symbol'] == symbol]
+
+    def fetch_closed_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._request()
+        with self._lock:
+            return [dict(o) for o in self.closed_orders.values()
+                    if (symbol is None or o['symbol'] == symbol) and (since is None or o['timestamp'] >= since)]
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None, params={}):
+        self._request()
+        with self._lock:
+            trades = [dict(t) for t in self.trades
+                      if (symbol is None or t['symbol'] == symbol) and (since is None or t['timestamp'] >= since)]
+        return trades[:limit] if limit else trades
+
+    def fetch_balance(self, params={}):
+        self._request()
+        return {'USD': {'free': self.balance, 'used': 0.0, 'total': self.balance}}
+
+    def fetch_positions(self, symbols=None, params={}):
+        self._request()
+        with self._lock:
+            return [dict(p) for s, p in self.positions.items() if symbols is None or s in symbols]
+
+
+class AsyncFakeExchange:
+    """asyncio facade over FakeExchange, mirroring ccxt.async_support"""
+
+    def __init__(self, latency=0.05, **kwargs):
+        self.sync = FakeExchange(latency=0, **kwargs)
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return call
+
+    async def close(self):
+        pass
+
+
+class FakeStreamExchange(AsyncFakeExchange):
+    """AsyncFakeExchange with ccxt.pro style private order, trade and account streams.
+
+    Fills are injected with fill() or by replaying a price path through
+    move_price(), so fill sequences can be replayed deterministically.
+    Balance and position changes are injected with set_balance() and
+    set_position().
+    """
+
+    def __init__(self, latency=0.0, emit_trades=True, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.sync.has.update({'watchOrders': True, 'watchMyTrades': True,
+                              'watchBalance': True, 'watchPositions': True})
+        self.emit_trades = emit_trades
+        self.order_updates = asyncio.Queue()
+        self.trade_updates = asyncio.Queue()
+        self.balance_updates = asyncio.Queue()
+        self.position_updates = asyncio.Queue()
+        self.fill_times = {}  # order id -> perf_counter() when the fill was emitted
+
+    def fill(self, order_id, price=None):
+        """Fill a resting order completely and publish it on the streams"""
+        with self.sync._lock:
+            order = self.sync.orders.pop(order_id, None)
+        if order is None:
+            return None
+
+        fill_price = order['price'] if price is None else price
+        order.update({'status': 'closed', 'filled': order['amount'], 'average': fill_price})
+        self.sync.closed_orders[order_id] = order
+        self.fill_times[order_id] = time.perf_counter()
+
+        trade = self.sync.record_trade(order, fill_price)
+        self.order_updates.put_nowait(dict(order))
+        if self.emit_trades:
+            self.trade_updates.put_nowait(trade)
+        return order
+
+    def move_price(self, price):
+        """Fill every resting order the given trade price crosses"""
+        self.sync.last_price = price
+        with self.sync._lock:
+            crossed = [o['id'] for o in self.sync.orders.values()
+                       if (o['side'] == 'buy' and price <= o['price'])
+                       or (o['side'] == 'sell' and price >= o['price'])]
+        return [self.fill(order_id) for order_id in crossed]
+
+    def set_balance(self, total):
+        """Change the account balance and publish it on the balance stream"""
+        self.sync.balance = total
+        self.balance_updates.put_nowait({'USD': {'free': total, 'used': 0.0, 'total': total}})
+
+    def set_position(self, symbol, side, contracts, notional=0.0, unrealized_pnl=0.0):
+        """Change a position and publish it on the position stream"""
+        position = {'symbol': symbol, 'side': side, 'contracts': contracts,
+                    'notional': notional, 'unrealizedPnl': unrealized_pnl}
+        with self.sync._lock:
+            if contracts:
+                self.sync.positions[symbol] = position
+            else:
+                self.sync.positions.pop(symbol, None)
+        self.position_updates.put_nowait(dict(position))
+
+    async def replay_prices(self, prices, interval=0.0):
+        """Replay a price path, yielding to the event loop between ticks"""
+        for price in prices:
+            self.move_price(price)
+            await asyncio.sleep(interval)
+
+    async def _drain(self, updates):
+        items = [await updates.get()]
+        while not updates.empty():
+            items.append(updates.get_nowait())
+        return items
+
+    async def watch_orders(self, symbol=None, since=None, limit=None, params={}):
+        return await self._drain(self.order_updates)
+
+    async def watch_my_trades(self, symbol=None, since=None, limit=None, params={}):
+        return await self._drain(self.trade_updates)
+
+    async def watch_balance(self, params={}):
+        return (await self._drain(self.balance_updates))[-1]
+
+    async def watch_positions(self, symbols=None, since=None, limit=None, params={}):
+        return await self._drain(self.position_updates)
@@ -0,0 +1,562 @@
+from collections import deque
+from datetime import datetime
+import os
+import json
+
+import numpy as np
+
+from exchange_adapters import get_adapter
+from exchange_service import ExchangeService
+from grid_generators import SIZINGS, SPACINGS, generate_grid, geometric_count
+from market_book import L2Book
+from market_data import MarketDataStore
+from trailing import parse_trailing
+
+# Available exchanges and their configurations
+EXCHANGE_CONFIGS = {
+    'Phemex': {
+        'id': 'phemex',
+        'markets': ['BTC/USD:USD', 'ETH/USD:USD', 'SOL/USD:USD'],
+        'type': 'future',
+        'maker_fee': 0.0001,
+        'taker_fee': 0.0006
+    },
+    'Binance USDⓈ-M': {
+        'id': 'binanceusdm',
+        'markets': ['BTC/USDT:USDT', 'ETH/USDT:USDT', 'SOL/USDT:USDT'],
+        'type': 'future',
+        'maker_fee': 0.0002,
+        'taker_fee': 0.0005
+    },
+    'Bybit': {
+        'id': 'bybit',
+        'markets': ['BTC/USDT:USDT', 'ETH/USDT:USDT', 'SOL/USDT:USDT'],
+        'type': 'future',
+        'maker_fee': 0.0002,
+        'taker_fee': 0.00055
+    },
+    'OKX': {
+        'id': 'okx',
+        'markets': ['BTC/USDT:USDT', 'ETH/USDT:USDT', 'SOL/USDT:USDT'],
+        'type': 'future',
+        'maker_fee': 0.0002,
+        'taker_fee': 0.0005,
+        'needs_password': True
+    },
+    # Simulated account matched locally against live Phemex prices
+    'Paper': {
+        'id': 'paper',
+        'price_source': 'phemex',
+        'markets': ['BTC/USD:USD', 'ETH/USD:USD', 'SOL/USD:USD'],
+        'type': 'future',
+        'maker_fee': 0.0001,
+        'taker_fee': 0.0006
+    }
+}
+
+
+# Candles volatility spacing weights its levels by, read from the local market data store
+VOLATILITY_TIMEFRAME = '1h'
+VOLATILITY_LOOKBACK = 30 * 24
+
+# Fills kept in TradingCore.trade_history
+TRADE_HISTORY_LIMIT = 1000
+
+
+# Configuration Management
+class ConfigManager:
+    CONFIG_FILE = 'grid_trading_config.json'
+
+    @classmethod
+    def load_config(cls):
+        """Load configuration from a JSON file"""
+        try:
+            if os.path.exists(cls.CONFIG_FILE):
+                with open(cls.CONFIG_FILE, 'r') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"Error loading config: {e}")
+        return {}
+
+    @classmethod
+    def save_config(cls, config):
+        """Save configuration to a JSON file"""
+        try:
+            with open(cls.CONFIG_FILE, 'w') as f:
+                json.dump(config, f, indent=4)
+        except Exception as e:
+            print(f"Error saving config: {e}")
+
+
+def print_log(message):
+    """Default logger for running without a GUI"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"{timestamp}: {message}", flush=True)
+
+
+def parse_grid_params(raw):
+    """Convert raw grid settings (GUI strings or config values) into typed parameters.
+
+    Custom grids give 'levels' (prices, optionally with 'weights') instead of
+    a price range; geometric grids may give 'spacing_pct' instead of a level
+    count.
+    """
+    custom = raw.get('levels')
+    params = {
+        'name': raw.get('name'),
+        'symbol': raw.get('symbol'),
+        'spacing': raw.get('spacing') or ('custom' if custom else 'arithmetic'),
+        'sizing': raw.get('sizing') or 'quote',
+        'num_grids': int(raw.get('num_grids', 10)),
+        'investment': float(raw.get('investment', 100)),
+        'leverage': int(raw.get('leverage', 1)),
+        'direction': raw.get('direction', 'Long'),
+        'trailing': parse_trailing(raw.get('trailing'))
+    }
+
+    if params['spacing'] not in SPACINGS:
+        raise ValueError(f"Spacing must be one of {', '.join(SPACINGS)}")
+    if params['sizing'] not in SIZINGS:
+        raise ValueError(f"Sizing must be one of {', '.join(SIZINGS)}")
+
+    if params['spacing'] == 'custom':
+        if not custom:
+            raise ValueError("Custom spacing needs a list of levels")
+        weights = raw.get('weights') or [1.0] * len(custom)
+        if len(weights) != len(custom):
+            raise ValueError("Need one weight per custom level")
+        pairs = sorted(zip((float(price) for price in custom), (float(weight) for weight in weights)),
+                       reverse=True)
+        if len({price for price, _ in pairs}) != len(pairs):
+            raise ValueError("Custom levels must have distinct prices")
+        params['levels'] = [price for price, _ in pairs]
+        params['weights'] = [weight for _, weight in pairs]
+        params['upper_price'] = params['levels'][0]
+        params['lower_price'] = params['levels'][-1]
+        params['num_grids'] = len(pairs)
+    else:
+        params['upper_price'] = float(raw['upper_price'])
+        params['lower_price'] = float(raw['lower_price'])
+
+    if params['upper_price'] <= params['lower_price']:
+        raise ValueError("Upper price must be greater than lower price")
+
+    if params['spacing'] == 'geometric' and raw.get('spacing_pct'):
+        params['num_grids'] = geometric_count(params['lower_price'], params['upper_price'],
+                                              float(raw['spacing_pct']))
+
+    if params['num_grids'] < 2:
+        raise ValueError("Number of grids must be at least 2")
+
+    if params['direction'] not in ('Long', 'Short'):
+        raise ValueError("Direction must be Long or Short")
+
+    if params['trailing'] and params['spacing'] not in ('arithmetic', 'geometric'):
+        raise ValueError("Only arithmetic and geometric grids can trail the price")
+
+    return params
+
+
+def build_grid_levels(params, precision=None, closes=None):
+    """Compute the grid ladder, returning (levels, grid_step, investment_per_grid).
+
+    Levels come from grid_generators; each carries the 'exit' price its
+    counter order goes to. grid_step is None unless the spacing is
+    arithmetic. With a MarketPrecision the whole ladder is rounded to the
+    market's tick and lot in one pass and sizes are expressed in contracts;
+    levels under the market minimum raise ValueError before anything is sent.
+    """
+    ladder = generate_grid(params, closes)
+    prices, exits, sizes = ladder['prices'], ladder['exits'], ladder['sizes']
+    grid_step = ladder['grid_step']
+    investment_per_grid = params['investment'] / len(prices)
+    side = 'buy' if params['direction'] == "Long" else 'sell'
+
+    if precision is not None:
+        prices, sizes = precision.apply(prices, sizes)
+        exits = precision.round_prices(exits)
+        notionals = precision.notional(sizes, prices)
+        if grid_step is not None:
+            grid_step = float(precision.round_prices(np.float64(grid_step)))
+    else:
+        notionals = sizes * prices
+
+    levels = [{
+        'price': float(price),
+        'size': float(size),
+        'notional': float(notional),
+        'exit': float(exit_),
+        'type': side
+    } for price, size, notional, exit_ in zip(prices, sizes, notionals, exits)]
+    return levels, grid_step, investment_per_grid
+
+
+class TradingCore:
+    """Trading state and exchange commands shared by the GUI and the headless daemon.
+
+    Front ends call process_results() periodically; every service result is
+    applied to the core state first and then handed to registered listeners.
+    """
+
+    def __init__(self, service=None, log=None, persist_credentials=True):
+        self.service = service or ExchangeService()
+        self.log = log or print_log
+        self.persist_credentials = persist_credentials
+        self.exchange_configs = EXCHANGE_CONFIGS
+        self.exchange_name = 'Phemex'
+        self.symbol = 'BTC/USD:USD'  # Updated to Phemex default
+        self.grids = {}  # grid id -> snapshot of that grid's state
+        self.level_index = {}  # grid id -> {order id: index of its level in the snapshot}
+        self.books = {}  # symbol -> L2Book of the last quote the service published
+        self.listeners = []
+
+        # Trading parameters
+        self.grid_size = 10  # Number of grid levels
+        self.position_size = 100  # Size of each grid position in USDT
+        self.take_profit = 2.0  # Take profit percentage, used when a grid has no step
+        self.leverage = 1  # Default leverage
+
+        # PnL tracking; pnl is the service ledger's snapshot of realized PnL, fees and funding
+        self.pnl = None
+        self.start_balance = 0
+        self.account = None
+        self.trade_history = deque(maxlen=TRADE_HISTORY_LIMIT)
+
+        self.account_request_pending = False
+        self._pending_api_key = None
+        self.handlers = {
+            'log': self._on_log,
+            'connect': self._on_connect,
+            'fetch_account': self._on_account,
+            'account': self._on_account,
+            'pnl': self._on_pnl,
+            'quote': self._on_quote,
+            'create_grid': self._on_create_grid,
+            'update_grid': self._on_update_grid,
+            'fill': self._on_fill,
+            'rearm': self._on_rearm,
+            'close_all': self._on_close_all,
+            'remove_grid': self._on_remove_grid
+        }
+
+    @property
+    def connected(self):
+        return self.service.connected
+
+    @property
+    def grid_levels(self):
+        """Levels of every grid running on the selected symbol"""
+        return [level for grid in self.grids.values() if grid['symbol'] == self.symbol
+                for level in grid['levels']]
+
+    def grid_symbols(self):
+        return sorted({grid['symbol'] for grid in self.grids.values()} | {self.symbol})
+
+    def start(self):
+        self.service.start()
+        return self
+
+    def stop(self):
+        self.service.stop()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def process_results(self):
+        """Apply pending service results to the core state and notify listeners"""
+        items = self.service.poll_results()
+        for item in items:
+            handler = self.handlers.get(item['command'])
+            if handler:
+                handler(item)
+            for listener in self.listeners:
+                listener(item)
+        return items
+
+    def connect(self, api_key, secret, exchange_name='Phemex', symbol=None, password=None):
+        """Ask the service to create an authenticated exchange client"""
+        exchange_config = self.exchange_configs[exchange_name]
+        if exchange_config.get('needs_password') and not password:
+            raise ValueError(f"{exchange_name} API keys need their passphrase")
+        self.exchange_name = exchange_name
+        if symbol:
+            self.symbol = self.normalize_symbol(symbol)
+        self._pending_api_key = api_key
+        # Quotes of the previous session are stale; the new one publishes its own
+        self.books = {}
+        return self.service.submit('connect', exchange_config['id'], api_key, secret,
+                                   symbols=self.grid_symbols(), password=password)
+
+    def normalize_symbol(self, symbol):
+        """symbol in the selected venue's unified form, e.g. 'BTCUSDT' -> 'BTC/USDT:USDT'"""
+        config = self.exchange_configs[self.exchange_name]
+        return get_adapter(config.get('price_source', config['id'])).normalize_symbol(symbol)
+
+    def request_account(self):
+        """Force a REST reconciliation of the account cache unless one is in flight.
+
+        The cache normally follows the exchange's balance and position streams,
+        and its changes arrive as 'account' events without any request.
+        """
+        if not self.connected or self.account_request_pending:
+            return None
+        self.account_request_pending = True
+        return self.service.submit('fetch_account', self.grid_symbols())
+
+    def market_precision(self, symbol):
+        """Tick and lot table of symbol from the market cache, or None if it was never loaded"""
+        exchange_id = self.exchange_configs[self.exchange_name]['id']
+        return self.service.markets.precision(exchange_id, symbol)
+
+    def price_history(self, symbol):
+        """Recent closes of symbol from the local market data store"""
+        config = self.exchange_configs[self.exchange_name]
+        exchange_id = config.get('price_source', config['id'])
+        candles = MarketDataStore(exchange_id=exchange_id).load_ohlcv(symbol, VOLATILITY_TIMEFRAME)
+        if len(candles) < 2:
+            raise ValueError(f"No {VOLATILITY_TIMEFRAME} candles stored for {symbol}, run "
+                             f"python -m market_data sync --symbol {symbol} --timeframe {VOLATILITY_TIMEFRAME}")
+        return np.array(candles[-VOLATILITY_LOOKBACK:, 4])
+
+    def build_levels(self, params, symbol):
+        """Ladder for symbol, rounded to its market and weighted by its history where needed"""
+        closes = self.price_history(symbol) if params['spacing'] == 'volatility' else None
+        return build_grid_levels(params, self.market_precision(symbol), closes)
+
+    def total_pnl(self):
+        """Realized PnL net of actual fees and funding, plus the exchange's unrealized PnL"""
+        unrealized = self.account['unrealized_pnl'] if self.account else 0
+        return (self.pnl['net'] if self.pnl else 0) + unrealized
+
+    def preview_grid(self, params):
+        """Log grid levels and investment details without trading"""
+        symbol = params.get('symbol') or self.symbol
+        levels, grid_step, investment_per_grid = self.build_levels(params, symbol)
+
+        self.log("\n=== Grid Preview ===")
+        self.log(f"Direction: {params['direction']}")
+        self.log(f"Price Range: {params['lower_price']:.2f} - {params['upper_price']:.2f} USD")
+        if grid_step is not None:
+            self.log(f"Grid Step: {grid_step:.2f} USD")
+        else:
+            gaps = [abs(a['price'] - b['price']) for a, b in zip(levels, levels[1:])]
+            self.log(f"Spacing: {params['spacing']}, steps {min(gaps):.2f} - {max(gaps):.2f} USD")
+        self.log(f"Number of Grids: {params['num_grids']}")
+        self.log(f"Total Investment: {params['investment']:.2f} USD")
+        self.log(f"Investment per Grid: {investment_per_grid:.2f} USD")
+        self.log(f"Leverage: {params['leverage']}x")
+        trailing = params.get('trailing')
+        if trailing:
+            self.log(f"Trailing: {trailing['mode']} once {trailing['threshold']:g} steps out of range "
+                     f"for {trailing['debounce']:g}s")
+        book = self.market_book(symbol)
+        if book is not None:
+            self.log(f"Market: bid {book.best_bid():.2f} / ask {book.best_ask():.2f} USD")
+
+        self.log("\nGrid Levels:")
+        precision = self.market_precision(symbol)
+        tick = precision.tick if precision is not None and precision.tick else None
+        for i, level in enumerate(levels):
+            line = f"Level {i+1}: {level['price']:.2f} USD - Size: {level['size']:.4f}"
+            if book is not None and book.crosses(level['type'], level['price']):
+                line += " - crosses the book, will be skipped"
+                if tick is not None:
+                    line += f" (post-only at {book.post_only_price(level['type'], level['price'], tick):.2f})"
+            self.log(line)
+        return levels
+
+    def market_book(self, symbol):
+        """Top of symbol's live book while connected and quoted, else None"""
+        book = self.books.get(symbol) if self.connected else None
+        return book if book is not None and book.bid is not None and book.ask is not None else None
+
+    def create_grid(self, params):
+        """Build the ladder and hand it to the exchange service"""
+        if not self.connected:
+            raise ValueError("Please connect to exchange first")
+
+        symbol = self.normalize_symbol(params.get('symbol') or self.symbol)
+        levels, grid_step, _ = self.build_levels(params, symbol)
+
+        self.log("\n=== Creating Grid Bot ===")
+        self.log(f"Setting up {params['direction']} grid on {symbol}...")
+
+        # Leverage and the whole ladder are sent from the exchange service,
+        # which then re-arms each filled level one grid step away
+        return self.service.submit('create_grid', symbol, levels, params['leverage'],
+                                   grid_step=grid_step, take_profit=self.take_profit,
+                                   grid_id=params.get('name'), trailing=params.get('trailing'))
+
+    def update_grid(self, grid_id, params):
+        """Move a running grid onto new parameters, changing only the orders that differ"""
+        if not self.connected:
+            raise ValueError("Please connect to exchange first")
+        if grid_id not in self.grids:
+            raise ValueError(f"Unknown grid {grid_id}")
+
+        levels, grid_step, _ = self.build_levels(params, self.grids[grid_id]['symbol'])
+        self.log(f"\n=== Updating Grid {grid_id} ===")
+        return self.service.submit('update_grid', grid_id, levels, params['leverage'],
+                                   grid_step=grid_step, take_profit=self.take_profit)
+
+    def remove_grid(self, grid_id, cancel_orders=True):
+        """Stop one grid without touching other grids on the same symbol"""
+        if not self.connected:
+            raise ValueError("Please connect to exchange first")
+        return self.service.submit('remove_grid', grid_id, cancel_orders=cancel_orders)
+
+    def close_all(self, symbol=None):
+        """Cancel open orders and close positions for one symbol, or for every symbol"""
+        if not self.connected:
+            raise ValueError("Please connect to exchange first")
+
+        self.log("\n=== Closing All Positions ===")
+        return self.service.submit('close_all', [symbol] if symbol else None)
+
+    def _mirror(self, grid):
+        """Take a grid snapshot from the service and index its levels by order id"""
+        self.grids[grid['grid_id']] = grid
+        self.level_index[grid['grid_id']] = {level['order']['id']: i for i, level in enumerate(grid['levels'])
+                                             if (level.get('order') or {}).get('id')}
+
+    def _on_log(self, item):
+        self.log(item['result'])
+
+    def _on_connect(self, item):
+        if item['error']:
+            self.log(f"API connection failed: {item['error']}")
+            return
+
+        # Save configuration
+        if self.persist_credentials:
+            config = {
+                'last_exchange': self.exchange_name,
+                'api_key': self._pending_api_key
+            }
+            ConfigManager.save_config(config)
+        self.log("API connection successful")
+
+        for grid in item['result']['recovered']:
+            recovery = grid.pop('recovery')
+            self._mirror(grid)
+            self.log(f"Recovered grid {grid['grid_id']} on {grid['symbol']}: {recovery['open']} orders open, "
+                     f"{recovery['filled']} filled while offline, {recovery['replaced']} placed again")
+
+    def _on_account(self, item):
+        if item['command'] == 'fetch_account':
+            self.account_request_pending = False
+        if item['error']:
+            self.log(f"Error updating account overview: {item['error']}")
+            return
+
+        if item['result'] is None:
+            return
+        self.account = item['result']
+
+        # Store initial balance if not set
+        if self.start_balance == 0:
+            self.start_balance = self.account['balance']
+
+    def _on_create_grid(self, item):
+        if item['error']:
+            self.log(f"Error creating grid bot: {item['error']}")
+            return
+
+        grid = item['result']
+        self._mirror(grid)
+        levels = grid['levels']
+
+        for level in levels:
+            price = level['price']
+            side = "Long" if level['type'] == 'buy' else "Short"
+            if level['status'] == 'open':
+                self.log(f"Created {side} order at {price:.2f} USD")
+            else:
+                self.log(f"Error creating order at {price:.2f}: {level['error']}")
+
+        placed = sum(1 for level in levels if level['status'] == 'open')
+        self.log(f"Placed {placed}/{len(levels)} orders for grid {grid['grid_id']}")
+        self.log("Grid bot created successfully!")
+
+    def _on_update_grid(self, item):
+        if item['error']:
+            self.log(f"Error updating grid: {item['error']}")
+            return
+
+        grid = item['result']
+        summary = grid.pop('reconcile')
+        self._mirror(grid)
+
+        for level in grid['levels']:
+            if level['status'] == 'failed':
+                self.log(f"Error creating order at {level['price']:.2f}: {level['error']}")
+        self.log(f"Grid {grid['grid_id']} updated: {summary['kept']} kept, {summary['amended']} amended, "
+                 f"{summary['cancelled']} cancelled, {summary['created']} created")
+        if summary.get('blocked'):
+            self.log(f"{summary['blocked']} levels blocked by the risk limits")
+
+    def _on_pnl(self, item):
+        self.pnl = item['result']
+
+    def _on_quote(self, item):
+        quote = item['result']
+        book = self.books.get(quote['symbol'])
+        if book is None:
+            book = self.books[quote['symbol']] = L2Book(quote['symbol'], depth=1)
+        book.reset([quote['bid']] if quote['bid'] else [], [quote['ask']] if quote['ask'] else [],
+                   quote['timestamp'])
+
+    def _on_fill(self, item):
+        level = item['result']['level']
+        counter = item['result']['counter']
+        self.trade_history.append(item['result'])
+
+        # Mirror the fill into the grid snapshot: the counter takes the filled level's place
+        grid_id = item['result']['grid_id']
+        grid = self.grids.get(grid_id)
+        if grid is not None:
+            index = self.level_index[grid_id]
+            i = index.pop((level.get('order') or {}).get('id'), None)
+            if i is None:
+                i = len(grid['levels'])
+                grid['levels'].append(counter)
+            else:
+                grid['levels'][i] = counter
+            if (counter.get('order') or {}).get('id'):
+                index[counter['order']['id']] = i
+
+        self.log(f"[{item['result']['grid_id']}] Filled {level['type']} at {level['price']:.2f} USD")
+        if counter['status'] == 'open':
+            self.log(f"Placed counter {counter['type']} at {counter['price']:.2f} USD")
+        elif counter['status'] == 'pending':
+            self.log(f"Holding counter {counter['type']} at {counter['price']:.2f} USD until the book moves")
+
+    def _on_rearm(self, item):
+        counter = item['result']['counter']
+        grid = self.grids.get(item['result']['grid_id'])
+        if grid is not None and item['result']['index'] < len(grid['levels']):
+            grid['levels'][item['result']['index']] = counter
+            self.level_index[grid['grid_id']][counter['order']['id']] = item['result']['index']
+        self.log(f"[{item['result']['grid_id']}] Placed counter {counter['type']} at {counter['price']:.2f} USD")
+
+    def _on_close_all(self, item):
+        if item['error']:
+            self.log(f"Error closing positions: {item['error']}")
+            return
+        report = item['result']
+        for grid_id in report['grid_ids']:
+            self.grids.pop(grid_id, None)
+            self.level_index.pop(grid_id, None)
+        if report['flat']:
+            self.log(f"All positions and orders closed in {report['elapsed'] * 1000:.0f} ms")
+        else:
+            left = [symbol for symbol, result in report['symbols'].items() if not result['flat']]
+            self.log(f"WARNING: could not confirm a flat state on {', '.join(left)}")
+
+    def _on_remove_grid(self, item):
+        if item['error']:
+            self.log(f"Error stopping grid: {item['error']}")
+            return
+        self.grids.pop(item['result']['grid_id'], None)
+        self.level_index.pop(item['result']['grid_id'], None)
+        self.log(f"Stopped grid {item['result']['grid_id']}")
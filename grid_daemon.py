@@ -0,0 +1,182 @@
+"""Run grid bots from a config file without the Tkinter GUI.
+
+    python -m grid_daemon --config grids.json
+"""
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+
+from exchange_service import ExchangeService
+from grid_core import TradingCore, parse_grid_params
+from log_pipeline import DEFAULT_LOG_DIR, LogPipeline
+from market_cache import DEFAULT_MARKETS_CACHE
+from metrics import METRICS, MetricsFileWriter, format_summary, serve_metrics
+from paper_exchange import DEFAULT_PAPER_BALANCE, PAPER_PRICE_SOURCE, PaperExchange, create_price_source, recorded_feed
+from recorder import ReplayExchange
+from risk_engine import parse_risk_limits
+from state_journal import DEFAULT_JOURNAL
+
+
+def load_daemon_config(path):
+    """Load and sanity-check a daemon config file"""
+    with open(path, 'r') as f:
+        config = json.load(f)
+    if not config.get('grids'):
+        raise ValueError(f"No grids defined in {path}")
+    return config
+
+
+def wait_for(core, request_ids, stop, timeout=30):
+    """Process service results until the given requests complete.
+
+    Returns the result for a single id, or a dict of results for a list of ids.
+    """
+    pending = [request_ids] if not isinstance(request_ids, list) else list(request_ids)
+    results = {}
+    deadline = time.monotonic() + timeout
+    while pending and not stop.is_set() and time.monotonic() < deadline:
+        for item in core.process_results():
+            if item['id'] in pending:
+                pending.remove(item['id'])
+                results[item['id']] = item
+        if pending:
+            time.sleep(0.05)
+    if not isinstance(request_ids, list):
+        return results.get(request_ids)
+    return results
+
+
+def paper_factory(paper, symbols, pool=None):
+    """exchange_factory for a paper account described by the config's 'paper' section.
+
+    'prices' is 'live' (default) to follow the public feed of price_source,
+    or 'recorded' to replay candles stored by market_data sync, one
+    tick every tick_interval seconds.
+    """
+    price_source = paper.get('price_source', PAPER_PRICE_SOURCE)
+
+    def create(exchange_id, api_key, secret, password=None):
+        feeds, source = [], None
+        if paper.get('prices', 'live') == 'recorded':
+            feeds = [recorded_feed(symbol, paper.get('timeframe', '1m'), exchange_id=price_source,
+                                   root=paper.get('data_dir', 'data'), interval=paper.get('tick_interval', 0.0))
+                     for symbol in symbols]
+        else:
+            source = create_price_source(price_source, pool=pool)
+        return PaperExchange(balance=paper.get('balance', DEFAULT_PAPER_BALANCE), feeds=feeds, source=source,
+                             maker_fee=paper.get('maker_fee', 0.0001), taker_fee=paper.get('taker_fee', 0.0006))
+    return create
+
+
+def run(config, preview_only=False, close_on_exit=False, replay=None, replay_speed=1.0):
+    """Connect, start every configured grid and keep them running until signalled.
+
+    With replay, the exchange is a capture written through the 'record'
+    setting, played back at replay_speed (None for as fast as possible),
+    and nothing is journaled.
+    """
+    # Account state follows the exchange streams; REST only reconciles it
+    service = ExchangeService(reconcile_interval=config.get('account_interval', 60),
+                              journal_path=None if replay else config.get('journal', DEFAULT_JOURNAL),
+                              markets_path=config.get('markets_cache', DEFAULT_MARKETS_CACHE),
+                              record_path=None if replay else config.get('record'),
+                              risk_limits=parse_risk_limits(config.get('risk')))
+    # Console plus rotating JSON-lines files; writing never blocks the trading loop
+    logs = LogPipeline(log_dir=config.get('log_dir', DEFAULT_LOG_DIR), ring_size=0, console=True)
+    core = TradingCore(service=service, log=logs.log, persist_credentials=False)
+    grids = [parse_grid_params(grid) for grid in config['grids']]
+    if config.get('paper') is not None:
+        service.exchange_factory = paper_factory(config['paper'],
+                                                 sorted({params['symbol'] or core.symbol for params in grids}),
+                                                 pool=service.sessions)
+    if replay:
+        service.exchange_factory = lambda exchange_id, api_key, secret, password=None: ReplayExchange(
+            replay, replay_speed)
+
+    if preview_only:
+        for params in grids:
+            core.preview_grid(params)
+        logs.stop()
+        return 0
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    api_key = config.get('api_key') or os.environ.get(config.get('api_key_env', 'GRID_API_KEY'), '')
+    secret = config.get('secret') or os.environ.get(config.get('secret_env', 'GRID_API_SECRET'), '')
+    # Passphrase of venues that have one, such as OKX
+    password = config.get('password') or os.environ.get(config.get('password_env', 'GRID_API_PASSWORD')) or None
+    exchange_name = 'Paper' if config.get('paper') is not None else config.get('exchange', 'Phemex')
+
+    # Exchange latency, errors and scheduler waits, for Prometheus or as a file
+    writer = server = None
+    if config.get('metrics_file'):
+        writer = MetricsFileWriter(config['metrics_file'], config.get('metrics_interval', 15)).start()
+    if config.get('metrics_port'):
+        server = serve_metrics(config['metrics_port'], config.get('metrics_host', '127.0.0.1'))
+
+    core.start()
+    try:
+        result = wait_for(core, core.connect(api_key, secret, exchange_name=exchange_name, password=password), stop)
+        if not result or result['error']:
+            return 1
+
+        # Every grid shares the core's single exchange session and rate limiter.
+        # Grids recovered from the state journal are already running.
+        requests = []
+        for i, params in enumerate(grids, 1):
+            if not params['symbol']:
+                params['symbol'] = core.symbol
+            if not params['name']:
+                params['name'] = f"{params['symbol']}#{i}"
+            if params['name'] in core.grids:
+                continue
+            requests.append(core.create_grid(params))
+        wait_for(core, requests, stop, timeout=300)
+
+        while not stop.is_set():
+            core.process_results()
+            stop.wait(0.05)
+
+        core.log("Shutting down")
+        if close_on_exit:
+            wait_for(core, core.close_all(), threading.Event())
+        return 0
+    finally:
+        core.stop()
+        if writer is not None:
+            writer.stop()
+        if server is not None:
+            server.shutdown()
+        if core.pnl:
+            core.log(f"Realized PnL {core.pnl['realized_pnl']:.4f}, fees {core.pnl['fees']:.4f}, "
+                     f"funding {core.pnl['funding']:.4f}, net {core.pnl['net']:.4f} USD "
+                     f"over {core.pnl['trades']} fills")
+        if METRICS.summary('exchange_request_seconds'):
+            core.log(f"Exchange request latency:\n{format_summary()}")
+        logs.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless futures grid trading bot")
+    parser.add_argument('--config', required=True, help="Path to a JSON grid config file")
+    parser.add_argument('--preview', action='store_true', help="Only print the grid levels")
+    parser.add_argument('--close-on-exit', action='store_true',
+                        help="Cancel orders and close positions when stopping")
+    parser.add_argument('--replay', metavar='CAPTURE', help="Run against a recorded capture instead of the exchange")
+    parser.add_argument('--replay-speed', default='1',
+                        help="Playback speed of --replay, e.g. 1, 10 or max (default: 1, as recorded)")
+    args = parser.parse_args(argv)
+
+    config = load_daemon_config(args.config)
+    speed = None if args.replay_speed == 'max' else float(args.replay_speed)
+    return run(config, preview_only=args.preview, close_on_exit=args.close_on_exit,
+               replay=args.replay, replay_speed=speed)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
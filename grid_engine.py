@@ -0,0 +1,243 @@
+import asyncio
+import time
+
+from metrics import METRICS
+from order_placer import post_only_rejected
+
+
+class GridEngine:
+    """React to streamed fills by re-arming the opposite side one grid step away.
+
+    Listens to the private watch_orders and watch_my_trades streams of a
+    ccxt.pro exchange; whichever reports a complete fill first triggers the
+    counter order, the other stream's copy of the event is ignored.
+
+    With books, counters go out post-only like the ladder. A counter the
+    book would cross, or the venue refuses as post-only, stays pending
+    and is sent again once the book has moved off its price.
+    """
+
+    def __init__(self, exchange, symbol, levels, grid_step=None, take_profit=None,
+                 log=None, on_fill=None, limiter=None, books=None, on_rearm=None):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.levels = levels
+        self.grid_step = grid_step
+        self.take_profit = take_profit
+        self.log = log or print
+        self.on_fill = on_fill
+        self.limiter = limiter
+        self.books = books  # MarketBooks
+        self.on_rearm = on_rearm  # called with a held back counter once it rests
+        self.params = {'postOnly': True} if books is not None else {}
+
+        self.running = False
+        self.orders = {}  # open order id -> level
+        self.filled_amounts = {}
+        self.latencies = []  # seconds from fill receipt to counter order acknowledgement
+        self.waiting = []  # counters held back while they would cross the book
+        self._listening = False
+        self._tasks = set()
+
+        for level in levels:
+            self.track(level)
+
+    def track(self, level):
+        """Start watching a level's resting order for fills"""
+        order = level.get('order')
+        if level.get('status') == 'open' and order and order.get('id'):
+            self.orders[order['id']] = level
+
+    def retarget(self, levels, grid_step=None, take_profit=None):
+        """Follow a reconciled ladder; fills of orders it no longer holds are ignored"""
+        self.levels = levels
+        self.grid_step = grid_step
+        self.take_profit = take_profit
+        self.orders = {}
+        for level in levels:
+            self.track(level)
+        self.filled_amounts = {order_id: amount for order_id, amount in self.filled_amounts.items()
+                               if order_id in self.orders}
+        self.waiting = [counter for counter in self.waiting if any(counter is level for level in levels)]
+
+    def replace(self, level, counter):
+        """Put counter where level is in the ladder, or at its end if level is no longer in it"""
+        for i, existing in enumerate(self.levels):
+            if existing is level:
+                self.levels[i] = counter
+                return
+        self.levels.append(counter)
+
+    def counter_price(self, level):
+        """Price of the order that closes out a filled level"""
+        if level.get('exit') is not None:
+            return level['exit']
+        if self.grid_step:
+            offset = self.grid_step
+        else:
+            offset = level['price'] * self.take_profit / 100
+        if level['type'] == 'buy':
+            return level['price'] + offset
+        return level['price'] - offset
+
+    async def run(self):
+        """Consume the order and trade streams until stopped"""
+        self.running = True
+        has = getattr(self.exchange, 'has', None) or {}
+        watchers = [self._watch_orders()]
+        if has.get('watchMyTrades'):
+            watchers.append(self._watch_trades())
+        try:
+            await asyncio.gather(*watchers)
+        finally:
+            self.running = False
+
+    def stop(self):
+        self.running = False
+        self._unlisten()
+
+    async def _watch_orders(self):
+        while self.running:
+            try:
+                orders = await self.exchange.watch_orders(self.symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"Order stream error: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+
+            received = time.perf_counter()
+            for order in orders:
+                self.handle_order_update(order, received)
+
+    async def _watch_trades(self):
+        while self.running:
+            try:
+                trades = await self.exchange.watch_my_trades(self.symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"Trade stream error: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+
+            received = time.perf_counter()
+            for trade in trades:
+                self.handle_trade(trade, received)
+
+    def handle_order_update(self, order, received=None):
+        """Process one streamed order; returns True if it belonged to this grid"""
+        if order.get('id') not in self.orders:
+            return False
+        if order.get('status') == 'closed':
+            self._handle_fill(order['id'], received or time.perf_counter())
+        return True
+
+    def handle_trade(self, trade, received=None):
+        """Process one streamed trade; returns True if it belonged to this grid"""
+        order_id = trade.get('order')
+        level = self.orders.get(order_id)
+        if level is None:
+            return False
+        filled = self.filled_amounts.get(order_id, 0) + float(trade['amount'])
+        self.filled_amounts[order_id] = filled
+        if filled >= level['size'] * (1 - 1e-9):
+            self._handle_fill(order_id, received or time.perf_counter())
+        return True
+
+    def _handle_fill(self, order_id, received):
+        """Mark a level filled and schedule its counter order"""
+        level = self.orders.pop(order_id, None)
+        if level is None:
+            return
+        self.filled_amounts.pop(order_id, None)
+        level['status'] = 'filled'
+        self._spawn(self._place_counter(level, received))
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _place_counter(self, level, received):
+        side = 'sell' if level['type'] == 'buy' else 'buy'
+        price = self.counter_price(level)
+        counter = {
+            'price': price,
+            'size': level['size'],
+            'type': side,
+            'order': None,
+            'status': 'pending',
+            'error': None,
+            'counter_of': level['price'],
+            # Once the counter fills, the level is re-armed where it started
+            'exit': level['price']
+        }
+        # The counter takes the filled level's place, so the ladder keeps its length however often it fills
+        self.replace(level, counter)
+        await self._send(counter, received)
+
+        if self.on_fill:
+            self.on_fill(level, counter)
+
+    async def _send(self, counter, received=None):
+        """Place a counter order; one that would take liquidity is held back instead"""
+        side, price = counter['type'], counter['price']
+        if self.books is not None and self.books.book(self.symbol).crosses(side, price):
+            self._hold(counter, f"{side} at {price} would cross the book")
+            return
+        try:
+            if self.limiter is not None:
+                await self.limiter.acquire(lane='order')
+            counter['order'] = await self.exchange.create_order(
+                self.symbol, 'limit', side, counter['size'], price, self.params)
+            counter['status'] = 'open'
+            counter['error'] = None
+            if received is not None:
+                latency = time.perf_counter() - received
+                self.latencies.append(latency)
+                METRICS.observe('grid_counter_seconds', latency)
+            self.track(counter)
+        except Exception as e:
+            if self.params and post_only_rejected(e):
+                self._hold(counter, str(e))
+                return
+            counter['status'] = 'failed'
+            counter['error'] = str(e)
+            METRICS.inc('grid_counter_errors_total')
+            self.log(f"Error placing counter {side} at {price:.2f}: {str(e)}")
+
+    def _hold(self, counter, reason):
+        """Keep a counter pending until the book moves off its price"""
+        counter['status'] = 'pending'
+        counter['error'] = f"Waiting for the book to move: {reason}"
+        self.waiting.append(counter)
+        METRICS.inc('grid_counter_held_total')
+        if not self._listening:
+            self._listening = True
+            self.books.add_listener(self.symbol, self.on_book)
+            self.books.subscribe([self.symbol])
+
+    def _unlisten(self):
+        if self._listening:
+            self._listening = False
+            self.books.remove_listener(self.symbol, self.on_book)
+
+    def on_book(self, book):
+        """Send the held back counters the book no longer crosses"""
+        if not self.running:
+            return
+        ready = [counter for counter in self.waiting if not book.crosses(counter['type'], counter['price'])]
+        if not ready:
+            return
+        self.waiting = [counter for counter in self.waiting if not any(counter is other for other in ready)]
+        if not self.waiting:
+            self._unlisten()
+        for counter in ready:
+            self._spawn(self._rearm(counter))
+
+    async def _rearm(self, counter):
+        await self._send(counter)
+        if counter['status'] == 'open' and self.on_rearm:
+            self.on_rearm(counter)
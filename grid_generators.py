@@ -0,0 +1,126 @@
+import numpy as np
+
+SPACINGS = ('arithmetic', 'geometric', 'volatility', 'custom')
+SIZINGS = ('quote', 'base')
+
+# Share of the levels spread evenly in volatility spacing, so quiet price bands keep some levels
+VOLATILITY_FLOOR = 0.25
+VOLATILITY_BINS = 200
+
+
+def arithmetic_prices(lower, upper, num_grids):
+    """Evenly spaced prices from upper down to lower"""
+    return np.linspace(upper, lower, num_grids)
+
+
+def geometric_prices(lower, upper, num_grids):
+    """Prices a constant percentage apart from upper down to lower"""
+    return np.geomspace(upper, lower, num_grids)
+
+
+def geometric_count(lower, upper, spacing_pct):
+    """Number of levels that keeps spacing_pct between neighbours from lower to upper"""
+    return int(np.floor(np.log(upper / lower) / np.log1p(spacing_pct / 100) + 1e-9)) + 1
+
+
+def volatility_prices(lower, upper, num_grids, closes, floor=VOLATILITY_FLOOR, bins=VOLATILITY_BINS):
+    """Prices packed into the bands where the market has moved most.
+
+    Every close-to-close move adds its absolute log return to the price band
+    it ended in; level density follows that weight, mixed with a uniform
+    floor share.
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    closes = closes[closes > 0]
+    if len(closes) < 2:
+        raise ValueError("Volatility spacing needs price history")
+    moves = np.abs(np.diff(np.log(closes)))
+    edges = np.linspace(lower, upper, bins + 1)
+    weights, _ = np.histogram(closes[1:], bins=edges, weights=moves)
+    total = weights.sum()
+    if total <= 0:
+        return arithmetic_prices(lower, upper, num_grids)
+
+    density = (1 - floor) * weights / total + floor / bins
+    cdf = np.concatenate([[0.0], np.cumsum(density)])
+    cdf /= cdf[-1]
+    return np.interp(np.linspace(0.0, 1.0, num_grids), cdf, edges)[::-1]
+
+
+def custom_prices(prices):
+    """User supplied prices, deduplicated and ordered from the top down"""
+    prices = np.unique(np.asarray(prices, dtype=np.float64))[::-1]
+    if len(prices) < 2 or prices[-1] <= 0:
+        raise ValueError("Custom grids need at least two positive prices")
+    return prices
+
+
+def level_exits(prices, long, geometric=False):
+    """Price each level closes at: the neighbouring level in the profit direction.
+
+    The outermost level has no such neighbour and closes one gap (or, for
+    geometric grids, one ratio) beyond itself.
+    """
+    exits = np.empty_like(prices)
+    if long:
+        exits[1:] = prices[:-1]
+        exits[0] = prices[0] * prices[0] / prices[1] if geometric else 2 * prices[0] - prices[1]
+    else:
+        exits[:-1] = prices[1:]
+        exits[-1] = prices[-1] * prices[-1] / prices[-2] if geometric else 2 * prices[-1] - prices[-2]
+    return exits
+
+
+def level_sizes(prices, investment, leverage, sizing='quote', weights=None):
+    """Base currency size per level for a total margin of investment.
+
+    'quote' puts the same notional on every level (optionally scaled by
+    weights); 'base' buys or sells the same amount at every level.
+    """
+    notional = investment * leverage
+    if sizing == 'base':
+        return np.full(len(prices), notional / prices.sum())
+    if weights is None:
+        weights = np.ones(len(prices))
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(weights) != len(prices) or (weights < 0).any() or weights.sum() <= 0:
+        raise ValueError("Need one non-negative weight per level")
+    return notional * weights / weights.sum() / prices
+
+
+def generate_grid(params, closes=None):
+    """The ladder described by params as arrays, prices from the top down.
+
+    Returns a dict with 'prices', 'exits' and 'sizes' (base currency), plus
+    'grid_step' for arithmetic grids and 'spacing_pct' for geometric ones
+    (None otherwise). closes is the price history volatility spacing
+    weights its levels by.
+    """
+    spacing = params.get('spacing', 'arithmetic')
+    lower, upper, num_grids = params['lower_price'], params['upper_price'], params['num_grids']
+    grid_step = spacing_pct = None
+
+    if spacing == 'arithmetic':
+        prices = arithmetic_prices(lower, upper, num_grids)
+        grid_step = (upper - lower) / (num_grids - 1)
+    elif spacing == 'geometric':
+        prices = geometric_prices(lower, upper, num_grids)
+        spacing_pct = ((upper / lower) ** (1 / (num_grids - 1)) - 1) * 100
+    elif spacing == 'volatility':
+        if closes is None:
+            raise ValueError("Volatility spacing needs price history")
+        prices = volatility_prices(lower, upper, num_grids, closes)
+    elif spacing == 'custom':
+        prices = custom_prices(params['levels'])
+    else:
+        raise ValueError(f"Unknown grid spacing: {spacing}")
+
+    long = params['direction'] == 'Long'
+    return {
+        'prices': prices,
+        'exits': level_exits(prices, long, geometric=spacing == 'geometric'),
+        'sizes': level_sizes(prices, params['investment'], params['leverage'],
+                             params.get('sizing', 'quote'), params.get('weights')),
+        'grid_step': grid_step,
+        'spacing_pct': spacing_pct
+    }
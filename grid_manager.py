@@ -0,0 +1,469 @@
+import asyncio
+import itertools
+import time
+
+from exchange_adapters import get_adapter
+from grid_engine import GridEngine
+from market_book import flag_crossing
+from metrics import METRICS
+from order_placer import AsyncGridOrderPlacer
+from rate_limiter import RequestScheduler, limited_read
+from reconciler import GridReconciler
+from trailing import GridTrailer
+
+
+class GridInstance:
+    """State owned by one running grid; nothing here is shared with other grids"""
+
+    def __init__(self, grid_id, symbol, levels, leverage, grid_step=None, take_profit=None):
+        self.grid_id = grid_id
+        self.symbol = symbol
+        self.levels = levels
+        self.leverage = leverage
+        self.grid_step = grid_step
+        self.take_profit = take_profit
+        self.engine = None
+        self.trailer = None  # GridTrailer while the grid follows the price
+        self.status = 'pending'
+
+    def open_order_ids(self):
+        return [level['order']['id'] for level in self.levels
+                if level.get('status') == 'open' and level.get('order')]
+
+    def snapshot(self):
+        """Copy of the grid state that is safe to hand to another thread"""
+        return {
+            'grid_id': self.grid_id,
+            'symbol': self.symbol,
+            'status': self.status,
+            'leverage': self.leverage,
+            'grid_step': self.grid_step,
+            'trailing': self.trailer.stats() if self.trailer is not None else None,
+            'levels': [dict(level) for level in self.levels]
+        }
+
+
+class GridManager:
+    """Run many independent grids over one exchange session and one rate limiter.
+
+    All grids share the same ccxt client (and so its HTTP connection pool and
+    websocket connections). Each symbol gets a single order stream and a single
+    trade stream, and updates are routed to the grid that owns the order id.
+    """
+
+    def __init__(self, exchange, limiter=None, log=None, on_fill=None, journal=None, on_trade=None, books=None,
+                 precision=None, risk=None, on_rearm=None):
+        self.exchange = exchange
+        self.adapter = get_adapter(getattr(exchange, 'id', None))
+        self.limiter = limiter or RequestScheduler.for_exchange(exchange)
+        self.log = log or print
+        self.on_fill = on_fill
+        self.on_rearm = on_rearm  # called with a counter order that rests after waiting for the book
+        self.on_trade = on_trade  # called with every streamed trade, e.g. PnLLedger.ingest
+        self.journal = journal  # StateJournal recording grids, order ids and fills
+        # MarketBooks; with it, levels that would cross are skipped and the rest are sent post-only
+        self.books = books
+        self.precision = precision  # symbol -> MarketPrecision or None, for rounding shifted ladders
+        # RiskEngine; with it, entry levels are checked before they are sent and every order is counted
+        self.risk = risk
+        self.grids = {}  # grid id -> GridInstance
+        self.leverage = {}  # symbol -> leverage last set on the exchange
+        self.streams = {}  # symbol -> list of router tasks
+        self._ids = itertools.count(1)
+
+    def new_grid_id(self, symbol):
+        grid_id = f"{symbol}#{next(self._ids)}"
+        while grid_id in self.grids:
+            grid_id = f"{symbol}#{next(self._ids)}"
+        return grid_id
+
+    def grids_for(self, symbol):
+        return [grid for grid in self.grids.values() if grid.symbol == symbol]
+
+    def supports_streams(self):
+        has = getattr(self.exchange, 'has', None) or {}
+        return bool(has.get('watchOrders'))
+
+    async def add_grid(self, symbol, levels, leverage, grid_step=None, take_profit=None, grid_id=None,
+                       trailing=None):
+        """Place a new grid and start re-arming its fills; trailing settings make it follow the price"""
+        grid_id = grid_id or self.new_grid_id(symbol)
+        if grid_id in self.grids:
+            raise ValueError(f"Grid {grid_id} is already running")
+
+        grid = GridInstance(grid_id, symbol, levels, leverage, grid_step, take_profit)
+        # Reserve the id while the grid is placed, and free it again if placing fails
+        self.grids[grid_id] = grid
+        placed = False
+        try:
+            await self._ensure_leverage(symbol, leverage)
+
+            resting = self._within_risk(symbol, await self._resting_levels(symbol, levels), leverage)
+            placer = AsyncGridOrderPlacer(self.exchange, batch_size=self.adapter.batch_limit, log=self.log,
+                                          limiter=self.limiter, post_only=self.books is not None)
+            with METRICS.timer('grid_place_seconds'):
+                await placer.place(symbol, resting)
+            placed = True
+        finally:
+            if not placed:
+                self.grids.pop(grid_id, None)
+                await self._abandon_levels(symbol, levels)
+        if self.risk is not None:
+            self.risk.track(symbol, resting)
+        if self.journal is not None:
+            self.journal.grid_started(grid)
+
+        self._start_engine(grid)
+        if trailing:
+            self._start_trailing(grid, trailing)
+        return grid
+
+    async def _abandon_levels(self, symbol, levels):
+        """Undo a grid that failed to place: drop its risk reservations and cancel what reached the book"""
+        if self.risk is not None:
+            self.risk.forget(symbol, [('reserved', id(level)) for level in levels])
+        orders = [level['order'] for level in levels
+                  if level.get('status') == 'open' and level.get('order') and level['order'].get('id')]
+        if not orders:
+            return
+        self.log(f"Cancelling {len(orders)} {symbol} orders of a grid that failed to place")
+        try:
+            reconciler = GridReconciler(self.exchange, limiter=self.limiter, log=self.log,
+                                        batch_size=self.adapter.batch_limit)
+            await reconciler.cancel(symbol, orders)
+        except Exception as e:
+            self.log(f"Error cancelling orders of a grid that failed to place: {str(e)}")
+
+    def _start_trailing(self, grid, trailing):
+        precision = self.precision(grid.symbol) if self.precision else None
+
+        def round_price(price):
+            return float(precision.round_prices(price))
+        grid.trailer = GridTrailer(self, grid, round_price=round_price if precision is not None else None,
+                                   log=self.log, **trailing)
+        if self.books is not None:
+            self.books.add_listener(grid.symbol, grid.trailer.on_book)
+            self.books.subscribe([grid.symbol])
+
+    def _stop_trailing(self, grid):
+        trailer, grid.trailer = grid.trailer, None
+        if trailer is not None:
+            if self.books is not None:
+                self.books.remove_listener(grid.symbol, trailer.on_book)
+            trailer.stop()
+
+    def _start_engine(self, grid):
+        if self.supports_streams():
+            grid.engine = GridEngine(
+                self.exchange, grid.symbol, grid.levels, grid_step=grid.grid_step,
+                take_profit=grid.take_profit, log=self.log, limiter=self.limiter, books=self.books,
+                on_fill=lambda level, counter: self._on_fill(grid, level, counter),
+                on_rearm=lambda counter: self._on_rearm(grid, counter))
+            grid.engine.running = True
+            self._ensure_streams(grid.symbol)
+        else:
+            self.log("Exchange has no order stream, fills will not be re-armed")
+        grid.status = 'running'
+
+    async def recover(self):
+        """Restart the grids recorded in the journal without placing their ladders again.
+
+        Journaled order ids are checked against one fetch_open_orders per
+        symbol. Orders that are gone are looked up in the closed orders:
+        fills get their counter order as if streamed, anything else (such as
+        a manual cancel) is placed again.
+        """
+        if self.journal is None:
+            return []
+        states = {grid_id: state for grid_id, state in self.journal.replay().items()
+                  if grid_id not in self.grids}
+        if not states:
+            return []
+
+        symbols = sorted({state['symbol'] for state in states.values()})
+        live = dict(await asyncio.gather(*(self._orders_by_id(symbol, 'fetch_open_orders')
+                                           for symbol in symbols)))
+
+        grids = []
+        missing = {}  # grid id -> levels whose order is no longer open
+        for grid_id, state in states.items():
+            levels = []
+            for saved in state['levels']:
+                if saved['status'] not in ('open', 'pending'):
+                    continue
+                level = {'price': saved['price'], 'size': saved['size'], 'type': saved['type'],
+                         'order': None, 'status': 'pending', 'error': None}
+                if saved['counter_of'] is not None:
+                    level['counter_of'] = saved['counter_of']
+                if saved.get('exit') is not None:
+                    level['exit'] = saved['exit']
+                order = live[state['symbol']].pop(saved['order_id'], None)
+                if order is not None:
+                    level.update({'order': order, 'status': 'open'})
+                else:
+                    missing.setdefault(grid_id, []).append((saved['order_id'], level, saved.get('order_ts')))
+                levels.append(level)
+
+            grid = GridInstance(grid_id, state['symbol'], levels, state['leverage'],
+                                state['grid_step'], state['take_profit'])
+            self.grids[grid_id] = grid
+            self.leverage.setdefault(grid.symbol, grid.leverage)
+            grids.append(grid)
+
+        # Only symbols with vanished orders need the closed order history
+        closed = {}
+        if missing and (getattr(self.exchange, 'has', None) or {}).get('fetchClosedOrders'):
+            placed_at = [saved_ts for entries in missing.values() for _, _, saved_ts in entries if saved_ts]
+            since = min(placed_at) if placed_at else None
+            missing_symbols = sorted({self.grids[grid_id].symbol for grid_id in missing})
+            closed = dict(await asyncio.gather(*(self._orders_by_id(symbol, 'fetch_closed_orders', since)
+                                                 for symbol in missing_symbols)))
+
+        recovered = []
+        for grid in grids:
+            filled, replace = [], []
+            for order_id, level, _ in missing.get(grid.grid_id, []):
+                order = closed.get(grid.symbol, {}).get(order_id)
+                if order is not None and order.get('status') == 'closed':
+                    level.update({'order': order, 'status': 'open'})
+                    filled.append(order)
+                else:
+                    replace.append(level)
+            if self.risk is not None:
+                self.risk.track(grid.symbol, grid.levels)
+            if replace:
+                placer = AsyncGridOrderPlacer(self.exchange, batch_size=self.adapter.batch_limit,
+                                              log=self.log, limiter=self.limiter, post_only=self.books is not None)
+                replace = self._within_risk(grid.symbol, await self._resting_levels(grid.symbol, replace),
+                                            grid.leverage)
+                await placer.place(grid.symbol, replace)
+                if self.risk is not None:
+                    self.risk.track(grid.symbol, replace)
+
+            self._start_engine(grid)
+            if grid.engine:
+                for order in filled:
+                    grid.engine.handle_order_update(order)
+            self.journal.grid_updated(grid)
+            recovered.append({'grid': grid, 'open': len(grid.open_order_ids()), 'filled': len(filled),
+                              'replaced': len(replace)})
+
+        unowned = sum(len(orders) for orders in live.values())
+        if unowned:
+            self.log(f"{unowned} open orders on {', '.join(symbols)} are not owned by any recovered grid")
+        return recovered
+
+    async def _orders_by_id(self, symbol, method, since=None):
+        fetch = getattr(self.exchange, method)
+        if since is None:
+            orders = await limited_read(self.limiter, (method, symbol), lambda: fetch(symbol))
+        else:
+            orders = await limited_read(self.limiter, (method, symbol, since), lambda: fetch(symbol, since))
+        return symbol, {order['id']: order for order in orders}
+
+    async def update_grid(self, grid_id, levels, leverage, grid_step=None, take_profit=None):
+        """Move a running grid onto a new ladder, touching only the orders that differ"""
+        grid = self.grids.get(grid_id)
+        if grid is None:
+            raise ValueError(f"Unknown grid {grid_id}")
+
+        await self._ensure_leverage(grid.symbol, leverage)
+
+        # Resting counter orders close positions the grid already holds, so they
+        # stay; only the entry ladder is reconciled
+        counters = [level for level in grid.levels
+                    if level.get('counter_of') is not None and level.get('status') == 'open']
+        owned = {level['order']['id'] for level in grid.levels
+                 if level.get('counter_of') is None and level.get('status') == 'open' and level.get('order')}
+
+        # One fetch tells us which of those orders are still resting
+        resting = await limited_read(self.limiter, ('fetch_open_orders', grid.symbol),
+                                     lambda: self.exchange.fetch_open_orders(grid.symbol))
+        open_orders = [order for order in resting if order['id'] in owned]
+
+        resting = await self._resting_levels(grid.symbol, levels)
+        crossing = len(levels) - len(resting)
+        if self.risk is not None:
+            # The old entry orders make way for the new ladder; the ones kept are counted again below
+            self.risk.forget(grid.symbol, owned)
+        resting = self._within_risk(grid.symbol, resting, leverage)
+        reconciler = GridReconciler(self.exchange, limiter=self.limiter, log=self.log,
+                                    batch_size=self.adapter.batch_limit, post_only=self.books is not None)
+        summary = await reconciler.reconcile(grid.symbol, resting, open_orders,
+                                             held_prices=[level['counter_of'] for level in counters])
+        if self.risk is not None:
+            self.risk.track(grid.symbol, resting)
+        summary['skipped'] = crossing
+        summary['blocked'] = len(levels) - crossing - len(resting)
+
+        if grid.trailer is not None:
+            try:
+                grid.trailer.follow(levels, grid_step)
+            except ValueError as e:
+                self.log(f"Grid {grid_id} stops trailing: {str(e)}")
+                self._stop_trailing(grid)
+        levels.extend(counters)
+        grid.levels = levels
+        grid.leverage = leverage
+        grid.grid_step = grid_step
+        grid.take_profit = take_profit
+        if grid.engine:
+            grid.engine.retarget(levels, grid_step=grid_step, take_profit=take_profit)
+        if self.journal is not None:
+            self.journal.grid_updated(grid)
+        return grid, summary
+
+    async def remove_grid(self, grid_id, cancel_orders=True, forget=True):
+        """Stop a grid and optionally cancel the orders it owns.
+
+        With forget unset the journal keeps the grid, so it is recovered on
+        the next start; that is how the manager shuts down.
+        """
+        grid = self.grids.pop(grid_id, None)
+        if grid is None:
+            raise ValueError(f"Unknown grid {grid_id}")
+        if grid.engine:
+            grid.engine.stop()
+        self._stop_trailing(grid)
+        grid.status = 'stopped'
+        if self.risk is not None:
+            self.risk.forget(grid.symbol, grid.open_order_ids())
+        if forget and self.journal is not None:
+            self.journal.grid_removed(grid_id)
+
+        if not self.grids_for(grid.symbol):
+            await self._stop_streams(grid.symbol)
+
+        if cancel_orders:
+            reconciler = GridReconciler(self.exchange, limiter=self.limiter, log=self.log,
+                                        batch_size=self.adapter.batch_limit)
+            await reconciler.cancel(grid.symbol, [{'id': order_id} for order_id in grid.open_order_ids()])
+        return grid
+
+    async def remove_symbol(self, symbol, cancel_orders=False):
+        """Stop every grid running on a symbol"""
+        grids = self.grids_for(symbol)
+        for grid in grids:
+            await self.remove_grid(grid.grid_id, cancel_orders=cancel_orders)
+        return grids
+
+    async def stop(self):
+        """Stop all grids without touching their orders or their journal entries"""
+        for grid_id in list(self.grids):
+            await self.remove_grid(grid_id, cancel_orders=False, forget=False)
+
+    async def _resting_levels(self, symbol, levels):
+        """Levels that rest as maker orders at the current book; crossing ones are flagged and skipped"""
+        if self.books is None:
+            return levels
+        try:
+            book = await self.books.top(symbol)
+        except Exception as e:
+            self.log(f"Could not read the {symbol} order book, placing without a crossing check: {str(e)}")
+            return levels
+        resting = flag_crossing(levels, book)
+        if len(resting) < len(levels):
+            self.log(f"Skipped {len(levels) - len(resting)} {symbol} levels that would cross the book "
+                     f"(bid {book.best_bid()}, ask {book.best_ask()})")
+        return resting
+
+    def _within_risk(self, symbol, levels, leverage):
+        """Levels that pass the risk engine, possibly downsized; the others are marked blocked"""
+        if self.risk is None:
+            return levels
+        allowed = self.risk.check(symbol, levels, leverage)
+        if len(allowed) < len(levels):
+            self.log(f"Blocked {len(levels) - len(allowed)} {symbol} levels over the risk limits: "
+                     f"{next(level['error'] for level in levels if level.get('status') == 'blocked')}")
+        return allowed
+
+    async def _ensure_leverage(self, symbol, leverage):
+        # Leverage is per symbol on the exchange, so grids on one symbol share it
+        if self.leverage.get(symbol) == leverage:
+            return
+        if symbol in self.leverage:
+            self.log(f"Changing {symbol} leverage from {self.leverage[symbol]}x to {leverage}x "
+                     f"for all grids on that symbol")
+        try:
+            if self.limiter is not None:
+                await self.limiter.acquire(lane='order')
+            # The venue adapter knows the venue's leverage params and harmless rejections
+            await self.adapter.set_leverage(self.exchange, symbol, leverage)
+            self.leverage[symbol] = leverage
+        except Exception as e:
+            self.log(f"Warning setting leverage: {str(e)}")
+
+    def _ensure_streams(self, symbol):
+        if symbol in self.streams:
+            return
+        has = getattr(self.exchange, 'has', None) or {}
+        tasks = [asyncio.ensure_future(self._route_orders(symbol))]
+        if has.get('watchMyTrades'):
+            tasks.append(asyncio.ensure_future(self._route_trades(symbol)))
+        self.streams[symbol] = tasks
+
+    async def _stop_streams(self, symbol):
+        tasks = self.streams.pop(symbol, [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def _route_orders(self, symbol):
+        while True:
+            try:
+                orders = await self.exchange.watch_orders(symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"Order stream error on {symbol}: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+
+            received = time.perf_counter()
+            grids = self.grids_for(symbol)
+            for order in orders:
+                for grid in grids:
+                    if grid.engine and grid.engine.handle_order_update(order, received):
+                        break
+
+    async def _route_trades(self, symbol):
+        while True:
+            try:
+                trades = await self.exchange.watch_my_trades(symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"Trade stream error on {symbol}: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+
+            received = time.perf_counter()
+            grids = self.grids_for(symbol)
+            for trade in trades:
+                if self.on_trade:
+                    self.on_trade(trade)
+                for grid in grids:
+                    if grid.engine and grid.engine.handle_trade(trade, received):
+                        break
+
+    def _on_fill(self, grid, level, counter):
+        if self.risk is not None:
+            # Counter orders close the filled amount, so they are counted but never blocked
+            self.risk.fill(grid.symbol, level)
+            self.risk.track(grid.symbol, [counter])
+        if self.journal is not None:
+            self.journal.fill(grid, level, counter)
+        if self.on_fill:
+            self.on_fill(grid, level, counter)
+
+    def _on_rearm(self, grid, counter):
+        if self.risk is not None:
+            self.risk.track(grid.symbol, [counter])
+        if self.journal is not None:
+            self.journal.grid_updated(grid)
+        if self.on_rearm:
+            self.on_rearm(grid, counter)
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+from reconciler import GridReconciler
+
+
+class KillSwitch:
+    """Flatten symbols as fast as the exchange allows.
+
+    For every symbol at once, cancel-all and a reduce-only market close are
+    fired concurrently, then open orders and positions are fetched to
+    confirm the symbol is flat. Anything left over is retried with
+    exponential backoff. All requests ride the scheduler's cancel lane.
+    """
+
+    def __init__(self, exchange, limiter=None, log=None, retries=5, backoff=0.1):
+        self.exchange = exchange
+        self.limiter = limiter
+        self.log = log or print
+        self.retries = retries
+        self.backoff = backoff
+
+    async def _urgent(self):
+        if self.limiter is not None:
+            await self.limiter.acquire(lane='cancel')
+
+    def _has(self, feature):
+        has = getattr(self.exchange, 'has', None) or {}
+        return bool(has.get(feature))
+
+    async def flatten(self, symbols, positions=None):
+        """Cancel every order and close every position on symbols.
+
+        positions may hold already known (e.g. cached) positions so the first
+        close goes out without waiting for a fetch. Returns a report with
+        'flat', 'elapsed' and per-symbol 'symbols' entries.
+        """
+        start = time.perf_counter()
+        known = {}
+        for position in positions or []:
+            known.setdefault(position['symbol'], []).append(position)
+
+        results = await asyncio.gather(*(self._flatten_symbol(symbol, known.get(symbol), start)
+                                         for symbol in symbols))
+        report = dict(zip(symbols, results))
+        return {
+            'flat': all(result['flat'] for result in results),
+            'elapsed': time.perf_counter() - start,
+            'symbols': report
+        }
+
+    async def _flatten_symbol(self, symbol, positions, start):
+        delay = self.backoff
+        for attempt in range(1, self.retries + 1):
+            if positions is None:
+                positions = await self._fetch(self.exchange.fetch_positions, [symbol])
+            # Cancels and closes go out together; the confirmation below catches any race
+            await asyncio.gather(self._cancel_all(symbol), self._close_positions(symbol, positions or []))
+
+            open_orders, positions = await asyncio.gather(
+                self._fetch(self.exchange.fetch_open_orders, symbol),
+                self._fetch(self.exchange.fetch_positions, [symbol]))
+            if open_orders is not None and positions is not None:
+                positions = [p for p in positions if float(p.get('contracts') or 0) > 0]
+                if not open_orders and not positions:
+                    return {'flat': True, 'attempts': attempt, 'elapsed': time.perf_counter() - start}
+                self.log(f"{symbol} not flat after attempt {attempt}: {len(open_orders)} orders, "
+                         f"{len(positions)} positions left")
+            else:
+                positions = None
+            await asyncio.sleep(delay)
+            delay *= 2
+        self.log(f"Could not confirm {symbol} is flat after {self.retries} attempts")
+        return {'flat': False, 'attempts': self.retries, 'elapsed': time.perf_counter() - start}
+
+    async def _fetch(self, method, *args):
+        """Confirmation read; None when it failed so the attempt is repeated"""
+        try:
+            await self._urgent()
+            return await method(*args)
+        except Exception as e:
+            self.log(f"Error checking state: {str(e)}")
+            return None
+
+    async def _cancel_all(self, symbol):
+        try:
+            if self._has('cancelAllOrders'):
+                await self._urgent()
+                await self.exchange.cancel_all_orders(symbol)
+            else:
+                await self._urgent()
+                open_orders = await self.exchange.fetch_open_orders(symbol)
+                await GridReconciler(self.exchange, limiter=self.limiter, log=self.log).cancel(symbol, open_orders)
+        except Exception as e:
+            self.log(f"Error cancelling orders on {symbol}: {str(e)}")
+
+    async def _close_positions(self, symbol, positions):
+        async def close(position):
+            contracts = float(position.get('contracts') or 0)
+            if contracts <= 0:
+                return
+            side = 'sell' if position.get('side') == 'long' else 'buy'
+            try:
+                await self._urgent()
+                # Reduce-only so a stale size can never open a position the other way
+                await self.exchange.create_order(symbol, 'market', side, contracts, None, {'reduceOnly': True})
+                self.log(f"Closed {position.get('side')} position of {contracts} contracts on {symbol}")
+            except Exception as e:
+                self.log(f"Error closing {position.get('side')} position on {symbol}: {str(e)}")
+
+        await asyncio.gather(*(close(position) for position in positions))
@@ -0,0 +1,283 @@
+import asyncio
+import collections
+import threading
+import time
+
+from rate_limiter import limited_read
+
+# Amounts below this are treated as fully matched
+DUST = 1e-12
+
+
+class PnLLedger:
+    """Realized PnL, fees and funding built from actual fills.
+
+    Fills are matched first in, first out per symbol: a buy closes the
+    oldest open short lots before opening a long lot, and vice versa. Every
+    lot is pushed and popped once, so a fill costs O(1) amortized and the
+    totals are kept running instead of recomputed. Fees come from the
+    trades' own fee fields. Trades are deduplicated by id, so streamed and
+    fetched copies of the same fill can both be fed in.
+    """
+
+    def __init__(self, precision=None, on_change=None, seen_limit=50000):
+        self.precision = precision  # symbol -> MarketPrecision or None, for contract size and inverse
+        self.on_change = on_change
+        self.seen_limit = seen_limit
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._symbols = {}
+            self._seen = collections.OrderedDict()  # recent trade and funding ids
+            self.realized_pnl = 0.0
+            self.fees = 0.0
+            self.funding = 0.0
+            self.trades = 0
+
+    def _symbol(self, symbol):
+        state = self._symbols.get(symbol)
+        if state is None:
+            state = self._symbols[symbol] = {
+                'lots': collections.deque(),  # [amount, price], oldest first
+                'side': None,  # 'long' or 'short' while lots are open
+                'open_amount': 0.0,
+                'open_cost': 0.0,
+                'realized_pnl': 0.0,
+                'fees': 0.0,
+                'funding': 0.0,
+                'trades': 0
+            }
+        return state
+
+    def _remember(self, key):
+        """False if key was ingested before; otherwise record it"""
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self.seen_limit:
+            self._seen.popitem(last=False)
+        return True
+
+    def _market(self, symbol):
+        market = self.precision(symbol) if self.precision else None
+        if market is None:
+            return 1.0, False
+        return market.contract_size, market.inverse
+
+    def _pnl(self, symbol, side, entry, exit_, amount):
+        contract_size, inverse = self._market(symbol)
+        sign = 1.0 if side == 'long' else -1.0
+        if inverse:
+            # Settled in the base coin; valued at the exit price
+            return sign * amount * contract_size * (1 / entry - 1 / exit_) * exit_
+        return sign * amount * contract_size * (exit_ - entry)
+
+    @staticmethod
+    def _fee(trade, price):
+        fees = trade.get('fees') or ([trade['fee']] if trade.get('fee') else [])
+        base = trade['symbol'].split('/')[0]
+        total = 0.0
+        for fee in fees:
+            cost = float(fee.get('cost') or 0)
+            total += cost * price if fee.get('currency') == base else cost
+        return total
+
+    def ingest(self, trade, notify=True):
+        """Apply one ccxt trade; returns False if it was already counted"""
+        with self._lock:
+            key = ('trade', trade.get('id') or (trade.get('order'), trade.get('timestamp'), trade.get('amount')))
+            if not self._remember(key):
+                return False
+
+            symbol = trade['symbol']
+            state = self._symbol(symbol)
+            price = float(trade['price'])
+            remaining = float(trade['amount'])
+            opening = 'long' if trade['side'] == 'buy' else 'short'
+            lots = state['lots']
+
+            if state['side'] is not None and state['side'] != opening:
+                while remaining > DUST and lots:
+                    lot = lots[0]
+                    matched = min(lot[0], remaining)
+                    pnl = self._pnl(symbol, state['side'], lot[1], price, matched)
+                    state['realized_pnl'] += pnl
+                    self.realized_pnl += pnl
+                    state['open_amount'] -= matched
+                    state['open_cost'] -= matched * lot[1]
+                    lot[0] -= matched
+                    remaining -= matched
+                    if lot[0] <= DUST:
+                        lots.popleft()
+                if not lots:
+                    state['side'] = None
+                    state['open_amount'] = state['open_cost'] = 0.0
+
+            if remaining > DUST:
+                lots.append([remaining, price])
+                state['side'] = opening
+                state['open_amount'] += remaining
+                state['open_cost'] += remaining * price
+
+            fee = self._fee(trade, price)
+            state['fees'] += fee
+            self.fees += fee
+            state['trades'] += 1
+            self.trades += 1
+        if notify:
+            self._changed()
+        return True
+
+    def ingest_many(self, trades):
+        """Apply trades in time order; returns how many were new"""
+        new = sum(self.ingest(trade, notify=False)
+                  for trade in sorted(trades, key=lambda trade: trade.get('timestamp') or 0))
+        if new:
+            self._changed()
+        return new
+
+    def apply_funding(self, entries):
+        """Add ccxt funding history entries (amount > 0 is received); returns how many were new"""
+        new = 0
+        with self._lock:
+            for entry in entries:
+                key = ('funding', entry.get('id') or (entry.get('symbol'), entry.get('timestamp')))
+                if not self._remember(key):
+                    continue
+                amount = float(entry.get('amount') or 0)
+                self._symbol(entry['symbol'])['funding'] += amount
+                self.funding += amount
+                new += 1
+        if new:
+            self._changed()
+        return new
+
+    def seed(self, symbol, side, amount, price):
+        """Open a lot filled before the ledger started, e.g. a grid level waiting on its counter"""
+        with self._lock:
+            state = self._symbol(symbol)
+            if state['side'] not in (None, side):
+                return
+            state['lots'].append([float(amount), float(price)])
+            state['side'] = side
+            state['open_amount'] += float(amount)
+            state['open_cost'] += float(amount) * float(price)
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(self.snapshot())
+
+    def snapshot(self):
+        """Totals plus per-symbol realized PnL, fees, funding and the open FIFO position"""
+        with self._lock:
+            return {
+                'realized_pnl': self.realized_pnl,
+                'fees': self.fees,
+                'funding': self.funding,
+                'net': self.realized_pnl - self.fees + self.funding,
+                'trades': self.trades,
+                'symbols': {symbol: {
+                    'realized_pnl': state['realized_pnl'],
+                    'fees': state['fees'],
+                    'funding': state['funding'],
+                    'trades': state['trades'],
+                    'side': state['side'],
+                    'open_amount': state['open_amount'],
+                    'avg_entry': state['open_cost'] / state['open_amount'] if state['open_amount'] > DUST else None
+                } for symbol, state in self._symbols.items()}
+            }
+
+
+class LedgerSync:
+    """Catch a PnLLedger up from fetch_my_trades and funding history by cursor.
+
+    Streamed trades are fed to the ledger as they arrive; this loop fills in
+    whatever the streams missed. It keeps its own cursor per symbol (the
+    newest fetched timestamp, refetched and skipped as a duplicate), so a
+    streamed trade never moves the cursor past one the stream dropped.
+    """
+
+    def __init__(self, exchange, ledger, symbols=(), since=None, interval=60, log=None, limiter=None,
+                 page_limit=100):
+        self.exchange = exchange
+        self.ledger = ledger
+        self.symbols = set(symbols)
+        self.since = since if since is not None else int(time.time() * 1000)
+        self.interval = interval
+        self.log = log or print
+        self.limiter = limiter
+        self.page_limit = page_limit
+        self._cursors = {}  # symbol -> newest fetched trade timestamp
+        self._funding_cursors = {}
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._loop())
+        return self
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def add_symbols(self, symbols):
+        new = set(symbols) - self.symbols
+        if new:
+            self.symbols |= new
+            self._wake.set()
+
+    def _has(self, feature):
+        has = getattr(self.exchange, 'has', None) or {}
+        return bool(has.get(feature))
+
+    async def sync(self):
+        """Fetch new trades and funding for every symbol; returns how many entries were new"""
+        new = 0
+        for symbol in sorted(self.symbols):
+            if self._has('fetchMyTrades'):
+                new += await self._sync_trades(symbol)
+            if self._has('fetchFundingHistory'):
+                since = self._funding_cursors.get(symbol, self.since)
+                entries = await limited_read(
+                    self.limiter, ('fetch_funding_history', symbol, since),
+                    lambda: self.exchange.fetch_funding_history(symbol, since))
+                new += self.ledger.apply_funding(entries)
+                self._funding_cursors[symbol] = max([since] + [entry['timestamp'] for entry in entries
+                                                               if entry.get('timestamp') is not None])
+        return new
+
+    async def _sync_trades(self, symbol):
+        new = 0
+        since = self._cursors.get(symbol, self.since)
+        while True:
+            trades = await limited_read(
+                self.limiter, ('fetch_my_trades', symbol, since),
+                lambda: self.exchange.fetch_my_trades(symbol, since, self.page_limit))
+            new += self.ledger.ingest_many(trades)
+            newest = max([since] + [trade['timestamp'] for trade in trades if trade.get('timestamp') is not None])
+            self._cursors[symbol] = newest
+            if len(trades) < self.page_limit:
+                return new
+            # A full page on one timestamp would otherwise be fetched forever
+            since = newest if newest > since else since + 1
+
+    async def _loop(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"Error syncing trades: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
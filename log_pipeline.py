@@ -0,0 +1,131 @@
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+DEFAULT_LOG_DIR = 'logs'
+
+
+def infer_level(message):
+    """Level of a free text log line written before levels existed"""
+    head = message.lstrip().lower()
+    if head.startswith('warning'):
+        return logging.WARNING
+    if head.startswith('error') or ' error ' in head[:40] or head.startswith('could not'):
+        return logging.ERROR
+    return logging.INFO
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message plus any structured fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking"""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RingBufferHandler(logging.Handler):
+    """Keep the most recent records for a UI; drain() returns those not shown yet.
+
+    Both the history and the backlog of undrained entries are capped, so a
+    UI that stops draining never grows memory.
+    """
+
+    def __init__(self, capacity=1000):
+        super().__init__()
+        self.entries = collections.deque(maxlen=capacity)
+        self._pending = collections.deque(maxlen=capacity)
+        self._pending_lock = threading.Lock()
+
+    def emit(self, record):
+        entry = (datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S"),
+                 record.levelname, record.getMessage())
+        with self._pending_lock:
+            self.entries.append(entry)
+            self._pending.append(entry)
+
+    def drain(self):
+        """Entries logged since the last drain, oldest first"""
+        with self._pending_lock:
+            entries = list(self._pending)
+            self._pending.clear()
+        return entries
+
+
+class LogPipeline:
+    """Non-blocking logging: callers enqueue, a background listener formats and writes.
+
+    Records go to rotating JSON-lines files under log_dir, to a capped ring
+    buffer the GUI renders in batches and, optionally, to the console.
+    log() is safe to call from any thread.
+    """
+
+    def __init__(self, log_dir=DEFAULT_LOG_DIR, name='grid_bot', max_bytes=5 * 1024 * 1024, backup_count=5,
+                 ring_size=1000, queue_size=10000, console=False):
+        handlers = []
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                os.path.join(log_dir, f"{name}.jsonl"), maxBytes=max_bytes,
+                backupCount=backup_count, encoding='utf-8')
+            file_handler.setFormatter(JsonLinesFormatter())
+            handlers.append(file_handler)
+        self.ring = RingBufferHandler(ring_size)
+        handlers.append(self.ring)
+        if console:
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setFormatter(logging.Formatter("%(asctime)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
+            handlers.append(stream)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def log(self, message, level=None, **fields):
+        """Enqueue one record; fields are written as structured JSON keys"""
+        message = str(message)
+        self.logger.log(level if level is not None else infer_level(message), message,
+                        extra={'fields': fields})
+
+    def stop(self):
+        """Flush what is queued and close the files"""
+        self.listener.stop()
+        self.logger.removeHandler(self.handler)
+        for handler in self.listener.handlers:
+            handler.close()
@@ -0,0 +1,227 @@
+import asyncio
+import time
+from array import array
+
+from rate_limiter import limited_read
+
+
+class L2Book:
+    """Aggregated price levels of one symbol in sorted arrays.
+
+    Each side is a pair of parallel float arrays (prices, amounts) sorted so
+    the best level is last: bids ascending, asks by descending price (kept
+    as negated prices). ccxt.pro applies the venue's diffs and checks their
+    sequence itself, so every streamed message replaces the book with its
+    top depth levels. The best bid and ask are cached after every reset, so
+    reading them is O(1). A book belongs to the thread that updates it.
+    """
+
+    def __init__(self, symbol, depth=50):
+        self.symbol = symbol
+        self.depth = depth  # levels kept per side
+        self._bid_prices, self._bid_amounts = array('d'), array('d')
+        self._ask_keys, self._ask_amounts = array('d'), array('d')  # negated ask prices
+        self.bid = None  # (price, amount) of the best bid
+        self.ask = None
+        self.timestamp = None  # exchange time of the last update, ms
+        self.nonce = None
+        self.received = None  # local monotonic time of the last update
+        self.updates = 0
+
+    def reset(self, bids, asks, timestamp=None, nonce=None):
+        """Replace the book with ccxt-style [price, amount] lists, best first"""
+        bids, asks = bids[:self.depth], asks[:self.depth]
+        self._bid_prices = array('d', [float(level[0]) for level in reversed(bids)])
+        self._bid_amounts = array('d', [float(level[1]) for level in reversed(bids)])
+        self._ask_keys = array('d', [-float(level[0]) for level in reversed(asks)])
+        self._ask_amounts = array('d', [float(level[1]) for level in reversed(asks)])
+        self._touched(timestamp, nonce)
+
+    def _touched(self, timestamp, nonce):
+        self.bid = (self._bid_prices[-1], self._bid_amounts[-1]) if self._bid_prices else None
+        self.ask = (-self._ask_keys[-1], self._ask_amounts[-1]) if self._ask_keys else None
+        self.timestamp = timestamp
+        self.nonce = nonce
+        self.received = time.monotonic()
+        self.updates += 1
+
+    def best_bid(self):
+        return self.bid[0] if self.bid else None
+
+    def best_ask(self):
+        return self.ask[0] if self.ask else None
+
+    def mid(self):
+        bid, ask = self.bid, self.ask
+        if bid is None or ask is None:
+            return None
+        return (bid[0] + ask[0]) / 2
+
+    def spread(self):
+        bid, ask = self.bid, self.ask
+        if bid is None or ask is None:
+            return None
+        return ask[0] - bid[0]
+
+    def bids(self, limit=None):
+        """[price, amount] levels best first"""
+        count = len(self._bid_prices) if limit is None else min(limit, len(self._bid_prices))
+        return [[self._bid_prices[-1 - i], self._bid_amounts[-1 - i]] for i in range(count)]
+
+    def asks(self, limit=None):
+        count = len(self._ask_keys) if limit is None else min(limit, len(self._ask_keys))
+        return [[-self._ask_keys[-1 - i], self._ask_amounts[-1 - i]] for i in range(count)]
+
+    def age(self):
+        """Seconds since the last update, None if there never was one"""
+        return None if self.received is None else time.monotonic() - self.received
+
+    def crosses(self, side, price):
+        """True if a limit order at price would take liquidity instead of resting"""
+        if side == 'buy':
+            ask = self.ask
+            return ask is not None and price >= ask[0]
+        bid = self.bid
+        return bid is not None and price <= bid[0]
+
+    def post_only_price(self, side, price, tick=0.0):
+        """The price closest to price that rests as a maker: one tick inside the opposite touch"""
+        if side == 'buy':
+            ask = self.ask
+            return price if ask is None or price < ask[0] else ask[0] - tick
+        bid = self.bid
+        return price if bid is None or price > bid[0] else bid[0] + tick
+
+
+def flag_crossing(levels, book):
+    """Flag levels that would cross book and mark them skipped; returns the levels that rest.
+
+    A crossing level would fill straight away as a taker, so it is not
+    placed. It is skipped rather than moved to post_only_price(): moved to
+    the touch it would no longer be a grid step from its neighbours, and
+    its counter order would be priced off a level the grid does not have.
+    The others are sent post-only, so a market move while they are in
+    flight cannot make them take either.
+    """
+    resting = []
+    for level in levels:
+        level['crosses'] = book is not None and book.crosses(level['type'], level['price'])
+        if level['crosses']:
+            touch = book.best_ask() if level['type'] == 'buy' else book.best_bid()
+            level.update({'order': None, 'status': 'skipped',
+                          'error': f"{level['type']} at {level['price']} would cross the book at {touch}"})
+        else:
+            resting.append(level)
+    return resting
+
+
+class MarketBooks:
+    """Keep an L2Book per symbol current from the exchange's public streams.
+
+    Symbols are followed through watch_order_book where the exchange has
+    it, else through watch_ticker for the top of the book only. ccxt.pro
+    applies the venue's diffs to its own book; each message copies the top
+    depth levels into the L2Book. Without a stream, or while one is
+    stale, top() fetches the book over REST through the read lane.
+    Listeners get the book after every streamed update; on_update gets
+    every book after any update, streamed or fetched.
+    """
+
+    def __init__(self, exchange, depth=50, log=None, limiter=None, stale_after=10.0, on_update=None):
+        self.exchange = exchange
+        self.depth = depth
+        self.log = log or print
+        self.limiter = limiter
+        self.stale_after = stale_after
+        self.on_update = on_update
+        self.books = {}  # symbol -> L2Book
+        self.listeners = {}  # symbol -> [callback(book)]
+        self._tasks = {}  # symbol -> stream task
+
+    def _has(self, feature):
+        has = getattr(self.exchange, 'has', None) or {}
+        return bool(has.get(feature))
+
+    def book(self, symbol):
+        """The symbol's L2Book, created empty on first use"""
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = L2Book(symbol, self.depth)
+        return book
+
+    def add_listener(self, symbol, callback):
+        self.listeners.setdefault(symbol, []).append(callback)
+
+    def remove_listener(self, symbol, callback):
+        callbacks = self.listeners.get(symbol, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def subscribe(self, symbols):
+        """Follow more symbols; those already followed are left alone"""
+        if not (self._has('watchOrderBook') or self._has('watchTicker')):
+            return
+        for symbol in symbols:
+            if symbol not in self._tasks:
+                self._tasks[symbol] = asyncio.ensure_future(self._stream(symbol))
+
+    async def stop(self):
+        tasks, self._tasks = list(self._tasks.values()), {}
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def top(self, symbol):
+        """The symbol's book with a current best bid and ask, fetched over REST if the stream has none"""
+        book = self.book(symbol)
+        age = book.age()
+        if age is not None and age <= self.stale_after and book.bid is not None and book.ask is not None:
+            return book
+        if self._has('fetchOrderBook') and hasattr(self.exchange, 'fetch_order_book'):
+            snapshot = await limited_read(self.limiter, ('fetch_order_book', symbol),
+                                          lambda: self.exchange.fetch_order_book(symbol, self.depth))
+            book.reset(snapshot['bids'], snapshot['asks'], snapshot.get('timestamp'), snapshot.get('nonce'))
+        elif self._has('fetchTicker') and hasattr(self.exchange, 'fetch_ticker'):
+            ticker = await limited_read(self.limiter, ('fetch_ticker', symbol),
+                                        lambda: self.exchange.fetch_ticker(symbol))
+            self._apply_ticker(book, ticker)
+        if self.on_update:
+            self.on_update(book)
+        return book
+
+    @staticmethod
+    def _apply_ticker(book, ticker):
+        last = ticker.get('last')
+        bid = ticker.get('bid') or last
+        ask = ticker.get('ask') or last
+        book.reset([[bid, ticker.get('bidVolume') or 0.0]] if bid else [],
+                   [[ask, ticker.get('askVolume') or 0.0]] if ask else [],
+                   ticker.get('timestamp'))
+
+    async def _stream(self, symbol):
+        book = self.book(symbol)
+        delay = 1
+        while True:
+            try:
+                if self._has('watchOrderBook'):
+                    snapshot = await self.exchange.watch_order_book(symbol, self.depth)
+                    book.reset(snapshot['bids'], snapshot['asks'], snapshot.get('timestamp'),
+                               snapshot.get('nonce'))
+                else:
+                    self._apply_ticker(book, await self.exchange.watch_ticker(symbol))
+                delay = 1
+                for callback in list(self.listeners.get(symbol, ())):
+                    callback(book)
+                if self.on_update:
+                    self.on_update(book)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # top() falls back to REST once the book goes stale
+                self.log(f"{symbol} order book stream error: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
@@ -0,0 +1,190 @@
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_MARKETS_CACHE = 'markets_cache.json'
+DEFAULT_MARKETS_TTL = 24 * 3600
+
+# ccxt precisionMode values
+DECIMAL_PLACES = 2
+SIGNIFICANT_DIGITS = 3
+TICK_SIZE = 4
+
+
+def precision_step(value, precision_mode):
+    """Smallest increment for a ccxt precision value, or None when it cannot be expressed as a step"""
+    if value is None:
+        return None
+    if precision_mode == TICK_SIZE:
+        return float(value)
+    if precision_mode == DECIMAL_PLACES:
+        return 10.0 ** -int(value)
+    return None
+
+
+def _decimals(step):
+    """Decimal places needed to print multiples of step without float noise"""
+    return max(0, int(math.ceil(-math.log10(step)))) + 2
+
+
+class MarketPrecision:
+    """Tick, lot and minimum sizes of one market, applied to whole ladders at once"""
+
+    def __init__(self, symbol, tick=None, lot=None, min_amount=None, min_cost=None,
+                 contract_size=1.0, inverse=False):
+        self.symbol = symbol
+        self.tick = tick
+        self.lot = lot
+        self.min_amount = min_amount
+        self.min_cost = min_cost
+        self.contract_size = contract_size or 1.0
+        self.inverse = inverse
+
+    @classmethod
+    def from_market(cls, market, precision_mode=DECIMAL_PLACES):
+        precision = market.get('precision') or {}
+        limits = market.get('limits') or {}
+        return cls(
+            market['symbol'],
+            tick=precision_step(precision.get('price'), precision_mode),
+            lot=precision_step(precision.get('amount'), precision_mode),
+            min_amount=(limits.get('amount') or {}).get('min'),
+            min_cost=(limits.get('cost') or {}).get('min'),
+            contract_size=market.get('contractSize') or 1.0,
+            inverse=bool(market.get('inverse'))
+        )
+
+    def contracts(self, base_sizes, prices):
+        """Order amounts in the market's units for sizes given in the base currency"""
+        if self.inverse:
+            # Inverse contracts are quoted in USD per contract
+            return base_sizes * prices / self.contract_size
+        return base_sizes / self.contract_size
+
+    def round_prices(self, prices):
+        if not self.tick:
+            return prices
+        return np.round(np.round(prices / self.tick) * self.tick, _decimals(self.tick))
+
+    def round_amounts(self, amounts):
+        """Round down to whole lots so a level never exceeds its share of the investment"""
+        if not self.lot:
+            return amounts
+        return np.round(np.floor(amounts / self.lot + 1e-9) * self.lot, _decimals(self.lot))
+
+    def notional(self, amounts, prices):
+        """Quote value of orders of amounts at prices"""
+        if self.inverse:
+            return amounts * self.contract_size
+        return amounts * self.contract_size * prices
+
+    def apply(self, prices, base_sizes):
+        """Round a ladder to tick and lot in one pass; returns (prices, amounts).
+
+        Raises ValueError when any level ends up under the market's minimum
+        amount or cost, since the exchange would reject it anyway.
+        """
+        prices = self.round_prices(np.asarray(prices, dtype=np.float64))
+        amounts = self.round_amounts(self.contracts(np.asarray(base_sizes, dtype=np.float64), prices))
+        too_small = amounts <= 0
+        if self.min_amount:
+            too_small |= amounts < self.min_amount * (1 - 1e-9)
+        if self.min_cost and not self.inverse:
+            too_small |= self.notional(amounts, prices) < self.min_cost * (1 - 1e-9)
+        if too_small.any():
+            raise ValueError(f"{int(too_small.sum())} of {len(amounts)} levels on {self.symbol} are below "
+                             f"the minimum order size (min amount {self.min_amount}, min cost "
+                             f"{self.min_cost}); raise the investment or use fewer grids")
+        if len(np.unique(prices)) < len(prices):
+            raise ValueError(f"Grid step is smaller than the {self.symbol} tick size of {self.tick}")
+        return prices, amounts
+
+
+class MarketCache:
+    """load_markets() results per exchange, persisted to disk with a TTL.
+
+    attach() hands cached markets to a fresh client with set_markets(), so
+    connecting needs no markets request while the cache is fresh.
+    precision() works without any client, e.g. for previews before
+    connecting, from whatever was cached last.
+    """
+
+    def __init__(self, path=DEFAULT_MARKETS_CACHE, ttl=DEFAULT_MARKETS_TTL, log=None):
+        self.path = path
+        self.ttl = ttl
+        self.log = log or print
+        self._lock = threading.Lock()
+        self._entries = None  # exchange id -> {'fetched_at', 'precision_mode', 'markets'}
+        self._tables = {}  # (exchange id, symbol) -> MarketPrecision
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r') as f:
+                        self._entries = json.load(f)
+                except (OSError, ValueError) as e:
+                    self.log(f"Ignoring unreadable markets cache {self.path}: {str(e)}")
+        return self._entries
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp, self.path)
+
+    def is_fresh(self, exchange_id):
+        with self._lock:
+            entry = self._load().get(exchange_id)
+        return entry is not None and time.time() - entry['fetched_at'] < self.ttl
+
+    def store(self, exchange_id, markets, precision_mode=DECIMAL_PLACES):
+        """Replace the cached markets of one exchange and persist them"""
+        with self._lock:
+            self._load()[exchange_id] = {
+                'fetched_at': time.time(),
+                'precision_mode': precision_mode,
+                'markets': markets
+            }
+            self._tables = {key: table for key, table in self._tables.items() if key[0] != exchange_id}
+            try:
+                self._save()
+            except (OSError, TypeError, ValueError) as e:
+                self.log(f"Could not persist markets cache: {str(e)}")
+
+    async def attach(self, exchange_id, exchange, load=None, reload=False):
+        """Give exchange its markets from the cache, or load and cache them when stale.
+
+        load is the coroutine function used to fetch (default
+        exchange.load_markets), so callers can route it through a limiter.
+        """
+        if not reload and self.is_fresh(exchange_id) and hasattr(exchange, 'set_markets'):
+            with self._lock:
+                markets = self._entries[exchange_id]['markets']
+            exchange.set_markets(markets)
+            return markets
+
+        markets = await (load or exchange.load_markets)()
+        if markets:
+            self.store(exchange_id, markets, getattr(exchange, 'precisionMode', DECIMAL_PLACES))
+        return markets
+
+    def precision(self, exchange_id, symbol):
+        """MarketPrecision for symbol, or None if the market was never loaded"""
+        key = (exchange_id, symbol)
+        with self._lock:
+            table = self._tables.get(key)
+            if table is None:
+                entry = self._load().get(exchange_id)
+                market = entry['markets'].get(symbol) if entry else None
+                if market is None:
+                    return None
+                table = self._tables[key] = MarketPrecision.from_market(market, entry['precision_mode'])
+            return table
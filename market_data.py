@@ -0,0 +1,202 @@
+"""Local cache of historical candles and trades.
+
+Each series is a raw little-endian float64 file of fixed-width rows, so a
+file can be appended to as chunks arrive and later opened as a zero-copy
+np.memmap. Interrupted syncs resume from the last complete row.
+
+    python -m market_data sync --exchange phemex --symbol BTC/USD:USD --timeframe 1m --days 365
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+OHLCV_COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+TRADE_COLUMNS = ('timestamp', 'price', 'amount', 'side')  # side: 1 buy, -1 sell, 0 unknown
+
+ROW_DTYPE = np.dtype('<f8')
+
+TIMEFRAME_UNITS = {'s': 1000, 'm': 60000, 'h': 3600000, 'd': 86400000, 'w': 604800000}
+
+
+def timeframe_ms(timeframe):
+    """Length of a ccxt timeframe string such as '1m' or '4h' in milliseconds"""
+    try:
+        return int(timeframe[:-1]) * TIMEFRAME_UNITS[timeframe[-1]]
+    except (KeyError, ValueError):
+        raise ValueError(f"Unsupported timeframe: {timeframe}")
+
+
+def safe_symbol(symbol):
+    return symbol.replace('/', '-').replace(':', '-')
+
+
+class MarketDataStore:
+    """Append-only columnar files per exchange, symbol and timeframe"""
+
+    def __init__(self, root='data', exchange_id='phemex', log=None):
+        self.root = root
+        self.exchange_id = exchange_id
+        self.log = log or print
+
+    def ohlcv_path(self, symbol, timeframe):
+        return os.path.join(self.root, self.exchange_id, safe_symbol(symbol), f"ohlcv_{timeframe}.f64")
+
+    def trades_path(self, symbol):
+        return os.path.join(self.root, self.exchange_id, safe_symbol(symbol), "trades.f64")
+
+    def _load(self, path, width):
+        """Memory-map a series read-only; a trailing partial row is ignored"""
+        if not os.path.exists(path):
+            return np.empty((0, width), dtype=ROW_DTYPE)
+        rows = os.path.getsize(path) // (ROW_DTYPE.itemsize * width)
+        if rows == 0:
+            return np.empty((0, width), dtype=ROW_DTYPE)
+        return np.memmap(path, dtype=ROW_DTYPE, mode='r', shape=(rows, width))
+
+    def load_ohlcv(self, symbol, timeframe):
+        """Candles as an (N, 6) read-only memmap in OHLCV_COLUMNS order"""
+        return self._load(self.ohlcv_path(symbol, timeframe), len(OHLCV_COLUMNS))
+
+    def load_trades(self, symbol):
+        """Trades as an (N, 4) read-only memmap in TRADE_COLUMNS order"""
+        return self._load(self.trades_path(symbol), len(TRADE_COLUMNS))
+
+    def _repair(self, path, width):
+        """Drop a partially written row left behind by an interrupted sync"""
+        if not os.path.exists(path):
+            return
+        row_bytes = ROW_DTYPE.itemsize * width
+        size = os.path.getsize(path)
+        if size % row_bytes:
+            with open(path, 'r+b') as f:
+                f.truncate(size - size % row_bytes)
+
+    def _append(self, path, rows, width):
+        """Append rows and make them durable before the next page is requested"""
+        rows = np.ascontiguousarray(rows, dtype=ROW_DTYPE).reshape(-1, width)
+        if not len(rows):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(rows.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return len(rows)
+
+    def _last_timestamp(self, path, width):
+        data = self._load(path, width)
+        return int(data[-1, 0]) if len(data) else None
+
+    def sync_ohlcv(self, exchange, symbol, timeframe='1m', since=None, until=None, limit=1000):
+        """Download candles after the last stored one; returns the number of new rows"""
+        path = self.ohlcv_path(symbol, timeframe)
+        width = len(OHLCV_COLUMNS)
+        self._repair(path, width)
+
+        step = timeframe_ms(timeframe)
+        until = until or int(time.time() * 1000)
+        last = self._last_timestamp(path, width)
+        if last is not None:
+            since = last + step
+        elif since is None:
+            raise ValueError("since is required for the first sync of a series")
+
+        added = 0
+        while since + step <= until:
+            rows = exchange.fetch_ohlcv(symbol, timeframe, since, limit)
+            if not rows:
+                break
+            rows = np.asarray(rows, dtype=ROW_DTYPE)[:, :width]
+            # Only closed candles: a forming one would never be corrected, the next sync resumes after it
+            rows = rows[(rows[:, 0] >= since) & (rows[:, 0] + step <= until)]
+            if not len(rows):
+                break
+            added += self._append(path, rows, width)
+            since = int(rows[-1, 0]) + step
+            self.log(f"{symbol} {timeframe}: {added} candles synced, up to "
+                     f"{time.strftime('%Y-%m-%d %H:%M', time.gmtime(since / 1000))} UTC")
+        return added
+
+    def sync_trades(self, exchange, symbol, since=None, until=None, limit=1000):
+        """Download trades after the last stored one; returns the number of new rows"""
+        path = self.trades_path(symbol)
+        width = len(TRADE_COLUMNS)
+        self._repair(path, width)
+
+        until = until or int(time.time() * 1000)
+        data = self._load(path, width)
+        if len(data):
+            # Trades sharing the last timestamp may be incomplete, so refetch them
+            since = int(data[-1, 0])
+            keep = int(np.searchsorted(data[:, 0], since, side='left'))
+            del data
+            with open(path, 'r+b') as f:
+                f.truncate(keep * width * ROW_DTYPE.itemsize)
+        elif since is None:
+            raise ValueError("since is required for the first sync of a series")
+
+        added = 0
+        sides = {'buy': 1.0, 'sell': -1.0}
+        while since < until:
+            trades = exchange.fetch_trades(symbol, since, limit)
+            trades = [t for t in trades if since <= t['timestamp'] < until]
+            if not trades:
+                break
+            rows = np.array([(t['timestamp'], t['price'], t['amount'], sides.get(t.get('side'), 0.0))
+                             for t in trades], dtype=ROW_DTYPE)
+            last = int(rows[-1, 0])
+            if last > since and len(trades) >= limit:
+                # A full page may cut its last millisecond short; refetch it with the next page
+                rows = rows[rows[:, 0] < last]
+                next_since = last
+            else:
+                next_since = last + 1
+            added += self._append(path, rows, width)
+            since = next_since
+            self.log(f"{symbol}: {added} trades synced")
+        return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local market data cache")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sync = sub.add_parser('sync', help="Download missing candles (and optionally trades)")
+    sync.add_argument('--exchange', default='phemex', help="ccxt exchange id")
+    sync.add_argument('--symbol', required=True)
+    sync.add_argument('--timeframe', default='1m')
+    sync.add_argument('--days', type=float, default=365, help="History to fetch on the first sync")
+    sync.add_argument('--trades', action='store_true', help="Also sync the public trade tape")
+    sync.add_argument('--root', default='data')
+
+    info = sub.add_parser('info', help="Show what is stored for a symbol")
+    info.add_argument('--exchange', default='phemex')
+    info.add_argument('--symbol', required=True)
+    info.add_argument('--timeframe', default='1m')
+    info.add_argument('--root', default='data')
+
+    args = parser.parse_args(argv)
+    store = MarketDataStore(args.root, args.exchange)
+
+    if args.command == 'sync':
+        import ccxt
+
+        exchange = getattr(ccxt, args.exchange)({'enableRateLimit': True})
+        since = int((time.time() - args.days * 86400) * 1000)
+        store.sync_ohlcv(exchange, args.symbol, args.timeframe, since=since)
+        if args.trades:
+            store.sync_trades(exchange, args.symbol, since=since)
+
+    candles = store.load_ohlcv(args.symbol, args.timeframe)
+    if len(candles):
+        first, last = (time.strftime('%Y-%m-%d %H:%M', time.gmtime(ts / 1000))
+                       for ts in (candles[0, 0], candles[-1, 0]))
+        print(f"{args.symbol} {args.timeframe}: {len(candles)} candles from {first} to {last} UTC")
+    else:
+        print(f"{args.symbol} {args.timeframe}: no candles stored")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import bisect
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Exchange coroutines that are one REST round-trip each; watch_* streams block by design
+TIMED_PREFIXES = ('fetch_', 'create_', 'cancel_', 'edit_', 'set_')
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+def _summary_label(labels):
+    """'method', or 'venue:method' for series labelled with a venue"""
+    method = labels.get('method')
+    if method is None or 'venue' not in labels:
+        return method
+    return f"{labels['venue']}:{method}"
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, cheap enough for the hot path"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate the q-quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return min(lower + (bound - lower) * (rank - seen) / count, self.max)
+            seen += count
+            lower = bound
+        return self.max
+
+
+class Metrics:
+    """Thread-safe registry of latency histograms, counters and gauges.
+
+    render() produces the Prometheus text format, so the same numbers can be
+    scraped over HTTP (serve_metrics) or written to a file (MetricsFileWriter).
+    Collectors registered with add_collector() run before each export to
+    copy in state kept elsewhere, such as the request scheduler's queues.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # name -> {label key: Histogram}
+        self.counters = {}  # name -> {label key: value}
+        self.gauges = {}  # name -> {label key: value}
+        self._collectors = []
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            key = _label_key(labels)
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def set_counter(self, name, value, **labels):
+        """Export a running total kept elsewhere, such as the scheduler's, as a counter"""
+        with self._lock:
+            self.counters.setdefault(name, {})[_label_key(labels)] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the wall time of a block, whether or not it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, collector):
+        """Call collector(metrics) before every export"""
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def collect(self):
+        for collector in list(self._collectors):
+            try:
+                collector(self)
+            except Exception:
+                pass
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        self.collect()
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(series.items()):
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, name):
+        """{labels: {'count', 'p50', 'p99', 'max'}} for one histogram, in seconds"""
+        with self._lock:
+            return {_summary_label(dict(key)) or _format_labels(key): {
+                'count': histogram.count,
+                'p50': histogram.quantile(0.5),
+                'p99': histogram.quantile(0.99),
+                'max': histogram.max
+            } for key, histogram in sorted(self.histograms.get(name, {}).items())}
+
+    def write(self, path):
+        """Write render() to path atomically, so readers never see half a file"""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+# Process-wide registry the exchange wrapper, scheduler and grid engines report into
+METRICS = Metrics()
+
+
+class InstrumentedExchange:
+    """Wrap an async ccxt exchange to time every REST call and count its errors.
+
+    Records exchange_request_seconds{method} and
+    exchange_errors_total{method,error}, both also labelled with venue when
+    one is given, so latency can be compared across exchanges; streams and
+    everything else pass through untouched.
+    """
+
+    def __init__(self, exchange, metrics=None, venue=None):
+        self.exchange = exchange
+        self.metrics = metrics or METRICS
+        self.labels = {'venue': venue} if venue else {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.exchange, name)
+        if not (name.startswith(TIMED_PREFIXES) and inspect.iscoroutinefunction(attr)):
+            return attr
+
+        async def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            except Exception as e:
+                self.metrics.inc('exchange_errors_total', method=name, error=type(e).__name__, **self.labels)
+                raise
+            finally:
+                self.metrics.observe('exchange_request_seconds', time.perf_counter() - start, method=name,
+                                     **self.labels)
+        return call
+
+
+def scheduler_collector(limiter):
+    """Collector exporting a RequestScheduler's queue depth and waits per lane"""
+    def collect(metrics):
+        state = limiter.metrics()
+        for lane, stats in state['lanes'].items():
+            metrics.set('scheduler_queue_depth', stats['depth'], lane=lane)
+            metrics.set_counter('scheduler_granted_total', stats['granted'], lane=lane)
+            metrics.set_counter('scheduler_queued_total', stats['queued'], lane=lane)
+            metrics.set_counter('scheduler_wait_seconds_total', round(stats['wait_time'], 6), lane=lane)
+            metrics.set('scheduler_max_wait_seconds', round(stats['max_wait'], 6), lane=lane)
+        metrics.set_counter('scheduler_coalesced_reads_total', state['coalesced'])
+    return collect
+
+
+def format_summary(metrics=None, name='exchange_request_seconds'):
+    """Human readable p50/p99 table of one histogram, e.g. for the log at shutdown"""
+    metrics = metrics or METRICS
+    lines = [f"{'method':>32} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for label, stats in metrics.summary(name).items():
+        lines.append(f"{label:>32} {stats['count']:>8} {stats['p50'] * 1000:>9.1f} "
+                     f"{stats['p99'] * 1000:>9.1f} {stats['max'] * 1000:>9.1f}")
+    return '\n'.join(lines)
+
+
+class MetricsFileWriter:
+    """Rewrite a Prometheus text file every interval seconds from a background thread"""
+
+    def __init__(self, path, interval=15, metrics=None):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics or METRICS
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread and write the final numbers"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            stopping = self._stop.wait(self.interval)
+            try:
+                self.metrics.write(self.path)
+            except OSError:
+                pass
+            if stopping:
+                return
+
+
+def serve_metrics(port, host='127.0.0.1', metrics=None):
+    """Serve /metrics for Prometheus from a daemon thread; returns the server (call shutdown())"""
+    metrics = metrics or METRICS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') not in ('', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,189 @@
+"""Parallel parameter sweeps over the vectorized grid backtester.
+
+    python -m optimizer --csv btc_1m.csv --lower 55000 60000 --upper 70000 75000 \
+        --grids 10 20 40 --leverage 1 2 5 --direction Long Short
+"""
+import argparse
+import itertools
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtest import add_candle_arguments, backtest_grid, candle_path, load_candles
+from grid_core import EXCHANGE_CONFIGS, parse_grid_params
+
+# Sort direction for each supported ranking key
+RANK_KEYS = {
+    'net_pnl': True,
+    'return_pct': True,
+    'max_drawdown_pct': False,
+    'pnl_to_drawdown': True
+}
+
+
+def parameter_grid(lower_prices, upper_prices, num_grids, leverages, directions, investment,
+                   spacings=('arithmetic',)):
+    """Every valid combination of the given parameter values"""
+    param_sets = []
+    for lower, upper, grids, leverage, direction, spacing in itertools.product(
+            lower_prices, upper_prices, num_grids, leverages, directions, spacings):
+        if upper <= lower:
+            continue
+        param_sets.append(parse_grid_params({
+            'lower_price': lower,
+            'upper_price': upper,
+            'num_grids': grids,
+            'spacing': spacing,
+            'investment': investment,
+            'leverage': leverage,
+            'direction': direction
+        }))
+    return param_sets
+
+
+class SharedCandles:
+    """Publish an OHLCV array once in shared memory so workers read it without pickling"""
+
+    def __init__(self, candles):
+        self.shm = None
+        if is_file_mapped(candles):
+            # Already backed by a file: workers map the same pages from the page cache
+            self.array = candles
+            self.spec = ('file', candles.filename, candles.shape, candles.dtype.str)
+            return
+        candles = np.ascontiguousarray(candles, dtype=np.float64)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, candles.nbytes))
+        self.array = np.ndarray(candles.shape, dtype=candles.dtype, buffer=self.shm.buf)
+        self.array[:] = candles
+        self.spec = ('shm', self.shm.name, candles.shape, candles.dtype.str)
+
+    def close(self):
+        self.array = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_file_mapped(candles):
+    """True for a float64 np.memmap over a whole file, such as MarketDataStore.load_ohlcv()"""
+    return (isinstance(candles, np.memmap) and isinstance(candles.base, mmap.mmap)
+            and candles.offset == 0 and candles.dtype == np.float64 and candles.flags.c_contiguous)
+
+
+# Worker-side view of the shared candles and their tick path, set once per process
+_worker_candles = None
+_worker_ticks = None
+_worker_shm = None
+
+
+def _set_worker_candles(candles):
+    global _worker_candles, _worker_ticks
+    _worker_candles = candles
+    _worker_ticks = None
+    if candles is not None:
+        _worker_ticks = candle_path(candles[:, 1], candles[:, 2], candles[:, 3], candles[:, 4])
+
+
+def _attach_candles(spec):
+    global _worker_shm
+    kind, name, shape, dtype = spec
+    if kind == 'file':
+        candles = np.memmap(name, dtype=dtype, mode='r', shape=tuple(shape))
+    else:
+        # Pool workers share the parent's resource tracker, so attaching here does
+        # not take ownership; the parent unlinks the segment once the sweep ends
+        _worker_shm = shared_memory.SharedMemory(name=name)
+        candles = np.ndarray(shape, dtype=dtype, buffer=_worker_shm.buf)
+        candles.flags.writeable = False
+    _set_worker_candles(candles)
+
+
+def _run_chunk(param_sets, exchange):
+    results = []
+    for params in param_sets:
+        result = backtest_grid(_worker_candles, params, exchange=exchange, ticks=_worker_ticks)
+        result['params'] = params
+        results.append(result)
+    return results
+
+
+def rank_results(results, key='net_pnl'):
+    """Sort sweep results best first; ties are broken by the smaller drawdown"""
+    if key not in RANK_KEYS:
+        raise ValueError(f"Unknown ranking key: {key}")
+    for result in results:
+        result['pnl_to_drawdown'] = result['net_pnl'] / max(result['max_drawdown'], 1e-9)
+    descending = RANK_KEYS[key]
+    return sorted(results, key=lambda r: (-r[key] if descending else r[key], r['max_drawdown_pct']))
+
+
+def sweep(candles, param_sets, workers=None, chunk_size=None, exchange='Phemex', rank_by='net_pnl'):
+    """Backtest every parameter set across a process pool and rank the results"""
+    if not param_sets:
+        return []
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        _set_worker_candles(np.asarray(candles, dtype=np.float64))
+        try:
+            return rank_results(_run_chunk(param_sets, exchange), rank_by)
+        finally:
+            _set_worker_candles(None)
+
+    # A few chunks per worker keeps the pool busy without per-task overhead dominating
+    chunk_size = chunk_size or max(1, len(param_sets) // (workers * 4))
+    chunks = [param_sets[i:i + chunk_size] for i in range(0, len(param_sets), chunk_size)]
+
+    results = []
+    with SharedCandles(candles) as shared:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_candles,
+                                 initargs=(shared.spec,)) as pool:
+            for chunk_results in pool.map(_run_chunk, chunks, itertools.repeat(exchange)):
+                results.extend(chunk_results)
+    return rank_results(results, rank_by)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep grid parameters over historical candles")
+    add_candle_arguments(parser)
+    parser.add_argument('--lower', type=float, nargs='+', required=True)
+    parser.add_argument('--upper', type=float, nargs='+', required=True)
+    parser.add_argument('--grids', type=int, nargs='+', default=[10])
+    parser.add_argument('--leverage', type=int, nargs='+', default=[1])
+    parser.add_argument('--direction', nargs='+', choices=['Long', 'Short'], default=['Long'])
+    parser.add_argument('--spacing', nargs='+', choices=['arithmetic', 'geometric', 'volatility'],
+                        default=['arithmetic'])
+    parser.add_argument('--investment', type=float, default=100)
+    parser.add_argument('--exchange', default='Phemex', choices=list(EXCHANGE_CONFIGS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--rank-by', default='net_pnl', choices=list(RANK_KEYS))
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    candles = load_candles(args)
+    param_sets = parameter_grid(args.lower, args.upper, args.grids, args.leverage,
+                                args.direction, args.investment, args.spacing)
+    results = sweep(candles, param_sets, workers=args.workers, exchange=args.exchange,
+                    rank_by=args.rank_by)
+
+    print(f"{'lower':>10} {'upper':>10} {'grids':>6} {'lev':>4} {'dir':>6} {'spacing':>10} "
+          f"{'net pnl':>12} {'max dd %':>9} {'fills':>7} {'liq':>4}")
+    for result in results[:args.top]:
+        p = result['params']
+        print(f"{p['lower_price']:>10.2f} {p['upper_price']:>10.2f} {p['num_grids']:>6} "
+              f"{p['leverage']:>4} {p['direction']:>6} {p['spacing']:>10} {result['net_pnl']:>12.2f} "
+              f"{result['max_drawdown_pct']:>9.2f} {result['fills']:>7} "
+              f"{'yes' if result['liquidated'] else 'no':>4}")
+
+
+if __name__ == "__main__":
+    main()
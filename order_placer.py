@@ -0,0 +1,305 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import batch_fit, limited_read
+
+# Orders sent per create_orders call when the exchange does not advertise a limit
+DEFAULT_BATCH_SIZE = 20
+
+# ccxt errors that mean the venue refused the whole request, so none of its orders exist
+REJECTION_ERRORS = ('BadRequest', 'InvalidOrder', 'InsufficientFunds', 'NotSupported', 'AuthenticationError',
+                    'PermissionDenied', 'AccountSuspended', 'ArgumentsRequired')
+
+# ccxt's error for a post-only order the venue would have filled as a taker
+POST_ONLY_ERRORS = ('OrderImmediatelyFillable',)
+
+# Open orders this much older than a batch request cannot have come from it
+CLOCK_SKEW_MS = 5000
+
+
+def reset_levels(levels):
+    """Mark every level as pending before submission"""
+    for level in levels:
+        level['order'] = None
+        level['status'] = 'pending'
+        level['error'] = None
+
+
+def batch_requests(symbol, levels, params=None):
+    """Translate grid levels into create_orders request dicts"""
+    requests = [{
+        'symbol': symbol,
+        'type': 'limit',
+        'side': level['type'],
+        'amount': level['size'],
+        'price': level['price'],
+    } for level in levels]
+    if params:
+        for request in requests:
+            request['params'] = dict(params)
+    return requests
+
+
+def apply_batch_result(levels, orders):
+    """Record the per-order outcome of a create_orders response"""
+    for i, level in enumerate(levels):
+        order = orders[i] if i < len(orders) else None
+        if order and order.get('id') and order.get('status') != 'rejected':
+            level['order'] = order
+            level['status'] = 'open'
+        else:
+            level['status'] = 'failed'
+            level['error'] = (order or {}).get('info') or 'No order returned by batch request'
+
+
+def batch_rejected(error):
+    """True if error proves a create_orders call placed nothing; timeouts and network errors do not"""
+    if isinstance(error, (ValueError, TypeError, NotImplementedError)):
+        return True
+    return any(cls.__name__ in REJECTION_ERRORS for cls in type(error).__mro__)
+
+
+def post_only_rejected(error):
+    """True if error is the venue refusing a post-only order because it would have taken liquidity"""
+    if any(cls.__name__ in POST_ONLY_ERRORS for cls in type(error).__mro__):
+        return True
+    # Venues mapped to a plain InvalidOrder, and the paper exchange, only say so in the message
+    message = str(error).lower()
+    return 'post-only' in message or 'post only' in message
+
+
+def claim_placed(levels, open_orders, since_ms):
+    """Attach open orders placed since since_ms to the levels they match; returns the levels left unplaced.
+
+    An order matches a level with the same side, price and amount, and is
+    claimed by one level at most.
+    """
+    candidates = [order for order in open_orders
+                  if order.get('timestamp') is None or order['timestamp'] >= since_ms - CLOCK_SKEW_MS]
+    unplaced = []
+    for level in levels:
+        match = next((order for order in candidates if order.get('side') == level['type']
+                      and math.isclose(float(order.get('price') or 0.0), level['price'], rel_tol=1e-9)
+                      and math.isclose(float(order.get('amount') or 0.0), level['size'], rel_tol=1e-9)), None)
+        if match is None:
+            unplaced.append(level)
+            continue
+        candidates.remove(match)
+        level['order'] = match
+        level['status'] = 'open'
+    return unplaced
+
+
+def mark_unknown(levels, error):
+    """Fail levels whose batch may or may not have reached the book"""
+    for level in levels:
+        level['status'] = 'failed'
+        level['error'] = f"Batch outcome unknown, not placed again: {error}"
+
+
+def exchange_supports_batch(exchange):
+    """Check whether the exchange exposes a usable batch order endpoint"""
+    has = getattr(exchange, 'has', None) or {}
+    return bool(has.get('createOrders')) and hasattr(exchange, 'create_orders')
+
+
+class GridOrderPlacer:
+    """Place a ladder of grid orders through a batch endpoint or a bounded worker pool"""
+
+    def __init__(self, exchange, max_workers=8, batch_size=None, log=None):
+        self.exchange = exchange
+        self.max_workers = max_workers
+        self.batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self.log = log or print
+
+        # ccxt expresses its rate limit as milliseconds between requests
+        self.min_interval = (getattr(exchange, 'rateLimit', 0) or 0) / 1000.0
+        self._slot_lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def supports_batch(self):
+        return exchange_supports_batch(self.exchange)
+
+    def place(self, symbol, levels):
+        """Submit an order for every level and record the outcome on each level dict"""
+        reset_levels(levels)
+        if not levels:
+            return levels
+
+        if self.supports_batch():
+            self._place_batched(symbol, levels)
+        else:
+            self._place_pooled(symbol, levels)
+        return levels
+
+    def _wait_for_slot(self, cost=1):
+        """Space request start times by the rate limit across all workers; cost is the number of orders sent"""
+        if self.min_interval <= 0:
+            return
+        with self._slot_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval * cost
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def _place_batched(self, symbol, levels):
+        """Send levels in chunks through create_orders"""
+        for start in range(0, len(levels), self.batch_size):
+            chunk = levels[start:start + self.batch_size]
+            sent_ms = time.time() * 1000
+            try:
+                self._wait_for_slot(len(chunk))
+                orders = self.exchange.create_orders(batch_requests(symbol, chunk))
+            except Exception as e:
+                if batch_rejected(e):
+                    # Batch endpoint refused the chunk, retry those levels one by one
+                    self.log(f"Batch order request rejected, falling back to single orders: {str(e)}")
+                    self._place_pooled(symbol, chunk)
+                else:
+                    self.log(f"Batch order request failed, checking open orders before placing again: {str(e)}")
+                    self._recover_batch(symbol, chunk, sent_ms, e)
+                continue
+            apply_batch_result(chunk, orders)
+
+    def _recover_batch(self, symbol, levels, sent_ms, error):
+        """Place only the levels of a failed batch that did not reach the book"""
+        try:
+            self._wait_for_slot()
+            open_orders = self.exchange.fetch_open_orders(symbol)
+        except Exception as e:
+            self.log(f"Error fetching open orders of {symbol}: {str(e)}")
+            mark_unknown(levels, error)
+            return
+        unplaced = claim_placed(levels, open_orders, sent_ms)
+        if unplaced:
+            self._place_pooled(symbol, unplaced)
+
+    def _place_single(self, symbol, level):
+        """Place one level and record its outcome"""
+        try:
+            self._wait_for_slot()
+            if level['type'] == 'buy':
+                order = self.exchange.create_limit_buy_order(symbol, level['size'], level['price'])
+            else:
+                order = self.exchange.create_limit_sell_order(symbol, level['size'], level['price'])
+            level['order'] = order
+            level['status'] = 'open'
+        except Exception as e:
+            level['status'] = 'failed'
+            level['error'] = str(e)
+        return level
+
+    def _place_pooled(self, symbol, levels):
+        """Place levels concurrently with a bounded number of in-flight requests"""
+        workers = max(1, min(self.max_workers, len(levels)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda level: self._place_single(symbol, level), levels))
+
+
+class AsyncGridOrderPlacer:
+    """asyncio counterpart of GridOrderPlacer for ccxt.async_support exchanges"""
+
+    def __init__(self, exchange, max_in_flight=8, batch_size=None, log=None, limiter=None, post_only=False):
+        self.exchange = exchange
+        self.max_in_flight = max_in_flight
+        self.log = log or print
+        self.limiter = limiter  # shared AsyncTokenBucket, replaces local spacing when set
+        # Venues count every order of a batch against their limits, so a batch costs one token per order
+        self.batch_size = batch_fit(limiter, 'order', batch_size or DEFAULT_BATCH_SIZE)
+        # Post-only orders are rejected instead of filling as taker if the market moved onto them
+        self.params = {'postOnly': True} if post_only else {}
+
+        self.min_interval = (getattr(exchange, 'rateLimit', 0) or 0) / 1000.0
+        self._next_slot = 0.0
+
+    def supports_batch(self):
+        return exchange_supports_batch(self.exchange)
+
+    async def place(self, symbol, levels):
+        """Submit an order for every level and record the outcome on each level dict"""
+        reset_levels(levels)
+        if not levels:
+            return levels
+
+        if self.supports_batch():
+            await self._place_batched(symbol, levels)
+        else:
+            await self._place_pooled(symbol, levels)
+        return levels
+
+    async def _wait_for_slot(self, cost=1):
+        """Space request start times by the exchange rate limit; cost is the number of orders sent"""
+        if self.limiter is not None:
+            await self.limiter.acquire(cost, lane='order')
+            return
+        if self.min_interval <= 0:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.min_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _place_batched(self, symbol, levels):
+        """Send levels in chunks through create_orders"""
+        for start in range(0, len(levels), self.batch_size):
+            chunk = levels[start:start + self.batch_size]
+            sent_ms = time.time() * 1000
+            try:
+                await self._wait_for_slot(len(chunk))
+                orders = await self.exchange.create_orders(batch_requests(symbol, chunk, self.params))
+            except Exception as e:
+                if batch_rejected(e):
+                    self.log(f"Batch order request rejected, falling back to single orders: {str(e)}")
+                    await self._place_pooled(symbol, chunk)
+                else:
+                    self.log(f"Batch order request failed, checking open orders before placing again: {str(e)}")
+                    await self._recover_batch(symbol, chunk, sent_ms, e)
+                continue
+            apply_batch_result(chunk, orders)
+
+    async def _recover_batch(self, symbol, levels, sent_ms, error):
+        """Place only the levels of a failed batch that did not reach the book.
+
+        A timeout or dropped connection says nothing about whether the venue
+        took the batch, so its open orders are checked first.
+        """
+        try:
+            # Its own key: a coalesced read may have been sent before the batch reached the venue
+            open_orders = await limited_read(self.limiter, ('fetch_open_orders', symbol, sent_ms),
+                                             lambda: self.exchange.fetch_open_orders(symbol))
+        except Exception as e:
+            self.log(f"Error fetching open orders of {symbol}: {str(e)}")
+            mark_unknown(levels, error)
+            return
+        unplaced = claim_placed(levels, open_orders, sent_ms)
+        if unplaced:
+            await self._place_pooled(symbol, unplaced)
+
+    async def _place_single(self, symbol, level, semaphore):
+        """Place one level and record its outcome"""
+        async with semaphore:
+            try:
+                await self._wait_for_slot()
+                if level['type'] == 'buy':
+                    order = await self.exchange.create_limit_buy_order(symbol, level['size'], level['price'],
+                                                                       self.params)
+                else:
+                    order = await self.exchange.create_limit_sell_order(symbol, level['size'], level['price'],
+                                                                        self.params)
+                level['order'] = order
+                level['status'] = 'open'
+            except Exception as e:
+                level['status'] = 'failed'
+                level['error'] = str(e)
+        return level
+
+    async def _place_pooled(self, symbol, levels):
+        """Place levels concurrently with a bounded number of in-flight requests"""
+        semaphore = asyncio.Semaphore(max(1, self.max_in_flight))
+        await asyncio.gather(*(self._place_single(symbol, level, semaphore) for level in levels))
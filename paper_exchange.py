@@ -0,0 +1,615 @@
+"""Paper trading against a local matching engine.
+
+PaperExchange speaks the async ccxt methods the bot uses, including the
+private order, trade, balance and position streams, so ExchangeService
+runs on it unchanged. Resting limit orders are matched against a price
+feed: a live public client, a recorded candle series from the market
+data store, or any async iterable of (symbol, price) ticks.
+"""
+import asyncio
+import collections
+import heapq
+import itertools
+import time
+
+import numpy as np
+
+from exchange_adapters import create_client
+from market_data import MarketDataStore
+
+PAPER_EXCHANGE_ID = 'paper'
+DEFAULT_PAPER_BALANCE = 10000.0
+# Public client the paper exchange takes live prices and market metadata from
+PAPER_PRICE_SOURCE = 'phemex'
+# Filled and cancelled orders and own trades kept for fetch_closed_orders / fetch_my_trades
+HISTORY_LIMIT = 100000
+
+
+class OrderBook:
+    """Resting limit orders of one symbol, matched against traded prices.
+
+    Bids and asks are heaps keyed by price then arrival, so placing an
+    order costs O(log n) and a tick that crosses nothing costs O(1).
+    Cancelled orders stay in the heaps until they surface or a compaction
+    drops them.
+    """
+
+    def __init__(self, value=None):
+        self.bids = []  # (-price, seq, order id)
+        self.asks = []  # (price, seq, order id)
+        self.orders = {}  # order id -> order
+        self.value = value or (lambda amount, price: amount * price)  # quote value of amount at price
+        self.notional = {'buy': 0.0, 'sell': 0.0}  # quote value of the resting orders per side
+        self._live = {}  # order id -> seq of its current heap entry
+        self._seq = itertools.count()
+        self._stale = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def add(self, order):
+        seq = next(self._seq)
+        self.orders[order['id']] = order
+        self._live[order['id']] = seq
+        self.notional[order['side']] += self.value(order['remaining'], order['price'])
+        if order['side'] == 'buy':
+            heapq.heappush(self.bids, (-order['price'], seq, order['id']))
+        else:
+            heapq.heappush(self.asks, (order['price'], seq, order['id']))
+
+    def remove(self, order_id):
+        """Take an order off the book; returns it, or None if it is not resting"""
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        del self._live[order_id]
+        self.notional[order['side']] -= self.value(order['remaining'], order['price'])
+        self._stale += 1
+        if self._stale > 1024 and self._stale > len(self.orders):
+            self._compact()
+        return order
+
+    def amend(self, order_id, amount=None, price=None):
+        """Change an order in place; a new price loses its time priority"""
+        order = self.remove(order_id)
+        if order is None:
+            return None
+        if amount is not None:
+            order['remaining'] = amount - order['filled']
+            order['amount'] = amount
+        if price is not None:
+            order['price'] = price
+        self.add(order)
+        return order
+
+    def _compact(self):
+        self.bids = [entry for entry in self.bids if self._live.get(entry[2]) == entry[1]]
+        self.asks = [entry for entry in self.asks if self._live.get(entry[2]) == entry[1]]
+        heapq.heapify(self.bids)
+        heapq.heapify(self.asks)
+        self._stale = 0
+
+    def match(self, price):
+        """Pop every order a trade at price reaches, best priced and oldest first"""
+        filled = []
+        bids, asks, live = self.bids, self.asks, self._live
+        while bids and -bids[0][0] >= price:
+            _, seq, order_id = heapq.heappop(bids)
+            if live.get(order_id) == seq:
+                filled.append(self._take(order_id))
+        while asks and asks[0][0] <= price:
+            _, seq, order_id = heapq.heappop(asks)
+            if live.get(order_id) == seq:
+                filled.append(self._take(order_id))
+        return filled
+
+    def _take(self, order_id):
+        order = self.orders.pop(order_id)
+        del self._live[order_id]
+        self.notional[order['side']] -= self.value(order['remaining'], order['price'])
+        return order
+
+
+def candle_path(candles):
+    """Price path through OHLC candles: open, the nearer extreme, the other extreme, close.
+
+    A rising candle is assumed to trade down to its low before its high
+    and a falling one the reverse, so both sides of a grid get touched.
+    """
+    candles = np.asarray(candles, dtype=np.float64)
+    opens, highs, lows, closes = candles[:, 1], candles[:, 2], candles[:, 3], candles[:, 4]
+    rising = closes >= opens
+    path = np.empty((len(candles), 4))
+    path[:, 0] = opens
+    path[:, 1] = np.where(rising, lows, highs)
+    path[:, 2] = np.where(rising, highs, lows)
+    path[:, 3] = closes
+    return path.ravel()
+
+
+async def replay_feed(symbol, prices, interval=0.0):
+    """Ticks of symbol at the given prices, yielding to the event loop between them"""
+    for price in prices:
+        yield symbol, float(price)
+        await asyncio.sleep(interval)
+
+
+def recorded_feed(symbol, timeframe='1m', exchange_id=PAPER_PRICE_SOURCE, root='data', interval=0.0):
+    """Replay the candles of symbol stored by market_data sync"""
+    candles = MarketDataStore(root=root, exchange_id=exchange_id).load_ohlcv(symbol, timeframe)
+    if not len(candles):
+        raise ValueError(f"No {timeframe} candles stored for {symbol}, run "
+                         f"python -m market_data sync --symbol {symbol} --timeframe {timeframe}")
+    return replay_feed(symbol, candle_path(candles), interval)
+
+
+async def live_feed(source, symbol, poll_interval=1.0):
+    """Ticks of symbol from a public client: its trade stream, else ticker polling"""
+    has = getattr(source, 'has', None) or {}
+    while True:
+        try:
+            if has.get('watchTrades'):
+                prices = [trade['price'] for trade in await source.watch_trades(symbol)]
+            else:
+                prices = [(await source.fetch_ticker(symbol)).get('last')]
+                await asyncio.sleep(poll_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Network errors are retried; the book just sees no ticks meanwhile
+            await asyncio.sleep(poll_interval)
+            continue
+        for price in prices:
+            if price:
+                yield symbol, float(price)
+
+
+def create_price_source(exchange_id=PAPER_PRICE_SOURCE, pool=None):
+    """Unauthenticated async ccxt client for live prices, preferring ccxt.pro streams"""
+    return create_client(exchange_id, pool=pool)
+
+
+class PaperExchange:
+    """Async ccxt stand-in that trades a simulated one-way futures account.
+
+    Resting orders fill at their own price (maker fee) once a tick reaches
+    them; market orders and limit orders that cross the last price fill at
+    the last price (taker fee). Amounts are contracts of the symbol's
+    market, linear or inverse, as given by load_markets() or
+    set_markets(); symbols without a market are linear with a contract
+    of one base unit. Notional, fees and PnL are valued in the account
+    currency the way PnLLedger and the risk engine value them. Initial
+    margin is the larger of the resting buy and sell notional plus the
+    position notional, divided by leverage, and orders that do not fit
+    are rejected.
+
+    Prices come from feeds, async iterables of (symbol, price) started on
+    first use, and from source, a public client followed per symbol as
+    soon as the symbol is traded or watched. tick() can also be called
+    directly. Everything runs on the event loop of the caller, so it is
+    not thread-safe.
+    """
+
+    def __init__(self, balance=DEFAULT_PAPER_BALANCE, maker_fee=0.0001, taker_fee=0.0006, feeds=(),
+                 source=None, currency='USD', history_limit=HISTORY_LIMIT):
+        self.id = PAPER_EXCHANGE_ID
+        self.rateLimit = 0
+        self.has = {
+            'createOrders': True,
+            'cancelOrders': True,
+            'cancelAllOrders': True,
+            'editOrder': True,
+            'fetchPositions': True,
+            'fetchClosedOrders': True,
+            'fetchMyTrades': True,
+            'fetchTicker': True,
+            'watchTicker': True,
+            'watchOrders': True,
+            'watchMyTrades': True,
+            'watchBalance': True,
+            'watchPositions': True,
+        }
+        self.currency = currency
+        self.cash = float(balance)  # deposits plus realized PnL minus fees
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.source = source
+        self.books = {}  # symbol -> OrderBook
+        self.last_prices = {}
+        self.positions = {}  # symbol -> [signed contracts, entry price]
+        self.markets = {}
+        self.contracts = {}  # symbol -> (contract size, inverse)
+        self.leverage = {}
+        self.closed_orders = collections.OrderedDict()
+        self.trades = collections.deque(maxlen=history_limit)
+        self.history_limit = history_limit
+        self.tick_count = 0
+        self._feeds = list(feeds)
+        self._tasks = []
+        self._followed = set()
+        self._queues = {}  # (stream, symbol or None) -> asyncio.Queue, created by the first watcher
+        self._ids = itertools.count(1)
+
+    # Price feeds
+
+    def _ensure_feeds(self, symbol=None):
+        feeds, self._feeds = self._feeds, []
+        if symbol is not None and self.source is not None and symbol not in self._followed:
+            self._followed.add(symbol)
+            feeds.append(live_feed(self.source, symbol))
+        for feed in feeds:
+            self._tasks.append(asyncio.ensure_future(self._run_feed(feed)))
+
+    async def _run_feed(self, feed):
+        async for symbol, price in feed:
+            self.tick(symbol, price)
+
+    def tick(self, symbol, price):
+        """Trade at price on symbol: fill every resting order it reaches; returns the filled orders"""
+        self.tick_count += 1
+        self.last_prices[symbol] = price
+        if ('ticker', symbol) in self._queues:
+            self._publish('ticker', symbol, self._ticker(symbol))
+        book = self.books.get(symbol)
+        if book is None or not book.orders:
+            return []
+        filled = book.match(price)
+        for order in filled:
+            self._fill(order, order['price'], self.maker_fee)
+        if filled:
+            self._publish_account(symbol)
+        return filled
+
+    # Accounting
+
+    def _notional(self, symbol, amount, price):
+        contract_size, inverse = self.contracts.get(symbol, (1.0, False))
+        if inverse:
+            # Inverse contracts are worth a fixed amount of the quote currency
+            return amount * contract_size
+        return amount * contract_size * price
+
+    def _pnl(self, symbol, contracts, entry, price):
+        """PnL of signed contracts opened at entry and valued at price"""
+        contract_size, inverse = self.contracts.get(symbol, (1.0, False))
+        if inverse:
+            return contracts * contract_size * (1 / entry - 1 / price) * price
+        return contracts * contract_size * (price - entry)
+
+    def _book(self, symbol):
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(lambda amount, price: self._notional(symbol, amount, price))
+        return book
+
+    def _position_value(self, symbol):
+        contracts, entry = self.positions.get(symbol, (0.0, 0.0))
+        if not contracts:
+            return 0.0, 0.0
+        mark = self.last_prices.get(symbol, entry)
+        return self._notional(symbol, abs(contracts), mark), self._pnl(symbol, contracts, entry, mark)
+
+    def _margin(self, symbol, extra_side=None, extra_notional=0.0):
+        """Initial margin of symbol, optionally with one more resting order"""
+        book = self.books.get(symbol)
+        buys = book.notional['buy'] if book else 0.0
+        sells = book.notional['sell'] if book else 0.0
+        if extra_side == 'buy':
+            buys += extra_notional
+        elif extra_side == 'sell':
+            sells += extra_notional
+        notional, _ = self._position_value(symbol)
+        return (max(buys, sells) + notional) / self.leverage.get(symbol, 1)
+
+    def _totals(self):
+        symbols = set(self.positions) | set(self.books)
+        unrealized = sum(self._position_value(symbol)[1] for symbol in self.positions)
+        used = sum(self._margin(symbol) for symbol in symbols)
+        return self.cash + unrealized, used
+
+    def _check_margin(self, symbol, side, amount, price):
+        total, used = self._totals()
+        needed = self._margin(symbol, side, self._notional(symbol, amount, price)) - self._margin(symbol)
+        if needed > 0 and used + needed > total + 1e-9:
+            raise ValueError(f"Insufficient margin for {side} {amount} {symbol} at {price}: "
+                             f"{total - used:.2f} {self.currency} free, {needed:.2f} needed")
+
+    def _apply_fill(self, symbol, side, amount, price, fee_rate):
+        """Move the position and the cash for a fill; returns the fee charged"""
+        contracts, entry = self.positions.get(symbol, (0.0, 0.0))
+        delta = amount if side == 'buy' else -amount
+        if contracts == 0 or (contracts > 0) == (delta > 0):
+            if self.contracts.get(symbol, (1.0, False))[1]:
+                # Inverse entries average harmonically: the same USD buys fewer coins at a higher price
+                entry = (contracts + delta) / ((contracts / entry if contracts else 0.0) + delta / price)
+            else:
+                entry = (contracts * entry + delta * price) / (contracts + delta)
+        else:
+            closing = min(abs(delta), abs(contracts))
+            self.cash += self._pnl(symbol, closing if contracts > 0 else -closing, entry, price)
+            if abs(delta) > abs(contracts):
+                entry = price
+        contracts += delta
+        if abs(contracts) < 1e-12:
+            self.positions.pop(symbol, None)
+        else:
+            self.positions[symbol] = [contracts, entry]
+        fee = self._notional(symbol, amount, price) * fee_rate
+        self.cash -= fee
+        return fee
+
+    def _fill(self, order, price, fee_rate, amount=None):
+        amount = order['remaining'] if amount is None else amount
+        fee = self._apply_fill(order['symbol'], order['side'], amount, price, fee_rate)
+        cost = self._notional(order['symbol'], amount, price)
+        order['average'] = ((order['average'] or 0.0) * order['filled'] + price * amount) / (order['filled'] + amount)
+        order['cost'] += cost
+        order['filled'] += amount
+        order['remaining'] = max(order['remaining'] - amount, 0.0)
+        order['status'] = 'closed'
+        order['fee']['cost'] += fee
+        self._archive(order)
+        trade = {
+            'id': f"t{order['id']}",
+            'order': order['id'],
+            'symbol': order['symbol'],
+            'type': order['type'],
+            'side': order['side'],
+            'takerOrMaker': 'maker' if fee_rate == self.maker_fee else 'taker',
+            'amount': amount,
+            'price': price,
+            'cost': cost,
+            'timestamp': int(time.time() * 1000),
+            'fee': {'cost': fee, 'currency': self.currency},
+        }
+        self.trades.append(trade)
+        self._publish('orders', order['symbol'], dict(order))
+        self._publish('trades', order['symbol'], dict(trade))
+
+    def _archive(self, order):
+        self.closed_orders[order['id']] = order
+        if len(self.closed_orders) > self.history_limit:
+            self.closed_orders.popitem(last=False)
+
+    # Streams
+
+    def _publish(self, stream, symbol, item):
+        for key in ((stream, symbol), (stream, None)):
+            updates = self._queues.get(key)
+            if updates is not None:
+                updates.put_nowait(item)
+
+    def _publish_account(self, symbol):
+        self._publish('positions', None, self._position(symbol))
+        self._publish('balance', None, self._balance())
+
+    async def _watch(self, stream, symbol=None):
+        self._ensure_feeds(symbol)
+        updates = self._queues.get((stream, symbol))
+        if updates is None:
+            updates = self._queues[(stream, symbol)] = asyncio.Queue()
+        items = [await updates.get()]
+        while not updates.empty():
+            items.append(updates.get_nowait())
+        return items
+
+    async def watch_orders(self, symbol=None, since=None, limit=None, params={}):
+        return await self._watch('orders', symbol)
+
+    async def watch_my_trades(self, symbol=None, since=None, limit=None, params={}):
+        return await self._watch('trades', symbol)
+
+    async def watch_ticker(self, symbol, params={}):
+        return (await self._watch('ticker', symbol))[-1]
+
+    async def watch_balance(self, params={}):
+        return (await self._watch('balance'))[-1]
+
+    async def watch_positions(self, symbols=None, since=None, limit=None, params={}):
+        return await self._watch('positions')
+
+    # REST methods
+
+    def set_markets(self, markets, currencies=None):
+        """Take market metadata, e.g. from the markets cache; contract sizes and types decide the accounting"""
+        self.markets = dict(markets or {})
+        self.contracts = {symbol: (market.get('contractSize') or 1.0, bool(market.get('inverse')))
+                          for symbol, market in self.markets.items()}
+        return self.markets
+
+    async def load_markets(self, reload=False, params={}):
+        """Market metadata of the price source, so grids round to real ticks and lots"""
+        if self.source is None:
+            return self.markets
+        return self.set_markets(await self.source.load_markets(reload))
+
+    def _balance(self):
+        total, used = self._totals()
+        free = total - used
+        return {
+            self.currency: {'free': free, 'used': used, 'total': total},
+            'free': {self.currency: free},
+            'used': {self.currency: used},
+            'total': {self.currency: total},
+        }
+
+    async def fetch_balance(self, params={}):
+        self._ensure_feeds()
+        return self._balance()
+
+    def _ticker(self, symbol):
+        # Orders fill against the last price, so it is both the bid and the ask
+        last = self.last_prices.get(symbol)
+        return {'symbol': symbol, 'last': last, 'bid': last, 'ask': last, 'timestamp': int(time.time() * 1000)}
+
+    async def fetch_ticker(self, symbol, params={}):
+        self._ensure_feeds(symbol)
+        return self._ticker(symbol)
+
+    def _position(self, symbol):
+        contracts, entry = self.positions.get(symbol, (0.0, 0.0))
+        notional, unrealized = self._position_value(symbol)
+        return {
+            'symbol': symbol,
+            'side': 'long' if contracts > 0 else 'short' if contracts < 0 else None,
+            'contracts': abs(contracts),
+            'entryPrice': entry or None,
+            'markPrice': self.last_prices.get(symbol),
+            'notional': notional,
+            'unrealizedPnl': unrealized,
+            'leverage': self.leverage.get(symbol, 1),
+        }
+
+    async def fetch_positions(self, symbols=None, params={}):
+        symbols = symbols if symbols is not None else list(self.positions)
+        return [self._position(symbol) for symbol in symbols if symbol in self.positions]
+
+    async def set_leverage(self, leverage, symbol=None, params={}):
+        self.leverage[symbol] = leverage
+        return {'symbol': symbol, 'leverage': leverage}
+
+    def _new_order(self, symbol, type, side, amount, price=None, params=None):
+        params = params or {}
+        self._ensure_feeds(symbol)
+        amount = float(amount)
+        if amount <= 0:
+            raise ValueError(f"Invalid order amount {amount}")
+        last = self.last_prices.get(symbol)
+        crosses = type == 'market' or (last is not None and (
+            (side == 'buy' and price >= last) or (side == 'sell' and price <= last)))
+        if crosses and last is None:
+            raise ValueError(f"No price for {symbol} yet")
+        if crosses and params.get('postOnly'):
+            raise ValueError(f"Post-only {side} order at {price} would cross the last price {last}")
+
+        reduce_only = params.get('reduceOnly')
+        if reduce_only:
+            contracts = self.positions.get(symbol, (0.0, 0.0))[0]
+            reducible = contracts if side == 'sell' else -contracts
+            if reducible <= 0:
+                raise ValueError(f"Reduce-only {side} order on {symbol} has no position to reduce")
+            amount = min(amount, reducible)
+        else:
+            self._check_margin(symbol, side, amount, price if price is not None else last)
+
+        order = {
+            'id': str(next(self._ids)),
+            'symbol': symbol,
+            'type': type,
+            'side': side,
+            'amount': amount,
+            'price': price,
+            'filled': 0.0,
+            'remaining': amount,
+            'cost': 0.0,
+            'average': None,
+            'status': 'open',
+            'reduceOnly': bool(reduce_only),
+            'postOnly': bool(params.get('postOnly')),
+            'timestamp': int(time.time() * 1000),
+            'fee': {'cost': 0.0, 'currency': self.currency},
+            'info': params,
+        }
+        if crosses:
+            self._fill(order, last, self.taker_fee)
+            self._publish_account(symbol)
+        else:
+            self._book(symbol).add(order)
+            self._publish('orders', symbol, dict(order))
+        return dict(order)
+
+    async def create_order(self, symbol, type, side, amount, price=None, params={}):
+        return self._new_order(symbol, type, side, amount, price, params)
+
+    async def create_limit_buy_order(self, symbol, amount, price, params={}):
+        return self._new_order(symbol, 'limit', 'buy', amount, price, params)
+
+    async def create_limit_sell_order(self, symbol, amount, price, params={}):
+        return self._new_order(symbol, 'limit', 'sell', amount, price, params)
+
+    async def create_market_buy_order(self, symbol, amount, params={}):
+        return self._new_order(symbol, 'market', 'buy', amount, None, params)
+
+    async def create_market_sell_order(self, symbol, amount, params={}):
+        return self._new_order(symbol, 'market', 'sell', amount, None, params)
+
+    async def create_orders(self, orders, params={}):
+        """Place each order on its own; a refused order comes back rejected with the reason in info"""
+        results = []
+        for o in orders:
+            try:
+                results.append(self._new_order(o['symbol'], o['type'], o['side'], o['amount'], o.get('price'),
+                                               o.get('params')))
+            except ValueError as e:
+                results.append({'id': None, 'symbol': o['symbol'], 'type': o['type'], 'side': o['side'],
+                                'amount': o['amount'], 'price': o.get('price'), 'status': 'rejected',
+                                'info': str(e)})
+        return results
+
+    def _cancel(self, order_id, symbol=None):
+        books = [self.books[symbol]] if symbol in self.books else self.books.values()
+        for book in books:
+            order = book.remove(order_id)
+            if order is not None:
+                order['status'] = 'canceled'
+                self._archive(order)
+                self._publish('orders', order['symbol'], dict(order))
+                return order
+        return None
+
+    async def cancel_order(self, id, symbol=None, params={}):
+        order = self._cancel(id, symbol)
+        if order is None:
+            raise ValueError(f'Order {id} not found')
+        return dict(order)
+
+    async def cancel_orders(self, ids, symbol=None, params={}):
+        orders = [self._cancel(order_id, symbol) for order_id in ids]
+        return [dict(order) for order in orders if order is not None]
+
+    async def cancel_all_orders(self, symbol=None, params={}):
+        symbols = [symbol] if symbol else list(self.books)
+        orders = [self._cancel(order_id, book_symbol) for book_symbol in symbols if book_symbol in self.books
+                  for order_id in list(self.books[book_symbol].orders)]
+        return [dict(order) for order in orders if order is not None]
+
+    async def edit_order(self, id, symbol, type, side, amount=None, price=None, params={}):
+        book = self.books.get(symbol)
+        order = book.orders.get(id) if book else None
+        if order is None:
+            raise ValueError(f'Order {id} not found')
+        if price is not None and price != order['price']:
+            last = self.last_prices.get(symbol)
+            if last is not None and ((side == 'buy' and price >= last) or (side == 'sell' and price <= last)):
+                raise ValueError(f"Amended {side} order at {price} would cross the last price {last}")
+        order = book.amend(id, amount, price)
+        self._publish('orders', symbol, dict(order))
+        return dict(order)
+
+    async def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        books = [self.books[symbol]] if symbol in self.books else [] if symbol else self.books.values()
+        return [dict(order) for book in books for order in book.orders.values()]
+
+    async def fetch_closed_orders(self, symbol=None, since=None, limit=None, params={}):
+        orders = [dict(order) for order in self.closed_orders.values()
+                  if (symbol is None or order['symbol'] == symbol)
+                  and (since is None or order['timestamp'] >= since)]
+        return orders[:limit] if limit else orders
+
+    async def fetch_my_trades(self, symbol=None, since=None, limit=None, params={}):
+        trades = [dict(trade) for trade in self.trades
+                  if (symbol is None or trade['symbol'] == symbol)
+                  and (since is None or trade['timestamp'] >= since)]
+        return trades[:limit] if limit else trades
+
+    async def close(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self.source is not None:
+            await self.source.close()
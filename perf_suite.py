@@ -0,0 +1,221 @@
+"""End-to-end performance regression suite built on recorded exchange traffic.
+
+A session (create a grid, re-center it, then react to a run of fills) is
+recorded once against the paper exchange. Each release replays that same
+capture as fast as the bot consumes it and appends the stage throughput
+and latency numbers to a history file, compared against the last run.
+
+    python -m perf_suite record --out perf/session.jsonl.gz
+    python -m perf_suite run --capture perf/session.jsonl.gz --label v1.4
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from grid_core import build_grid_levels, parse_grid_params
+from grid_manager import GridManager
+from metrics import METRICS, InstrumentedExchange
+from paper_exchange import PaperExchange, replay_feed
+from recorder import RecordingExchange, ReplayExchange
+
+SYMBOL = 'BTC/USD:USD'
+DEFAULT_HISTORY = 'perf_history.jsonl'
+
+# Higher is better for these results; the other numbers are times
+THROUGHPUT_KEYS = ('create_levels_per_s', 'fills_per_s')
+
+
+def session_levels(num_grids, shift=0):
+    """The suite's long grid below 100, moved up by shift steps"""
+    params = parse_grid_params({'symbol': SYMBOL, 'lower_price': 90.0, 'upper_price': 99.0, 'num_grids': num_grids,
+                                'investment': 100000.0, 'leverage': 1, 'direction': 'Long'})
+    levels, grid_step, _ = build_grid_levels(params)
+    if shift:
+        params['lower_price'] += shift * grid_step
+        params['upper_price'] += shift * grid_step
+        levels, _, _ = build_grid_levels(params)
+    return levels, grid_step
+
+
+def session_prices(num_ticks):
+    """Price path of the fill stage: ten swings through the whole grid"""
+    return 95.0 + 6.0 * np.sin(np.linspace(0.0, 20 * np.pi, num_ticks))
+
+
+async def run_session(exchange, num_grids, feed=None, tick=None):
+    """Create a grid, re-center it by two steps and handle fills; returns stage timings.
+
+    While recording, every tick of the async iterable feed is passed to
+    tick, the paper exchange's; while replaying, fills come from the
+    capture's stream messages and the stage ends once they are all
+    delivered.
+    """
+    fills = []
+    manager = GridManager(exchange, log=lambda m: None,
+                          on_fill=lambda grid, level, counter: fills.append(level))
+    levels, grid_step = session_levels(num_grids)
+
+    start = time.perf_counter()
+    grid = await manager.add_grid(SYMBOL, levels, 1, grid_step=grid_step)
+    create = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await manager.update_grid(grid.grid_id, session_levels(num_grids, shift=2)[0], 1, grid_step=grid_step)
+    reconcile = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if feed is not None:
+        async for symbol, price in feed:
+            tick(symbol, price)
+    drained = getattr(exchange, 'drained', None)
+    if drained is not None:
+        await drained()
+    while grid.engine and grid.engine._tasks:
+        await asyncio.sleep(0.001)
+    handling = time.perf_counter() - start
+    await manager.stop()
+    return {'create': create, 'reconcile': reconcile, 'fills': len(fills), 'fill_seconds': handling}
+
+
+def record_session(path, num_grids=200, num_ticks=20000):
+    """Record the suite's session against a fresh paper exchange"""
+    paper = PaperExchange(balance=1e9)
+    paper.tick(SYMBOL, 100.0)
+    exchange = RecordingExchange(paper, path)
+
+    async def session():
+        try:
+            return await run_session(exchange, num_grids, replay_feed(SYMBOL, session_prices(num_ticks)),
+                                     paper.tick)
+        finally:
+            await exchange.close()
+    timings = asyncio.run(session())
+    timings['lines'] = exchange.writer.lines
+    return timings
+
+
+def replay_session(path, num_grids, speed=None):
+    """Replay a capture through the bot; returns the suite's result numbers"""
+    METRICS.reset()
+    replay = ReplayExchange(path, speed=speed)
+
+    async def session():
+        return await run_session(InstrumentedExchange(replay), num_grids)
+    timings = asyncio.run(session())
+
+    def ms(name, q):
+        histograms = METRICS.histograms.get(name, {})
+        return round(histograms[()].quantile(q) * 1000, 3) if () in histograms else None
+    return {
+        'create_seconds': round(timings['create'], 4),
+        'create_levels_per_s': round(num_grids / timings['create'], 1),
+        'reconcile_seconds': round(timings['reconcile'], 4),
+        'plan_p50_ms': ms('grid_plan_seconds', 0.5),
+        'fills': timings['fills'],
+        'fills_per_s': round(timings['fills'] / timings['fill_seconds'], 1) if timings['fill_seconds'] else None,
+        'counter_p50_ms': ms('grid_counter_seconds', 0.5),
+        'counter_p99_ms': ms('grid_counter_seconds', 0.99),
+        'divergences': len(replay.divergences),
+        'stalls': replay.stalls
+    }
+
+
+def current_label():
+    """Short git revision of the working tree, or 'local' outside a checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'local'
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def regressions(result, previous, max_regression):
+    """Messages for numbers more than max_regression percent worse than previous"""
+    failures = []
+    for key, value in result.items():
+        before = previous.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or not before:
+            continue
+        if key in THROUGHPUT_KEYS:
+            change = (before - value) / before * 100
+        elif key.endswith(('_seconds', '_ms')):
+            change = (value - before) / before * 100
+        else:
+            continue
+        if change > max_regression:
+            failures.append(f"{key} regressed {change:.1f}% ({before} -> {value})")
+    return failures
+
+
+def print_result(result, previous=None):
+    print(f"{'metric':>22} {'value':>12} {'previous':>12}")
+    for key, value in result.items():
+        before = '' if previous is None else previous.get(key, '')
+        print(f"{key:>22} {str(value):>12} {str(before):>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record and replay the end-to-end performance suite")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    record = sub.add_parser('record', help="Record the suite's session against the paper exchange")
+    record.add_argument('--out', required=True, help="Capture file to write (.jsonl.gz)")
+    record.add_argument('--levels', type=int, default=200)
+    record.add_argument('--ticks', type=int, default=20000)
+
+    run = sub.add_parser('run', help="Replay a capture and track the results")
+    run.add_argument('--capture', help="Capture to replay (default: record a fresh one)")
+    run.add_argument('--levels', type=int, default=200, help="Grid levels the capture was recorded with")
+    run.add_argument('--ticks', type=int, default=20000, help="Ticks for a fresh capture")
+    run.add_argument('--speed', default='max', help="Playback speed, e.g. 1 or max (default: max)")
+    run.add_argument('--label', default=None, help="Release label (default: git revision)")
+    run.add_argument('--history', default=DEFAULT_HISTORY, help="JSON-lines file results are appended to")
+    run.add_argument('--max-regression', type=float, default=None,
+                     help="Fail when a number is this many percent worse than the last run")
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        timings = record_session(args.out, args.levels, args.ticks)
+        print(f"Recorded {timings['lines']} messages, {timings['fills']} fills to {args.out}")
+        return 0
+
+    capture = args.capture
+    if capture is None:
+        capture = os.path.join(tempfile.mkdtemp(), 'session.jsonl.gz')
+        record_session(capture, args.levels, args.ticks)
+    speed = None if args.speed == 'max' else float(args.speed)
+    result = replay_session(capture, args.levels, speed)
+
+    history = load_history(args.history)
+    config = {'capture': os.path.basename(capture), 'levels': args.levels, 'speed': args.speed}
+    previous = next((entry['result'] for entry in reversed(history) if entry['config'] == config), None)
+    print_result(result, previous)
+    with open(args.history, 'a') as f:
+        f.write(json.dumps({'label': args.label or current_label(), 'at': time.time(),
+                            'config': config, 'result': result}) + '\n')
+
+    failures = regressions(result, previous, args.max_regression) if previous and args.max_regression else []
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if result['divergences'] or result['stalls']:
+        print(f"WARNING: replay diverged from the capture ({result['divergences']} calls, "
+              f"{result['stalls']} stalled messages), the numbers are not comparable", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,235 @@
+import asyncio
+import heapq
+import time
+
+from metrics import METRICS
+
+
+class AsyncTokenBucket:
+    """Token bucket shared by every coroutine that talks to one exchange account"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)  # tokens per second
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waits = 0
+        self.wait_time = 0.0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def for_exchange(cls, exchange, burst=10):
+        """Build a bucket matching ccxt's rateLimit (milliseconds between requests)"""
+        rate_limit = getattr(exchange, 'rateLimit', 0) or 0
+        if rate_limit <= 0:
+            return None
+        return cls(1000.0 / rate_limit, burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost=1.0, lane=None):
+        """Wait until cost tokens are available and take them; lanes are not prioritised here"""
+        # The lock keeps waiters first-come first-served
+        async with self._lock:
+            self._refill()
+            if self.tokens < cost:
+                delay = (cost - self.tokens) / self.rate
+                self.waits += 1
+                self.wait_time += delay
+                await asyncio.sleep(delay)
+                self._refill()
+            self.tokens -= cost
+
+    def burst(self, lane=None):
+        """Most tokens one request can take"""
+        return self.capacity
+
+    async def read(self, key, fetch, cost=1.0):
+        """Rate-limited read; identical reads are not coalesced here"""
+        await self.acquire(cost)
+        return await fetch()
+
+
+def batch_fit(limiter, lane, batch_size):
+    """Largest batch the limiter can grant at once: batches cost one token per order"""
+    if limiter is None or not hasattr(limiter, 'burst'):
+        return batch_size
+    return max(1, min(batch_size, int(limiter.burst(lane))))
+
+
+async def limited_read(limiter, key, fetch, cost=1.0):
+    """Run fetch() through the limiter's read path, or directly without a limiter"""
+    if limiter is None:
+        return await fetch()
+    return await limiter.read(key, fetch, cost)
+
+
+# Request lanes in priority order: cancels and close-outs, then order placement, then reads
+LANES = ('cancel', 'order', 'read')
+
+# Published per-account REST limits as {group: (requests per second, burst)} and
+# the group each lane draws from; lanes sharing a group compete by priority
+VENUE_LIMITS = {
+    'phemex': {
+        'groups': {'contract': (500 / 60.0, 50)},
+        'lanes': {'cancel': 'contract', 'order': 'contract', 'read': 'contract'}
+    },
+    'binanceusdm': {
+        # 300 orders per 10 s; reads are weighted, 2400 per minute with most calls weighing 1-5
+        'groups': {'orders': (300 / 10.0, 30), 'reads': (2400 / 60.0 / 5, 10)},
+        'lanes': {'cancel': 'orders', 'order': 'orders', 'read': 'reads'}
+    },
+    'bybit': {
+        'groups': {'trade': (10.0, 10), 'reads': (10.0, 10)},
+        'lanes': {'cancel': 'trade', 'order': 'trade', 'read': 'reads'}
+    },
+    'okx': {
+        # Placing and cancelling are limited separately, 60 per 2 s each
+        'groups': {'cancel': (30.0, 60), 'order': (30.0, 60), 'read': (10.0, 20)},
+        'lanes': {'cancel': 'cancel', 'order': 'order', 'read': 'read'}
+    }
+}
+
+
+class _Lane:
+    def __init__(self):
+        self.depth = 0
+        self.granted = 0
+        self.queued = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+
+class _Group:
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waiters = []  # heap of (priority, seq, cost, enqueued, lane, future)
+        self.timer = None
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+
+class RequestScheduler:
+    """Shared REST request scheduler with priority lanes over per-group token buckets.
+
+    acquire() is a drop-in for AsyncTokenBucket.acquire() that also takes a
+    lane; when a group runs out of tokens the next one goes to the most
+    urgent waiting lane, first come first served within a lane. read()
+    additionally coalesces identical reads that are already in flight.
+    """
+
+    def __init__(self, groups, lanes=None):
+        self.groups = {name: _Group(rate, capacity) for name, (rate, capacity) in groups.items()}
+        default = next(iter(self.groups))
+        self.lane_groups = {lane: (lanes or {}).get(lane, default) for lane in LANES}
+        self.lanes = {lane: _Lane() for lane in LANES}
+        self.coalesced = 0
+        self._inflight = {}
+        self._seq = 0
+
+    @classmethod
+    def for_exchange(cls, exchange, burst=10):
+        """Use the venue's published limits, falling back to ccxt's rateLimit for all lanes"""
+        limits = VENUE_LIMITS.get(getattr(exchange, 'id', None))
+        if limits:
+            return cls(limits['groups'], limits['lanes'])
+        rate_limit = getattr(exchange, 'rateLimit', 0) or 0
+        if rate_limit <= 0:
+            return None
+        return cls({'default': (1000.0 / rate_limit, burst)})
+
+    def burst(self, lane='order'):
+        """Most tokens one request in lane can take"""
+        return self.groups[self.lane_groups[lane]].capacity
+
+    async def acquire(self, cost=1.0, lane='order'):
+        """Wait for cost tokens in the lane's group, ahead of any less urgent lane"""
+        group = self.groups[self.lane_groups[lane]]
+        if cost > group.capacity:
+            # The bucket never holds more than its capacity, so this request would wait forever
+            raise ValueError(f"Request cost {cost} exceeds the {self.lane_groups[lane]} rate limit burst "
+                             f"of {group.capacity:g}")
+        now = group.refill()
+        stats = self.lanes[lane]
+        if not group.waiters and group.tokens >= cost:
+            group.tokens -= cost
+            stats.granted += 1
+            METRICS.observe('rate_limit_wait_seconds', 0.0, lane=lane)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(group.waiters, (LANES.index(lane), self._seq, cost, now, lane, future))
+        stats.depth += 1
+        stats.queued += 1
+        self._dispatch(group)
+        await future
+
+    def _dispatch(self, group):
+        """Grant tokens to waiters in priority order and arm a timer for the rest"""
+        if group.timer is not None:
+            group.timer.cancel()
+            group.timer = None
+        now = group.refill()
+        while group.waiters:
+            _, _, cost, enqueued, lane, future = group.waiters[0]
+            if future.cancelled():
+                heapq.heappop(group.waiters)
+                self.lanes[lane].depth -= 1
+                continue
+            if group.tokens < cost:
+                break
+            heapq.heappop(group.waiters)
+            group.tokens -= cost
+            stats = self.lanes[lane]
+            stats.depth -= 1
+            stats.granted += 1
+            stats.wait_time += now - enqueued
+            stats.max_wait = max(stats.max_wait, now - enqueued)
+            METRICS.observe('rate_limit_wait_seconds', now - enqueued, lane=lane)
+            future.set_result(None)
+
+        if group.waiters:
+            delay = (group.waiters[0][2] - group.tokens) / group.rate
+            group.timer = asyncio.get_running_loop().call_later(delay, self._dispatch, group)
+
+    async def read(self, key, fetch, cost=1.0):
+        """Run fetch() in the read lane, sharing one request between identical concurrent reads"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        async def run():
+            await self.acquire(cost, lane='read')
+            return await fetch()
+
+        task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def metrics(self):
+        """Queue depth, grants and wait times per lane, plus coalesced reads"""
+        return {
+            'lanes': {name: {
+                'depth': lane.depth,
+                'granted': lane.granted,
+                'queued': lane.queued,
+                'wait_time': lane.wait_time,
+                'max_wait': lane.max_wait,
+                'avg_wait': lane.wait_time / lane.granted if lane.granted else 0.0
+            } for name, lane in self.lanes.items()},
+            'coalesced': self.coalesced,
+            'tokens': {name: group.tokens for name, group in self.groups.items()}
+        }
@@ -0,0 +1,208 @@
+import asyncio
+
+from metrics import METRICS
+from order_placer import DEFAULT_BATCH_SIZE, AsyncGridOrderPlacer, exchange_supports_batch
+from rate_limiter import batch_fit
+
+# Relative difference under which two prices or amounts count as the same
+DEFAULT_TOLERANCE = 1e-9
+
+
+def _same(a, b, tolerance):
+    return abs(float(a) - float(b)) <= tolerance * max(abs(float(a)), abs(float(b)), 1e-12)
+
+
+def plan_reconciliation(levels, open_orders, amend=True, held_prices=(), tolerance=DEFAULT_TOLERANCE):
+    """Work out the fewest order changes that turn open_orders into levels.
+
+    Orders are matched to levels of the same side by price. A matched order
+    is kept as is, or amended when only its amount differs. Leftover orders
+    are paired with leftover levels in price order and amended to them when
+    amend is set; whatever remains is cancelled or created. Levels at
+    held_prices already hold a position waiting on its counter order and are
+    left alone. Returns a dict of 'keep' and 'amend' (level, order) pairs
+    plus 'cancel' orders and 'create' and 'held' levels.
+    """
+    plan = {'keep': [], 'amend': [], 'cancel': [], 'create': [], 'held': []}
+
+    pending = []
+    for level in levels:
+        if any(_same(level['price'], price, tolerance) for price in held_prices):
+            plan['held'].append(level)
+        else:
+            pending.append(level)
+
+    for side in ('buy', 'sell'):
+        wanted = sorted((level for level in pending if level['type'] == side),
+                        key=lambda level: level['price'])
+        resting = sorted((order for order in open_orders if order['side'] == side),
+                         key=lambda order: float(order['price']))
+
+        # Both lists are sorted, so equal prices are found in a single merge pass
+        spare_levels, spare_orders = [], []
+        i = j = 0
+        while i < len(wanted) and j < len(resting):
+            level, order = wanted[i], resting[j]
+            if _same(level['price'], order['price'], tolerance):
+                remaining = order.get('remaining')
+                amount = order['amount'] if remaining is None else remaining
+                if _same(level['size'], amount, tolerance):
+                    plan['keep'].append((level, order))
+                elif amend:
+                    plan['amend'].append((level, order))
+                else:
+                    plan['cancel'].append(order)
+                    plan['create'].append(level)
+                i += 1
+                j += 1
+            elif level['price'] < float(order['price']):
+                spare_levels.append(level)
+                i += 1
+            else:
+                spare_orders.append(order)
+                j += 1
+        spare_levels.extend(wanted[i:])
+        spare_orders.extend(resting[j:])
+
+        # Moving an order costs one request, cancel plus create costs two
+        paired = min(len(spare_levels), len(spare_orders)) if amend else 0
+        plan['amend'].extend(zip(spare_levels[:paired], spare_orders[:paired]))
+        plan['create'].extend(spare_levels[paired:])
+        plan['cancel'].extend(spare_orders[paired:])
+    return plan
+
+
+def batches(count, batch_size):
+    return -(-count // batch_size)
+
+
+class GridReconciler:
+    """Bring a symbol's resting orders in line with a desired ladder with minimal requests.
+
+    Cancels go through cancel_orders in batches when the exchange has it,
+    changed levels are moved with edit_order, and only genuinely new levels
+    are placed, through the batch order placer. Where batching makes cancel
+    plus create cheaper than amending one order at a time, that is used
+    instead.
+    """
+
+    def __init__(self, exchange, limiter=None, log=None, max_in_flight=8, batch_size=None, post_only=False):
+        self.exchange = exchange
+        self.limiter = limiter
+        self.log = log or print
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self.post_only = post_only
+
+    def _has(self, feature):
+        has = getattr(self.exchange, 'has', None) or {}
+        return bool(has.get(feature))
+
+    def supports_amend(self):
+        return self._has('editOrder') and hasattr(self.exchange, 'edit_order')
+
+    def supports_batch_cancel(self):
+        return self._has('cancelOrders') and hasattr(self.exchange, 'cancel_orders')
+
+    def request_cost(self, plan):
+        """Requests a plan takes when nothing fails"""
+        cancels, creates = len(plan['cancel']), len(plan['create'])
+        if self.supports_batch_cancel():
+            cancels = batches(cancels, self.batch_size)
+        if exchange_supports_batch(self.exchange):
+            creates = batches(creates, self.batch_size)
+        return len(plan['amend']) + cancels + creates
+
+    def plan(self, levels, open_orders, held_prices=()):
+        """Cheapest plan for moving open_orders onto levels"""
+        with METRICS.timer('grid_plan_seconds'):
+            plan = plan_reconciliation(levels, open_orders, amend=False, held_prices=held_prices)
+            if self.supports_amend():
+                amended = plan_reconciliation(levels, open_orders, amend=True, held_prices=held_prices)
+                if self.request_cost(amended) < self.request_cost(plan):
+                    plan = amended
+        return plan
+
+    async def _slot(self, lane, cost=1):
+        if self.limiter is not None:
+            await self.limiter.acquire(cost, lane=lane)
+
+    async def reconcile(self, symbol, levels, open_orders, held_prices=()):
+        """Apply the cheapest plan for levels against open_orders and record outcomes on the levels"""
+        plan = self.plan(levels, open_orders, held_prices)
+
+        # Cancels go first so the margin they hold is free for moved and new orders
+        await self.cancel(symbol, plan['cancel'])
+
+        for level, order in plan['keep']:
+            level.update({'order': order, 'status': 'open', 'error': None})
+        for level in plan['held']:
+            level.update({'order': None, 'status': 'filled', 'error': None})
+
+        semaphore = asyncio.Semaphore(max(1, self.max_in_flight))
+        replaced = [level for level in await asyncio.gather(
+            *(self._amend(symbol, level, order, semaphore) for level, order in plan['amend']))
+            if level is not None]
+        create = plan['create'] + replaced
+
+        if create:
+            placer = AsyncGridOrderPlacer(self.exchange, max_in_flight=self.max_in_flight,
+                                          batch_size=self.batch_size, log=self.log, limiter=self.limiter,
+                                          post_only=self.post_only)
+            await placer.place(symbol, create)
+
+        return {
+            'requests': self.request_cost(plan),
+            'kept': len(plan['keep']),
+            'amended': len(plan['amend']) - len(replaced),
+            'cancelled': len(plan['cancel']),
+            'created': len(create),
+            'held': len(plan['held'])
+        }
+
+    async def _amend(self, symbol, level, order, semaphore):
+        """Move one order onto a level; returns the level if it has to be placed fresh instead"""
+        async with semaphore:
+            try:
+                await self._slot('order')
+                edited = await self.exchange.edit_order(order['id'], symbol, 'limit', level['type'],
+                                                        level['size'], level['price'],
+                                                        {'postOnly': True} if self.post_only else {})
+                level.update({'order': edited, 'status': 'open', 'error': None})
+                return None
+            except Exception as e:
+                self.log(f"Could not amend order {order['id']}, replacing it: {str(e)}")
+        await self.cancel(symbol, [order])
+        return level
+
+    async def cancel(self, symbol, orders):
+        """Cancel orders in batches where supported, otherwise concurrently one by one"""
+        ids = [order['id'] for order in orders]
+        if not ids:
+            return
+        if self.supports_batch_cancel():
+            # Every cancel of a batch counts against the venue's limit
+            batch_size = batch_fit(self.limiter, 'cancel', self.batch_size)
+            for start in range(0, len(ids), batch_size):
+                chunk = ids[start:start + batch_size]
+                try:
+                    await self._slot('cancel', len(chunk))
+                    await self.exchange.cancel_orders(chunk, symbol)
+                except Exception as e:
+                    self.log(f"Batch cancel failed, falling back to single cancels: {str(e)}")
+                    await self._cancel_each(symbol, chunk)
+        else:
+            await self._cancel_each(symbol, ids)
+
+    async def _cancel_each(self, symbol, ids):
+        semaphore = asyncio.Semaphore(max(1, self.max_in_flight))
+
+        async def cancel(order_id):
+            async with semaphore:
+                try:
+                    await self._slot('cancel')
+                    await self.exchange.cancel_order(order_id, symbol)
+                except Exception as e:
+                    self.log(f"Error cancelling order {order_id}: {str(e)}")
+
+        await asyncio.gather(*(cancel(order_id) for order_id in ids))
@@ -0,0 +1,321 @@
+"""Record everything the bot exchanges with an exchange, and play it back.
+
+RecordingExchange wraps an async ccxt client and appends every REST call,
+its response or error, and every stream message to a gzip compressed
+JSON-lines capture. ReplayExchange serves a capture back through the same
+interface at recorded speed (or a multiple of it) or as fast as the bot
+consumes it, so an incident can be reproduced and a session benchmarked
+offline.
+"""
+import asyncio
+import bisect
+import collections
+import gzip
+import inspect
+import json
+import queue
+import threading
+import time
+
+CAPTURE_VERSION = 1
+
+# Coroutines that change orders or account settings; replayed stream messages wait for these
+WRITE_PREFIXES = ('create_', 'cancel_', 'edit_', 'set_')
+READ_PREFIXES = ('fetch_', 'load_markets')
+STREAM_PREFIX = 'watch_'
+
+
+def _is_recorded(name):
+    return name.startswith(WRITE_PREFIXES + READ_PREFIXES) or name.startswith(STREAM_PREFIX)
+
+
+def _symbol_of(args, kwargs):
+    symbol = args[0] if args else kwargs.get('symbol')
+    return symbol if isinstance(symbol, str) else None
+
+
+def _call_key(method, args, kwargs):
+    """Exact identity of a call, so replies go back to the call that got them"""
+    return json.dumps([method, args, kwargs], sort_keys=True, default=str)
+
+
+class CaptureWriter:
+    """Append JSON lines to a gzip file from a background thread.
+
+    Callers serialize on their own thread, so later mutation of a
+    response cannot change what was recorded; compression and disk
+    writes happen off the event loop.
+    """
+
+    def __init__(self, path, compresslevel=6):
+        self.path = path
+        self.lines = 0
+        self._file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=compresslevel)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='capture-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, entry):
+        self._queue.put(json.dumps(entry, default=str))
+        self.lines += 1
+
+    def _run(self):
+        while True:
+            line = self._queue.get()
+            if line is None:
+                break
+            self._file.write(line)
+            self._file.write('\n')
+        self._file.close()
+
+    def close(self):
+        """Flush what is queued and close the file"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+class RecordingExchange:
+    """Wrap an async ccxt exchange and record its traffic to a capture file.
+
+    Every fetch_/create_/cancel_/edit_/set_ call and load_markets is
+    written with its arguments, start offset, duration and response or
+    error; every watch_ call is written the same way, its response being
+    the stream messages it returned. Everything else passes through.
+    """
+
+    def __init__(self, exchange, path):
+        self.exchange = exchange
+        self.writer = CaptureWriter(path)
+        self.started = time.monotonic()
+        self.writer.write({
+            'type': 'header',
+            'version': CAPTURE_VERSION,
+            'exchange': getattr(exchange, 'id', None),
+            'has': dict(getattr(exchange, 'has', None) or {}),
+            'rateLimit': getattr(exchange, 'rateLimit', 0),
+            'precisionMode': getattr(exchange, 'precisionMode', None),
+            'started_at': time.time()
+        })
+
+    def __getattr__(self, name):
+        attr = getattr(self.exchange, name)
+        if not (_is_recorded(name) and inspect.iscoroutinefunction(attr)):
+            return attr
+
+        async def call(*args, **kwargs):
+            start = time.monotonic()
+            entry = {'type': 'call', 'method': name, 'args': list(args), 'kwargs': kwargs,
+                     't': start - self.started}
+            try:
+                result = await attr(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                entry.update({'dt': time.monotonic() - start,
+                              'error': {'type': type(e).__name__, 'message': str(e)}})
+                self.writer.write(entry)
+                raise
+            entry.update({'dt': time.monotonic() - start, 'result': result})
+            self.writer.write(entry)
+            return result
+        return call
+
+    async def close(self):
+        try:
+            await self.exchange.close()
+        finally:
+            self.writer.close()
+
+
+def load_capture(path):
+    """(header, calls) of a capture file, calls in the order they completed"""
+    header, calls = None, []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A crash can leave the last line cut off
+                break
+            if entry['type'] == 'header':
+                header = entry
+            else:
+                calls.append(entry)
+    if header is None:
+        raise ValueError(f"{path} is not a capture file")
+    return header, calls
+
+
+class ReplayDivergence(ValueError):
+    """The bot made a call the capture has no answer for"""
+
+
+class ReplayedError(Exception):
+    """An exchange error as it was recorded, re-raised during replay"""
+
+    def __init__(self, error):
+        super().__init__(f"{error['type']}: {error['message']}")
+        self.type = error['type']
+
+
+class ReplayExchange:
+    """Serve a capture through the async ccxt interface it was recorded from.
+
+    Calls are answered from the capture: by exact arguments first, then by
+    method and symbol in recorded order, and reads fall back to their last
+    recorded answer. Writes the capture cannot answer raise
+    ReplayDivergence. Stream messages are delivered in recorded order,
+    each only after the writes that completed before it were replayed, so
+    fills never overtake the orders they fill.
+
+    speed 1.0 keeps recorded timing, 2.0 runs twice as fast, and None
+    delivers everything as soon as the bot asks. A stream message whose
+    writes never come is released after stall_timeout seconds.
+    """
+
+    def __init__(self, path, speed=1.0, stall_timeout=2.0):
+        header, calls = load_capture(path)
+        self.speed = speed
+        self.stall_timeout = stall_timeout
+        self.id = header['exchange'] if speed is not None else 'replay'
+        self.has = header['has']
+        self.rateLimit = header['rateLimit'] if speed is not None else 0
+        if header.get('precisionMode') is not None:
+            self.precisionMode = header['precisionMode']
+        self.markets = None
+        self.divergences = []  # (method, args) of writes the capture could not answer exactly
+        self.read_fallbacks = 0  # reads answered by method and symbol only; polling makes these normal
+        self.stalls = 0
+
+        self._exact = collections.defaultdict(collections.deque)  # call key -> records
+        self._by_symbol = collections.defaultdict(collections.deque)  # (method, symbol) -> records
+        self._last_read = {}  # (method, symbol) -> last recorded read
+        self._streams = collections.defaultdict(collections.deque)  # (method, symbol) -> records
+        writes = []
+        for record in calls:
+            record['end'] = record['t'] + record.get('dt', 0.0)
+            record['used'] = False
+            method = record['method']
+            symbol = _symbol_of(record['args'], record['kwargs'])
+            if method.startswith(STREAM_PREFIX):
+                self._streams[(method, symbol)].append(record)
+                continue
+            self._exact[_call_key(method, record['args'], record['kwargs'])].append(record)
+            self._by_symbol[(method, symbol)].append(record)
+            if method.startswith(WRITE_PREFIXES):
+                writes.append(record)
+            else:
+                self._last_read[(method, symbol)] = record
+        self._writes = sorted(writes, key=lambda record: record['end'])
+        self._write_ends = [record['end'] for record in self._writes]
+        self._watermark = 0  # writes before this index have all been replayed
+        self._pending_streams = sum(len(records) for records in self._streams.values())
+        self._progress = asyncio.Event()
+        self._drained = asyncio.Event()
+        if not self._pending_streams:
+            self._drained.set()
+        self._clock = None
+
+    def _now(self):
+        if self._clock is None:
+            self._clock = time.monotonic()
+        return time.monotonic() - self._clock
+
+    async def _wait_until(self, offset):
+        """Sleep until a recorded offset comes up at the replay speed"""
+        if self.speed is None:
+            return
+        delay = offset / self.speed - self._now()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _take(self, method, args, kwargs):
+        records = self._exact.get(_call_key(method, args, kwargs))
+        while records:
+            record = records.popleft()
+            if not record['used']:
+                return record
+        if method.startswith(WRITE_PREFIXES):
+            self.divergences.append((method, args))
+        else:
+            self.read_fallbacks += 1
+        records = self._by_symbol.get((method, _symbol_of(args, kwargs)))
+        while records:
+            record = records.popleft()
+            if not record['used']:
+                return record
+        if method.startswith(WRITE_PREFIXES):
+            raise ReplayDivergence(f"Capture has no answer for {method}{tuple(args)}")
+        record = self._last_read.get((method, _symbol_of(args, kwargs)))
+        if record is None:
+            raise ReplayDivergence(f"Capture has no answer for {method}{tuple(args)}")
+        return dict(record, used=False)
+
+    def _consume(self, record):
+        record['used'] = True
+        if record['method'].startswith(WRITE_PREFIXES):
+            writes = self._writes
+            while self._watermark < len(writes) and writes[self._watermark]['used']:
+                self._watermark += 1
+            self._progress.set()
+
+    async def _request(self, method, args, kwargs):
+        self._now()
+        record = self._take(method, args, kwargs)
+        if self.speed is not None:
+            await asyncio.sleep(record.get('dt', 0.0) / self.speed)
+        self._consume(record)
+        if 'error' in record:
+            raise ReplayedError(record['error'])
+        return record['result']
+
+    def _writes_done(self, end):
+        """True once every write that completed before end was replayed"""
+        return self._watermark >= bisect.bisect_right(self._write_ends, end)
+
+    async def _stream(self, method, args, kwargs):
+        self._now()
+        records = self._streams.get((method, _symbol_of(args, kwargs)))
+        if not records:
+            # Nothing more was recorded on this stream; block like an idle one
+            await asyncio.Future()
+        record = records.popleft()
+        await self._wait_until(record['end'])
+        deadline = time.monotonic() + self.stall_timeout
+        while not self._writes_done(record['end']):
+            self._progress.clear()
+            try:
+                await asyncio.wait_for(self._progress.wait(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                self.stalls += 1
+                break
+        self._pending_streams -= 1
+        if not self._pending_streams:
+            self._drained.set()
+        if 'error' in record:
+            raise ReplayedError(record['error'])
+        return record['result']
+
+    async def drained(self):
+        """Wait until every recorded stream message was delivered"""
+        await self._drained.wait()
+
+    def __getattr__(self, name):
+        if name.startswith(STREAM_PREFIX):
+            async def watch(*args, **kwargs):
+                return await self._stream(name, list(args), kwargs)
+            return watch
+        if _is_recorded(name):
+            async def call(*args, **kwargs):
+                return await self._request(name, list(args), kwargs)
+            return call
+        raise AttributeError(name)
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = markets
+
+    async def close(self):
+        pass
@@ -0,0 +1,408 @@
+"""Pre-trade risk checks against exposure kept incrementally from order and fill events.
+
+The RiskEngine holds, per symbol, the position and the resting orders as
+running sums, fed by the GridManager whenever it places, fills, reconciles
+or forgets orders, and the account equity from AccountState updates.
+Checking an order only adds it to those sums, so a check costs a few
+microseconds and never waits on fetch_balance or fetch_positions.
+"""
+import numpy as np
+
+RISK_ACTIONS = ('downsize', 'block')
+
+# Bisection steps when searching the largest size that stays within limits
+DOWNSIZE_STEPS = 24
+
+
+def parse_risk_limits(raw):
+    """Risk engine settings from a config section; None turns the limits off"""
+    if not raw:
+        return None
+    limits = {
+        'max_symbol_notional': raw.get('max_symbol_notional'),
+        'max_total_notional': raw.get('max_total_notional'),
+        'max_leverage': raw.get('max_leverage'),
+        'margin_buffer': float(raw.get('margin_buffer', 0.1)),
+        'liquidation_buffer': float(raw.get('liquidation_buffer', 0.05)),
+        'maintenance_margin': float(raw.get('maintenance_margin', 0.005)),
+        'action': raw.get('action', 'downsize')
+    }
+    for key in ('max_symbol_notional', 'max_total_notional', 'max_leverage'):
+        if limits[key] is not None:
+            limits[key] = float(limits[key])
+            if limits[key] <= 0:
+                raise ValueError(f"Risk limit {key} must be positive")
+    if not 0 <= limits['margin_buffer'] < 1:
+        raise ValueError("Risk margin_buffer must be between 0 and 1")
+    if limits['liquidation_buffer'] < 0 or limits['maintenance_margin'] < 0:
+        raise ValueError("Risk buffers cannot be negative")
+    if limits['action'] not in RISK_ACTIONS:
+        raise ValueError(f"Risk action must be one of {', '.join(RISK_ACTIONS)}")
+    return limits
+
+
+class SymbolExposure:
+    """Position and resting orders of one symbol as running sums.
+
+    Amounts are in contracts. Order cost sums contracts * price, so the
+    average entry of everything on one side is cost / contracts. The lowest
+    buy and highest sell are cached and only rescanned when the order that
+    held them goes away.
+    """
+
+    def __init__(self, symbol, contract_size=1.0, inverse=False):
+        self.symbol = symbol
+        self.contract_size = contract_size
+        self.inverse = inverse
+        self.leverage = 1
+        self.position = 0.0  # signed contracts, long positive
+        self.entry = 0.0  # average entry price of the position
+        self.buys = self.buy_cost = 0.0
+        self.sells = self.sell_cost = 0.0
+        self.orders = {}  # order id or reservation key -> (side, contracts, price)
+        self._lowest_buy = self._highest_sell = None
+        self._stale = False
+        self.value = 0.0  # worst case notional, as last counted in the engine totals
+        self.margin = 0.0
+
+    def add(self, key, side, contracts, price):
+        self.orders[key] = (side, contracts, price)
+        self._shift(side, contracts, contracts * price)
+        if side == 'buy' and (self._lowest_buy is None or price < self._lowest_buy):
+            self._lowest_buy = price
+        elif side == 'sell' and (self._highest_sell is None or price > self._highest_sell):
+            self._highest_sell = price
+
+    def remove(self, key):
+        """Drop a resting order; returns its (side, contracts, price) or None if it was not tracked"""
+        order = self.orders.pop(key, None)
+        if order is None:
+            return None
+        side, contracts, price = order
+        self._shift(side, -contracts, -contracts * price)
+        if price in (self._lowest_buy, self._highest_sell):
+            self._stale = True
+        return order
+
+    def _shift(self, side, contracts, cost):
+        if side == 'buy':
+            self.buys += contracts
+            self.buy_cost += cost
+        else:
+            self.sells += contracts
+            self.sell_cost += cost
+        # Drop float residue once a side has nothing resting
+        if self.buys < 1e-9:
+            self.buys = self.buy_cost = 0.0
+        if self.sells < 1e-9:
+            self.sells = self.sell_cost = 0.0
+
+    def extremes(self):
+        """(lowest resting buy, highest resting sell)"""
+        if self._stale:
+            buys = [price for side, _, price in self.orders.values() if side == 'buy']
+            sells = [price for side, _, price in self.orders.values() if side == 'sell']
+            self._lowest_buy = min(buys) if buys else None
+            self._highest_sell = max(sells) if sells else None
+            self._stale = False
+        return self._lowest_buy, self._highest_sell
+
+    def trade(self, side, contracts, price):
+        """Move the position by a fill"""
+        delta = contracts if side == 'buy' else -contracts
+        position = self.position
+        if position == 0 or (position > 0) == (delta > 0):
+            self.entry = (abs(position) * self.entry + contracts * price) / (abs(position) + contracts)
+        elif abs(delta) > abs(position):
+            self.entry = price
+        self.position = position + delta
+        if abs(self.position) < 1e-12:
+            self.position = self.entry = 0.0
+
+    def worst_case(self, buys, buy_cost, sells, sell_cost):
+        """(contracts, cost) of the long held if every buy fills, and of the short if every sell does"""
+        position = self.position
+        long_ = position + buys
+        if long_ > 0:
+            if position > 0:
+                long_cost = position * self.entry + buy_cost
+            else:
+                # Buys first close the short; what is left is held at their average price
+                long_cost = buy_cost * long_ / buys
+        else:
+            long_, long_cost = 0.0, 0.0
+        short = sells - position
+        if short > 0:
+            if position < 0:
+                short_cost = -position * self.entry + sell_cost
+            else:
+                short_cost = sell_cost * short / sells
+        else:
+            short, short_cost = 0.0, 0.0
+        return (long_, long_cost), (short, short_cost)
+
+    def notional(self, contracts, cost):
+        if self.inverse:
+            return contracts * self.contract_size
+        return cost * self.contract_size
+
+    def liquidation(self, side, contracts, cost, equity, maintenance):
+        """Estimated cross margin liquidation price of a position backed by equity; None if there is none"""
+        if contracts <= 0:
+            return None
+        size = contracts * self.contract_size
+        entry = cost / contracts
+        if self.inverse:
+            # Coin margined: equity and PnL are in the base coin, valued here at the entry price
+            coins = equity / entry
+            if side == 'long':
+                return size * (1 + maintenance) / (coins + size / entry)
+            denominator = size / entry - coins
+            return size * (1 - maintenance) / denominator if denominator > 0 else None
+        if side == 'long':
+            price = (size * entry - equity) / (size * (1 - maintenance))
+            return price if price > 0 else None
+        return (equity + size * entry) / (size * (1 + maintenance))
+
+
+class RiskEngine:
+    """Validate orders against margin, exposure and liquidation limits before they are sent.
+
+    An order is checked against the worst case of its symbol: every resting
+    order on its side filled on top of the position. That worst case must
+    stay under max_symbol_notional, all symbols together under
+    max_total_notional and max_leverage times equity, and their initial
+    margin must leave margin_buffer of the equity free. The estimated
+    liquidation price of the worst case position must also stay
+    liquidation_buffer beyond the furthest order on its side, so the whole
+    ladder can fill without liquidating the account.
+
+    Levels nearest the market are checked first. A level that breaches a
+    limit is downsized to the largest amount that fits, or blocked when
+    action is 'block' or not even the minimum amount fits.
+    """
+
+    def __init__(self, max_symbol_notional=None, max_total_notional=None, max_leverage=None, margin_buffer=0.1,
+                 liquidation_buffer=0.05, maintenance_margin=0.005, action='downsize', precision=None, log=None):
+        self.max_symbol_notional = max_symbol_notional
+        self.max_total_notional = max_total_notional
+        self.max_leverage = max_leverage
+        self.margin_buffer = margin_buffer
+        self.liquidation_buffer = liquidation_buffer
+        self.maintenance_margin = maintenance_margin
+        self.action = action
+        self.precision = precision  # symbol -> MarketPrecision or None
+        self.log = log or print
+        self.equity = None
+        self.symbols = {}  # symbol -> SymbolExposure
+        self.total_value = 0.0
+        self.total_margin = 0.0
+        self.blocked = 0
+        self.downsized = 0
+
+    def exposure(self, symbol):
+        exposure = self.symbols.get(symbol)
+        if exposure is None:
+            market = self.precision(symbol) if self.precision else None
+            if market is None:
+                exposure = SymbolExposure(symbol)
+            else:
+                exposure = SymbolExposure(symbol, market.contract_size, market.inverse)
+            self.symbols[symbol] = exposure
+        return exposure
+
+    def _recount(self, exposure):
+        """Bring the cross-symbol totals in line with exposure's current worst case"""
+        (long_, long_cost), (short, short_cost) = exposure.worst_case(exposure.buys, exposure.buy_cost,
+                                                                      exposure.sells, exposure.sell_cost)
+        value = max(exposure.notional(long_, long_cost), exposure.notional(short, short_cost))
+        margin = value / exposure.leverage
+        self.total_value += value - exposure.value
+        self.total_margin += margin - exposure.margin
+        exposure.value, exposure.margin = value, margin
+
+    # Events
+
+    def apply_balance(self, balance):
+        """Take the equity limits are measured against; ccxt's total holds the unrealized PnL on most venues"""
+        self.equity = balance
+
+    def apply_account(self, snapshot):
+        """Replace equity and positions with a snapshot reconciled over REST.
+
+        Between reconciliations positions follow the grid fills, as streamed
+        position updates would race those and count fills twice. A fill
+        racing a reconciliation may still be counted twice until the next.
+        """
+        if snapshot is None:
+            return
+        self.equity = snapshot['balance']
+        held = {}
+        for position in snapshot['positions']:
+            exposure = self.exposure(position['symbol'])
+            sign = 1.0 if position.get('side') == 'long' else -1.0
+            # Without an entry price the position is valued at its notional
+            entry = position.get('entry_price') or position['notional'] / (position['contracts']
+                                                                            * exposure.contract_size)
+            contracts, _ = held.get(position['symbol'], (0.0, 0.0))
+            held[position['symbol']] = (contracts + sign * position['contracts'], entry)
+        for symbol, exposure in self.symbols.items():
+            exposure.position, exposure.entry = held.get(symbol, (0.0, 0.0))
+            self._recount(exposure)
+
+    def set_leverage(self, symbol, leverage):
+        exposure = self.exposure(symbol)
+        if exposure.leverage != leverage:
+            exposure.leverage = leverage
+            self._recount(exposure)
+
+    def track(self, symbol, levels):
+        """Count the resting orders of levels just placed, replacing their reservations"""
+        exposure = self.exposure(symbol)
+        for level in levels:
+            exposure.remove(('reserved', id(level)))
+            order = level.get('order')
+            if level.get('status') == 'open' and order and order.get('id'):
+                exposure.add(order['id'], level['type'], level['size'], level['price'])
+        self._recount(exposure)
+
+    def forget(self, symbol, order_ids):
+        """Stop counting orders that were cancelled or are no longer managed"""
+        exposure = self.exposure(symbol)
+        for order_id in order_ids:
+            exposure.remove(order_id)
+        self._recount(exposure)
+
+    def fill(self, symbol, level):
+        """A level's order filled completely: its amount moves from the resting orders to the position"""
+        exposure = self.exposure(symbol)
+        order_id = (level.get('order') or {}).get('id')
+        if order_id is not None:
+            exposure.remove(order_id)
+        exposure.trade(level['type'], level['size'], level['price'])
+        self._recount(exposure)
+
+    # Checks
+
+    def breach(self, symbol, side, contracts, price):
+        """Why one more order would break a limit, or None if it fits"""
+        if self.equity is None:
+            return "no account figures yet"
+        exposure = self.exposure(symbol)
+        buys, buy_cost, sells, sell_cost = exposure.buys, exposure.buy_cost, exposure.sells, exposure.sell_cost
+        if side == 'buy':
+            buys, buy_cost = buys + contracts, buy_cost + contracts * price
+        else:
+            sells, sell_cost = sells + contracts, sell_cost + contracts * price
+        (long_, long_cost), (short, short_cost) = exposure.worst_case(buys, buy_cost, sells, sell_cost)
+        value = max(exposure.notional(long_, long_cost), exposure.notional(short, short_cost))
+        margin = value / exposure.leverage
+
+        if self.max_symbol_notional is not None and value > self.max_symbol_notional:
+            return f"{symbol} exposure {value:.2f} over its limit of {self.max_symbol_notional:.2f}"
+        total = self.total_value - exposure.value + value
+        if self.max_total_notional is not None and total > self.max_total_notional:
+            return f"total exposure {total:.2f} over its limit of {self.max_total_notional:.2f}"
+        if self.max_leverage is not None and total > self.max_leverage * self.equity:
+            return f"total exposure {total:.2f} over {self.max_leverage:g}x equity of {self.equity:.2f}"
+        other_margin = self.total_margin - exposure.margin
+        free = self.equity * (1 - self.margin_buffer) - other_margin
+        if margin > free:
+            return f"needs {margin:.2f} initial margin with {max(free, 0.0):.2f} free"
+
+        # Margin held by other symbols is not there to absorb this symbol's losses
+        backing = self.equity - other_margin
+        lowest, highest = exposure.extremes()
+        if side == 'buy':
+            furthest = price if lowest is None else min(lowest, price)
+            liquidation = exposure.liquidation('long', long_, long_cost, backing, self.maintenance_margin)
+            if liquidation is not None and liquidation >= furthest * (1 - self.liquidation_buffer):
+                return f"a full fill down to {furthest:.2f} would liquidate at {liquidation:.2f}"
+        else:
+            furthest = price if highest is None else max(highest, price)
+            liquidation = exposure.liquidation('short', short, short_cost, backing, self.maintenance_margin)
+            if liquidation is not None and liquidation <= furthest * (1 + self.liquidation_buffer):
+                return f"a full fill up to {furthest:.2f} would liquidate at {liquidation:.2f}"
+        return None
+
+    def _fitting_size(self, symbol, side, size, price):
+        """Largest amount under size that passes every check, rounded down to the lot; 0 if none does"""
+        low, high = 0.0, size
+        for _ in range(DOWNSIZE_STEPS):
+            middle = (low + high) / 2
+            if self.breach(symbol, side, middle, price) is None:
+                low = middle
+            else:
+                high = middle
+        market = self.precision(symbol) if self.precision else None
+        if market is None:
+            return low
+        low = float(market.round_amounts(np.float64(low)))
+        if market.min_amount and low < market.min_amount:
+            return 0.0
+        if market.min_cost and market.notional(low, price) < market.min_cost:
+            return 0.0
+        return low
+
+    def check(self, symbol, levels, leverage=None):
+        """Check levels about to be placed; returns those that may go out, possibly downsized.
+
+        Accepted levels are reserved straight away, so concurrent checks see
+        them before they are placed; track() swaps the reservations for the
+        orders. Blocked levels get status 'blocked' and the reason as
+        their error.
+        """
+        if leverage is not None:
+            self.set_leverage(symbol, leverage)
+        exposure = self.exposure(symbol)
+        accepted = []
+        # Levels nearest the market fill first, so they get the room first
+        for level in sorted(levels, key=lambda level: -level['price'] if level['type'] == 'buy' else level['price']):
+            side, size, price = level['type'], level['size'], level['price']
+            reason = self.breach(symbol, side, size, price)
+            if reason is not None and self.action == 'downsize' and self.equity is not None:
+                fitting = self._fitting_size(symbol, side, size, price)
+                if fitting > 0:
+                    if level.get('notional') is not None:
+                        level['notional'] *= fitting / size
+                    level['size'] = size = fitting
+                    self.downsized += 1
+                    reason = None
+            if reason is not None:
+                level.update({'order': None, 'status': 'blocked', 'error': f"Risk limit: {reason}"})
+                self.blocked += 1
+                continue
+            exposure.add(('reserved', id(level)), side, size, price)
+            accepted.append(level)
+        self._recount(exposure)
+        # Keep the caller's order
+        accepted_ids = {id(level) for level in accepted}
+        return [level for level in levels if id(level) in accepted_ids]
+
+    def snapshot(self):
+        """Worst case exposure per symbol and in total"""
+        symbols = {}
+        for symbol, exposure in self.symbols.items():
+            (long_, long_cost), (short, short_cost) = exposure.worst_case(exposure.buys, exposure.buy_cost,
+                                                                          exposure.sells, exposure.sell_cost)
+            backing = None if self.equity is None else self.equity - (self.total_margin - exposure.margin)
+            symbols[symbol] = {
+                'position': exposure.position,
+                'entry': exposure.entry,
+                'open_buys': exposure.buys,
+                'open_sells': exposure.sells,
+                'worst_notional': exposure.value,
+                'margin': exposure.margin,
+                'long_liquidation': None if backing is None else exposure.liquidation(
+                    'long', long_, long_cost, backing, self.maintenance_margin),
+                'short_liquidation': None if backing is None else exposure.liquidation(
+                    'short', short, short_cost, backing, self.maintenance_margin)
+            }
+        return {
+            'equity': self.equity,
+            'total_notional': self.total_value,
+            'total_margin': self.total_margin,
+            'blocked': self.blocked,
+            'downsized': self.downsized,
+            'symbols': symbols
+        }
@@ -0,0 +1,152 @@
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_JOURNAL = 'grid_state.db'
+
+
+def journal_level(level):
+    """The part of a level worth persisting: its shape and the order that backs it"""
+    order = level.get('order') or {}
+    return {
+        'price': level['price'],
+        'size': level['size'],
+        'type': level['type'],
+        'status': level.get('status'),
+        'order_id': order.get('id'),
+        'order_ts': order.get('timestamp'),
+        'counter_of': level.get('counter_of'),
+        'exit': level.get('exit')
+    }
+
+
+class StateJournal:
+    """Append-only SQLite (WAL) journal of grid definitions, order ids and fills.
+
+    Every change is one small insert, so a crash loses at most the event
+    being written. replay() folds the events back into the last known state
+    of each running grid, and compact() rewrites the journal as one snapshot
+    per grid so replay stays fast.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " ts REAL NOT NULL,"
+            " grid_id TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def bind_account(self, account):
+        """Tie the journal to one exchange account; False if it already belongs to another"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'account'").fetchone()
+            if row is not None and row[0] != account:
+                has_events = self._db.execute("SELECT 1 FROM events LIMIT 1").fetchone() is not None
+                if has_events:
+                    return False
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('account', ?)", (account,))
+        return True
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _append(self, grid_id, kind, payload):
+        with self._lock:
+            self._db.execute("INSERT INTO events (ts, grid_id, kind, payload) VALUES (?, ?, ?, ?)",
+                             (time.time(), grid_id, kind, json.dumps(payload)))
+
+    def _grid_payload(self, grid):
+        return {
+            'symbol': grid.symbol,
+            'leverage': grid.leverage,
+            'grid_step': grid.grid_step,
+            'take_profit': grid.take_profit,
+            'levels': [journal_level(level) for level in grid.levels]
+        }
+
+    def grid_started(self, grid):
+        """Record a grid and its whole ladder once its orders are placed"""
+        self._append(grid.grid_id, 'grid', self._grid_payload(grid))
+
+    def grid_updated(self, grid):
+        """Record the ladder of a grid after it was reconciled onto new levels"""
+        self._append(grid.grid_id, 'grid', self._grid_payload(grid))
+
+    def fill(self, grid, level, counter):
+        """Record a filled level together with the counter order placed for it"""
+        self._append(grid.grid_id, 'fill', {
+            'order_id': (level.get('order') or {}).get('id'),
+            'price': level['price'],
+            'size': level['size'],
+            'type': level['type'],
+            'counter': journal_level(counter)
+        })
+
+    def grid_removed(self, grid_id):
+        self._append(grid_id, 'removed', {})
+
+    def replay(self):
+        """Fold the journal into {grid_id: state} for every grid that was still running.
+
+        Each state holds symbol, leverage, grid_step, take_profit, levels,
+        fills (in order) and updated_at, the time of the grid's last event.
+        """
+        grids = {}
+        positions = {}  # grid id -> {order id: index of its level}
+        with self._lock:
+            rows = self._db.execute("SELECT ts, grid_id, kind, payload FROM events ORDER BY seq").fetchall()
+
+        for ts, grid_id, kind, payload in rows:
+            payload = json.loads(payload)
+            if kind == 'grid':
+                fills = grids.get(grid_id, {}).get('fills', [])
+                grids[grid_id] = dict(payload, fills=fills, updated_at=ts)
+                positions[grid_id] = {level['order_id']: i for i, level in enumerate(payload['levels'])
+                                      if level['order_id'] is not None}
+            elif kind == 'fill' and grid_id in grids:
+                # As in the engine, the counter takes the place of the level it closes
+                state, index = grids[grid_id], positions[grid_id]
+                counter = payload['counter']
+                i = index.pop(payload['order_id'], None)
+                if i is None:
+                    i = len(state['levels'])
+                    state['levels'].append(counter)
+                else:
+                    state['levels'][i] = counter
+                if counter['order_id'] is not None:
+                    index[counter['order_id']] = i
+                state['fills'].append(dict(payload, ts=ts))
+                state['updated_at'] = ts
+            elif kind == 'removed':
+                grids.pop(grid_id, None)
+                positions.pop(grid_id, None)
+        return grids
+
+    def compact(self):
+        """Replace the history with one snapshot event per running grid"""
+        grids = self.replay()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM events")
+                for grid_id, state in grids.items():
+                    snapshot = {key: state[key] for key in ('symbol', 'leverage', 'grid_step', 'take_profit')}
+                    snapshot['levels'] = [level for level in state['levels']
+                                          if level['status'] in ('open', 'pending')]
+                    self._db.execute("INSERT INTO events (ts, grid_id, kind, payload) VALUES (?, ?, ?, ?)",
+                                     (state['updated_at'], grid_id, 'grid', json.dumps(snapshot)))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return len(grids)
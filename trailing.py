@@ -0,0 +1,208 @@
+import asyncio
+import math
+import time
+
+from metrics import METRICS
+
+TRAIL_MODES = ('trail', 'recenter')
+
+# Ladders whose step ratios differ by more than this are not geometric
+GEOMETRIC_TOLERANCE = 1e-3
+
+
+def parse_trailing(raw):
+    """Trailing settings from a grid config value: true, or {'mode', 'threshold', 'debounce'}"""
+    if not raw:
+        return None
+    if raw is True:
+        raw = {}
+    settings = {
+        'mode': raw.get('mode', 'trail'),
+        'threshold': float(raw.get('threshold', 1.0)),
+        'debounce': float(raw.get('debounce', 10.0))
+    }
+    if settings['mode'] not in TRAIL_MODES:
+        raise ValueError(f"Trailing mode must be one of {', '.join(TRAIL_MODES)}")
+    if settings['threshold'] <= 0:
+        raise ValueError("Trailing threshold must be positive")
+    if settings['debounce'] < 0:
+        raise ValueError("Trailing debounce cannot be negative")
+    return settings
+
+
+def entry_ladder(levels):
+    """Plain copies of a grid's entry levels, lowest price first"""
+    return sorted(({key: level[key] for key in ('price', 'size', 'type', 'exit', 'notional') if key in level}
+                   for level in levels if level.get('counter_of') is None), key=lambda level: level['price'])
+
+
+class GridTrailer:
+    """Shift a running grid along with the price once it leaves the grid's range.
+
+    Prices come from on_price(), fed by the symbol's streamed book or by a
+    recorded path. Once the price has been at least threshold steps past an
+    edge for debounce seconds, the ladder moves by whole steps: 'trail'
+    just far enough that the edge level is back next to the price,
+    'recenter' until the price sits mid-ladder. Levels the old and new
+    ladder share are left untouched by the reconciler, so a shift only
+    cancels the levels that fall off one edge and places the ones added at
+    the other. Shifts are at least debounce seconds apart.
+
+    Arithmetic grids move by grid_step, geometric grids by their ratio.
+    """
+
+    def __init__(self, manager, grid, mode='trail', threshold=1.0, debounce=10.0, round_price=None, log=None,
+                 clock=time.monotonic):
+        self.manager = manager
+        self.grid = grid
+        self.mode = mode
+        self.threshold = threshold
+        self.debounce = debounce
+        self.round_price = round_price  # rounds extrapolated prices to the market tick
+        self.log = log or print
+        self.clock = clock
+        self.ladder = []
+        self.ratio = None
+        self.follow(grid.levels, grid.grid_step)
+
+        self.shifts = 0
+        self.requests = 0  # exchange requests spent on shifts
+        self.out_of_range = 0.0  # seconds the price spent more than a step beyond either edge
+        self._out_since = None  # when the price first crossed the threshold
+        self._last_seen = None  # (time, outside) of the previous price
+        self._last_shift = None
+        self._task = None
+
+    def follow(self, levels, grid_step=None):
+        """Take the entry ladder of levels as the one to shift from now on"""
+        ladder = entry_ladder(levels)
+        if len(ladder) < 2:
+            raise ValueError("Trailing needs at least two grid levels")
+        self.grid_step = grid_step
+        if grid_step is None:
+            ratios = [b['price'] / a['price'] for a, b in zip(ladder, ladder[1:])]
+            self.ratio = (ladder[-1]['price'] / ladder[0]['price']) ** (1 / (len(ladder) - 1))
+            if max(abs(ratio / self.ratio - 1) for ratio in ratios) > GEOMETRIC_TOLERANCE:
+                raise ValueError("Trailing needs an arithmetic or geometric grid")
+        self.ladder = ladder
+
+    def _move(self, price, steps):
+        if self.grid_step is not None:
+            moved = price + steps * self.grid_step
+        else:
+            moved = price * self.ratio ** steps
+        return self.round_price(moved) if self.round_price else moved
+
+    def position(self, price):
+        """Where price sits on the ladder in steps: 0 at the lowest level, len - 1 at the highest"""
+        low = self.ladder[0]['price']
+        if self.grid_step is not None:
+            return (price - low) / self.grid_step
+        return math.log(price / low) / math.log(self.ratio)
+
+    def steps_for(self, price):
+        """Whole steps to shift the ladder by for price; 0 while it is within the threshold"""
+        top = len(self.ladder) - 1
+        position = self.position(price)
+        if -self.threshold < position < top + self.threshold:
+            return 0
+        if self.mode == 'recenter':
+            return round(position - top / 2)
+        if position > top:
+            return max(1, math.floor(position - top))
+        return min(-1, math.ceil(position))
+
+    def shifted(self, steps):
+        """The ladder moved by steps; levels on prices the ladder already has are reused as they are"""
+        count = len(self.ladder)
+        levels = []
+        for index in range(steps, steps + count):
+            if 0 <= index < count:
+                levels.append(dict(self.ladder[index]))
+                continue
+            edge = self.ladder[-1] if index >= count else self.ladder[0]
+            offset = index - (count - 1) if index >= count else index
+            price = self._move(edge['price'], offset)
+            level = dict(edge, price=price)
+            if edge.get('exit') is not None:
+                level['exit'] = self._move(edge['exit'], offset)
+            if edge.get('notional') is not None:
+                level['notional'] = edge['notional'] * price / edge['price']
+            levels.append(level)
+        return levels
+
+    def on_book(self, book):
+        mid = book.mid()
+        if mid is not None:
+            self.on_price(mid)
+
+    def on_price(self, price, now=None):
+        """Account for a new price; returns the shift task when one was started"""
+        now = self.clock() if now is None else now
+        # Within a step of an edge the nearest level is still a step away, so the grid is working
+        top = len(self.ladder) - 1
+        position = self.position(price)
+        outside = position < -1 or position > top + 1
+        if self._last_seen is not None and self._last_seen[1]:
+            self.out_of_range += now - self._last_seen[0]
+        self._last_seen = (now, outside)
+
+        steps = self.steps_for(price)
+        if not steps:
+            self._out_since = None
+            return None
+        if self._out_since is None:
+            self._out_since = now
+        if now - self._out_since < self.debounce:
+            return None
+        if self._last_shift is not None and now - self._last_shift < self.debounce:
+            return None
+        if self._task is not None and not self._task.done():
+            return None
+        self._last_shift = now
+        self._out_since = None
+        self._task = asyncio.ensure_future(self.shift(steps, price))
+        return self._task
+
+    async def shift(self, steps, price=None):
+        """Move the running grid by steps through the manager's reconciler"""
+        start = time.perf_counter()
+        try:
+            grid, summary = await self.manager.update_grid(self.grid.grid_id, self.shifted(steps),
+                                                           self.grid.leverage, grid_step=self.grid.grid_step,
+                                                           take_profit=self.grid.take_profit)
+        except Exception as e:
+            METRICS.inc('grid_shift_errors_total')
+            self.log(f"Error shifting grid {self.grid.grid_id}: {str(e)}")
+            return None
+        # The open order fetch before reconciling is one more request
+        requests = summary['requests'] + 1
+        self.shifts += 1
+        self.requests += requests
+        METRICS.observe('grid_shift_seconds', time.perf_counter() - start)
+        METRICS.inc('grid_shifts_total')
+        METRICS.inc('grid_shift_requests_total', requests)
+        METRICS.set('grid_out_of_range_seconds', round(self.out_of_range, 3), grid=self.grid.grid_id)
+        where = f" at {price:.2f}" if price is not None else ''
+        self.log(f"Shifted grid {self.grid.grid_id} by {steps} steps{where}: {summary['cancelled']} cancelled, "
+                 f"{summary['created']} created, {requests} requests")
+        return summary
+
+    async def wait(self):
+        """Wait for a shift in flight, if any"""
+        task = self._task
+        if task is not None:
+            await asyncio.shield(task)
+
+    def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+
+    def stats(self):
+        return {
+            'shifts': self.shifts,
+            'requests': self.requests,
+            'requests_per_shift': self.requests / self.shifts if self.shifts else None,
+            'out_of_range_seconds': self.out_of_range
+        }